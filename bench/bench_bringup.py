@@ -0,0 +1,67 @@
+# Host side benchmark of the wakeup bring up, run on the simulator (sim
+# package): the network (wifi association in boot.py, broker connect) and the
+# gps one after the other (ConfigNetwork.CONCURRENT_BRINGUP = False, as
+# before) and at the same time. The tracker (main.py) runs wake cycles with
+# a few rides. Reports, for the accelerometer wakeups, the time from the
+# wakeup to the alert and to the first location the broker gets, and the
+# time awake
+# usage: python bench/bench_bringup.py [max wakes]
+# author: callen
+#
+
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator  # noqa: E402
+
+RIDES = [(70, 250), (600, 700), (1500, 1800), (2400, 2450), (3300, 3500)]
+DURATION = 4000
+ALERT_TOPIC = '/motorcycle/accelWakeup'
+LOCATION_TOPIC = '/motorcycle/location'
+# WAKE_REASON_ACCELEROMETER of the Pytrack
+ACCELEROMETER = 1
+# No EPO server answers on the simulated broker, a download would wait out ConfigGPS.EPO_DOWNLOAD_TIMEOUT
+CONFIG = {'ConfigGPS.EPO_REFRESH_HOURS': 0}
+
+
+def first(record, topic):
+    times = [m.time - record.start for m in record.published if m.topic == topic]
+    return min(times) if times else None
+
+
+def mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else float('nan')
+
+
+def run(concurrent, wakes):
+    config = dict(CONFIG)
+    config['ConfigNetwork.CONCURRENT_BRINGUP'] = concurrent
+    sim = Simulator(motion=RIDES, config=config)
+    with contextlib.redirect_stdout(io.StringIO()):
+        records = sim.run(wakes=wakes, until=DURATION)
+    alerts = [r for r in records if r.reason == ACCELEROMETER]
+    return (len(alerts), mean(first(r, ALERT_TOPIC) for r in alerts), mean(first(r, LOCATION_TOPIC) for r in alerts),
+            mean(r.awake for r in records), len(sim.broker.messages))
+
+
+def main(argv):
+    wakes = int(argv[1]) if len(argv) > 1 else 1000
+    print("{} simulated seconds, rides at {}".format(DURATION, ', '.join('{}-{} s'.format(*ride) for ride in RIDES)))
+    print("{:<12} {:>12} {:>9} {:>12} {:>9} {:>10}".format('bring up', 'accel wakes', 'alert s', 'location s',
+                                                          'awake s', 'published'))
+    results = {}
+    for name, concurrent in (('sequential', False), ('concurrent', True)):
+        results[name] = run(concurrent, wakes)
+        print("{:<12} {:12} {:9.2f} {:12.2f} {:9.2f} {:10}".format(name, *results[name]))
+    print("concurrent: first location {:.2f} s sooner per accelerometer wakeup".format(
+        results['sequential'][2] - results['concurrent'][2]))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,55 @@
+# Host side benchmark of the broker address cache (lib/resolver.py), run on the
+# simulator (sim package) with an LTE-M like round trip and DNS time.
+# The tracker (main.py) runs wake cycles with a few short rides, once looking
+# the broker up on every connect (ConfigMqtt.DNS_TTL = 0, as before the cache)
+# and once with the cache. Reports the time from the wakeup to the first
+# PUBLISH the broker gets (the accelerometer alert on the wakeups of a ride),
+# DNS lookups and bytes on the wire
+# usage: python bench/bench_broker_dns.py [wakes]
+# author: callen
+#
+
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator, NetModel  # noqa: E402
+
+RTT = 0.6
+DNS_TIME = 1.2
+RIDES = [(70, 250), (3000, 3200), (9000, 9150), (20000, 20300)]
+ALERT_TOPIC = '/motorcycle/accelWakeup'
+
+
+def run(ttl, wakes):
+    sim = Simulator(motion=RIDES, net=NetModel(rtt=RTT, dns_time=DNS_TIME), config={'ConfigMqtt.DNS_TTL': ttl})
+    with contextlib.redirect_stdout(io.StringIO()):
+        records = sim.run(wakes=wakes)
+    # The first wake (power on) is the same for both
+    records = [r for r in records[1:] if r.published]
+    first = [r.published[0].time - r.start for r in records]
+    alerts = [r.published[0].time - r.start for r in records if r.published[0].topic == ALERT_TOPIC]
+    return first, alerts, sim.stats
+
+
+def main(argv):
+    wakes = int(argv[1]) if len(argv) > 1 else 40
+    print("{} wakes, {} ms round trip, {} ms DNS lookup".format(wakes, int(RTT * 1000), int(DNS_TIME * 1000)))
+    print("{:<10} {:>8} {:>17} {:>15} {:>12} {:>10}".format('resolver', 'wakes', 'first publish s', 'alert s',
+                                                            'dns lookups', 'wire B'))
+    results = {}
+    for name, ttl in (('every', 0), ('cached', 86400)):
+        first, alerts, stats = run(ttl, wakes)
+        results[name] = sum(first) / len(first)
+        print("{:<10} {:8} {:17.2f} {:15.2f} {:12} {:10}".format(name, len(first), results[name],
+                                                                 sum(alerts) / max(len(alerts), 1),
+                                                                 stats['dns_lookups'], stats['wire_bytes']))
+    print("cached: first publish {:.2f} s sooner per wakeup".format(results['every'] - results['cached']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,110 @@
+# Host side benchmark of batched locations (lib/location.py version 2) against
+# one publish per fix (version 1)
+# Encoding: 60 fix segments of the recorded ride, one fix every STRIDE epochs,
+# bytes of the payloads and of the MQTT PUBLISH packets. Exact round trip of
+# every fix through the server decoder is checked.
+# Ride: the tracker (main.py on the simulator) tracks a one hour ride with each
+# format (a fix every SLEEP_BETWEEN_READS plus the time awake), reports bytes on the wire (with the IP / TCP headers, handshakes and
+# DNS), TCP connects and radio busy seconds spent on the broker (the wifi
+# association of boot.py is the same for both)
+# usage: python bench/bench_location_batch.py [capture.nmea]
+# author: callen
+#
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'lib'))
+
+import location  # noqa: E402
+from bench_location_payload import epochs, publish_size, DEFAULT_CAPTURE  # noqa: E402
+from sim import Simulator  # noqa: E402
+
+SEGMENT = 60
+STRIDES = (1, 5)
+TOPIC = '/motorcycle/location'
+# Tracking fix interval of the simulated ride (ConfigGPS.SLEEP_BETWEEN_READS) and its duration
+RIDE_INTERVAL = 60
+RIDE_FIXES = 60
+
+
+def segments(states, stride):
+    fixes = [location.encode_state(state) for state in states[::stride]]
+    return [fixes[i:i + SEGMENT] for i in range(0, len(fixes) - SEGMENT + 1, SEGMENT)]
+
+
+def encoding(states):
+    print("{:>6} {:>9} {:>16} {:>16} {:>14} {:>8}".format('stride', 'segments', 'per fix B (pkt)', 'batch B (pkt)',
+                                                          'B/fix batched', 'ratio'))
+    for stride in STRIDES:
+        single = batched = single_packets = batched_packets = 0
+        found = segments(states, stride)
+        for fixes in found:
+            payload = location.encode_batch(fixes)
+            assert location.decode_batch(payload) == [location.decode(fix) for fix in fixes]
+            single += sum(len(fix) for fix in fixes)
+            single_packets += sum(publish_size(fix) for fix in fixes)
+            batched += len(payload)
+            batched_packets += publish_size(payload)
+        n = len(found)
+        print("{:6} {:9} {:9.0f} ({:4.0f}) {:9.0f} ({:4.0f}) {:14.1f} {:7.1f}x".format(
+            stride, n, single / n, single_packets / n, batched / n, batched_packets / n, batched / n / SEGMENT,
+            single_packets / batched_packets))
+
+
+def ride(fmt):
+    '''
+    a ride of RIDE_FIXES fixes on the simulator with the locations published in fmt:
+    (fixes, messages, stats) from the accelerometer wakeup to the location sent after the ride
+    '''
+    start = 70
+    end = start + RIDE_INTERVAL * RIDE_FIXES
+    sim = Simulator(motion=[(start, end)],
+                    config={'ConfigMqtt.LOCATION_FORMATS': {TOPIC: fmt},
+                            'ConfigMqtt.BATCH_MAX_FIXES': RIDE_FIXES + 1,
+                            'ConfigMqtt.BATCH_MAX_SECONDS': RIDE_INTERVAL * (RIDE_FIXES + 1)})
+    before = None
+    while not any(m.time > end for m in sim.broker.published(TOPIC)):
+        if before is None and sim.clock.now >= start:
+            before = dict(sim.stats)
+            sent = len(sim.broker.published(TOPIC))
+        sim.run(wakes=1)
+    stats = {name: value - before.get(name, 0) for name, value in sim.stats.items()}
+    messages = sim.broker.published(TOPIC)[sent:]
+    fixes = sum(len(location.decode_any(m.payload)) for m in messages)
+    return fixes, len(messages), stats
+
+
+def rides():
+    import contextlib
+    import io
+    print("{:<8} {:>6} {:>9} {:>12} {:>13} {:>14}".format('format', 'fixes', 'messages', 'wire B', 'tcp connects',
+                                                          'radio busy s'))
+    results = {}
+    for fmt in (location.FORMAT_BINARY, location.FORMAT_BATCH):
+        with contextlib.redirect_stdout(io.StringIO()):
+            fixes, messages, stats = ride(fmt)
+        results[fmt] = stats
+        print("{:<8} {:6} {:9} {:12} {:13} {:14.2f}".format(fmt, fixes, messages, stats['wire_bytes'],
+                                                            stats['tcp_connects'], stats['radio_seconds']))
+    single, batched = results[location.FORMAT_BINARY], results[location.FORMAT_BATCH]
+    print("batched: {:.1f}x fewer bytes on the wire, {:.1f}x fewer radio busy seconds".format(
+        single['wire_bytes'] / batched['wire_bytes'], single['radio_seconds'] / batched['radio_seconds']))
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CAPTURE
+    with open(path, 'rb') as f:
+        states = epochs(f.read())
+    print("{} fixed epochs, segments of {} fixes".format(len(states), SEGMENT))
+    encoding(states)
+    print()
+    print("ride of {} s, from the accelerometer wakeup to the location sent after it".format(
+        RIDE_INTERVAL * RIDE_FIXES))
+    rides()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Host side benchmark of the location payload published on TOPIC_GPS
+# Builds the fixed epochs of a recorded L76 capture with nmea.FixState and
+# encodes each of them as the legacy str(dict), as json and with the binary
+# format of lib/location.py. Reports payload and MQTT PUBLISH sizes, encode
+# and decode times (CPython, compare the ratios rather than the absolute values)
+# usage: python bench/bench_location_payload.py [capture.nmea]
+# author: callen
+#
+
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lib'))
+
+import location  # noqa: E402
+from nmea import NMEAStream, FixState, EPOCH_TYPES, parse  # noqa: E402
+
+DEFAULT_CAPTURE = os.path.join(ROOT, 'bench', 'captures', 'l76_ride.nmea')
+TOPIC = '/motorcycle/location'
+ROUNDS = 20
+
+
+def epochs(capture):
+    """snapshot copies of the complete, valid epochs of a capture"""
+    stream = NMEAStream(size=4096)
+    state = FixState()
+    found = []
+    for i in range(0, len(capture), 255):
+        stream.feed(capture[i:i + 255])
+        while True:
+            sentence = stream.next_sentence()
+            if sentence is None:
+                break
+            if bytes(sentence[2:5]).decode() not in EPOCH_TYPES:
+                continue
+            if state.update(parse(sentence)) and state.valid:
+                snapshot = FixState()
+                for name in FixState.__slots__:
+                    setattr(snapshot, name, getattr(state, name))
+                found.append(snapshot)
+    return found
+
+
+def legacy(state):
+    # What monitorLocation published before: str() of the coordinates() dict
+    return str(dict(latitude=state.latitude, longitude=state.longitude, ttf=0)).encode()
+
+
+def as_json(state):
+    return json.dumps(dict(latitude=state.latitude, longitude=state.longitude, ttf=0,
+                           time=location.unix_time(state.date, state.utc))).encode()
+
+
+def binary(state):
+    return location.encode_state(state)
+
+
+def publish_size(payload):
+    """bytes of the QoS 1 PUBLISH packet carrying the payload"""
+    size = 2 + len(TOPIC) + 2 + len(payload)
+    return 1 + (1 if size < 128 else 2) + size
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for item in items:
+            function(item)
+    return (time.perf_counter() - start) / (ROUNDS * len(items)) * 1e6
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CAPTURE
+    with open(path, 'rb') as f:
+        states = epochs(f.read())
+    print("{} fixed epochs".format(len(states)))
+    print("{:<8} {:>10} {:>12} {:>12} {:>12}".format('format', 'payload B', 'PUBLISH B', 'encode us', 'decode us'))
+    buf = bytearray(location.SIZE)
+    for name, encoder, decoder in (('legacy', legacy, None), ('json', as_json, json.loads),
+                                   ('binary', binary, location.decode)):
+        payloads = [encoder(state) for state in states]
+        size = sum(len(p) for p in payloads) / len(payloads)
+        packet = sum(publish_size(p) for p in payloads) / len(payloads)
+        encode_us = timed(encoder, states)
+        decode_us = '{:.2f}'.format(timed(decoder, payloads)) if decoder is not None else '-'
+        print("{:<8} {:10.1f} {:12.1f} {:12.2f} {:>12}".format(name, size, packet, encode_us, decode_us))
+    encode_into_us = timed(lambda state: location.encode_state(state, buf=buf), states)
+    print("{:<8} {:>10} {:>12} {:12.2f} {:>12}".format('into buf', '', '', encode_into_us, ''))
+
+    # The server must get back what was encoded
+    for state in states:
+        decoded = location.decode(location.encode_state(state))
+        assert abs(decoded['latitude'] - state.latitude) < 1e-6
+        assert abs(decoded['longitude'] - state.longitude) < 1e-6
+
+
+if __name__ == '__main__':
+    main()
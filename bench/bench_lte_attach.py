@@ -0,0 +1,50 @@
+# Host side benchmark of the lte bring up (lib/ltesession.py), run on the
+# simulator (sim package) with its scripted Sequans modem: the tracker
+# (main.py) on lte for a number of wake cycles, with the modem detaching
+# before every deep sleep and kept registered in power saving mode
+# (ConfigLTE.PSM). Reports the attach latency the modem saw on the first
+# wakeup (provisioning it) and on the following ones, the AT commands sent
+# on the first wakeup and per following one, and the time awake
+# usage: python bench/bench_lte_attach.py [wakes]
+# author: callen
+#
+
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator  # noqa: E402
+
+
+def mean(values):
+    return sum(values) / len(values) if values else float('nan')
+
+
+def run(psm, wakes):
+    sim = Simulator(config={'ConfigNetwork.USE_LTE': True, 'ConfigLTE.PSM': psm})
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.run(wakes=1)
+        provisioning = len(sim.lte.commands)
+        records = sim.run(wakes=wakes - 1)
+    attaches = sim.lte.attaches
+    later = [seconds for start, seconds, kind in attaches[1:]]
+    kinds = sorted(set(kind for start, seconds, kind in attaches[1:]))
+    return (attaches[0][1], mean(later), '/'.join(kinds), provisioning,
+            (len(sim.lte.commands) - provisioning) / (len(records) - 1), mean([r.awake for r in records[1:]]))
+
+
+def main(argv):
+    wakes = int(argv[1]) if len(argv) > 1 else 20
+    print("{} wakeups on lte".format(wakes))
+    print("{:<10} {:>14} {:>14} {:>8} {:>9} {:>9} {:>9}".format('modem', 'first attach s', 'next attach s', 'kind',
+                                                                'first AT', 'next AT', 'awake s'))
+    for name, psm in (('detached', False), ('psm', True)):
+        print("{:<10} {:14.2f} {:14.2f} {:>8} {:9} {:9.1f} {:9.2f}".format(name, *run(psm, wakes)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,126 @@
+# Host side benchmark of a wake cycle with the blocking lib/mqtt.MQTTClient
+# versus lib/mqttasync.MQTTClientAsync, run on the simulator (sim package).
+# A cycle samples the accelerometer for motion (11 reads 0.5 s apart, like
+# Tracker.accelInMotion) and talks to the broker: connect, subscribe to the
+# tracking state, publish a heartbeat and a location with QoS 1, disconnect.
+# With the blocking client the broker round trips add up after the sampling,
+# with the async one they are in flight while the accelerometer is sampled.
+# Reports simulated wake time and socket writes per cycle for a wifi and an
+# LTE-M like round trip time
+# usage: python bench/bench_mqtt_async.py [cycles]
+# author: callen
+#
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator, NetModel  # noqa: E402
+
+SAMPLES = 10
+SAMPLE_INTERVAL = 0.5
+LOCATION = b'{"lat": 42.35843, "lon": -71.05977}'
+NETWORKS = (('wifi', 0.08), ('lte-m', 0.6))
+
+
+def start(rtt):
+    sim = Simulator(net=NetModel(rtt=rtt)).install()
+    from network import WLAN
+    ap = sim.wifi.access_points[0]
+    WLAN().connect(ap.ssid, auth=(WLAN.WPA2, ap.password))
+    sim.clock.advance_to(sim.wifi.connected_at)
+    return sim
+
+
+def on_message(topic, msg):
+    pass
+
+
+def blocking_cycle(accel):
+    import time
+    from mqtt import MQTTClient
+    from config import ConfigMqtt
+
+    samples = [accel.acceleration()]
+    for _ in range(SAMPLES):
+        time.sleep(SAMPLE_INTERVAL)
+        samples.append(accel.acceleration())
+    client = MQTTClient(ConfigMqtt.CLIENT_ID, ConfigMqtt.SERVER, port=ConfigMqtt.PORT, user=ConfigMqtt.USER,
+                        password=ConfigMqtt.PASSWORD)
+    client.set_callback(on_message)
+    client.connect()
+    client.subscribe(topic=ConfigMqtt.TOPIC_TRACKING_STATE)
+    client.check_msg()
+    client.publish(topic=ConfigMqtt.TOPIC_HEARTBEAT, msg=b'1', qos=1)
+    client.publish(topic=ConfigMqtt.TOPIC_GPS, msg=LOCATION, qos=1)
+    client.disconnect()
+    return samples
+
+
+def async_cycle(accel):
+    import uasyncio as asyncio
+    from mqttasync import MQTTClientAsync
+    from config import ConfigMqtt
+
+    async def sample():
+        samples = [accel.acceleration()]
+        for _ in range(SAMPLES):
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            samples.append(accel.acceleration())
+        return samples
+
+    async def report():
+        client = MQTTClientAsync(ConfigMqtt.CLIENT_ID, ConfigMqtt.SERVER, port=ConfigMqtt.PORT,
+                                 user=ConfigMqtt.USER, password=ConfigMqtt.PASSWORD)
+        client.set_callback(on_message)
+        await client.connect()
+        await client.subscribe(topic=ConfigMqtt.TOPIC_TRACKING_STATE)
+        await client.check_msg()
+        await client.publish(topic=ConfigMqtt.TOPIC_HEARTBEAT, msg=b'1', qos=1)
+        await client.publish(topic=ConfigMqtt.TOPIC_GPS, msg=LOCATION, qos=1)
+        await client.disconnect()
+
+    async def cycle():
+        samples, _ = await asyncio.gather(sample(), report())
+        return samples
+
+    return asyncio.run(cycle())
+
+
+def run(cycle, rtt, cycles):
+    sim = start(rtt)
+    try:
+        from LIS2HH12 import LIS2HH12
+        accel = LIS2HH12()
+        delivered = len(sim.broker.messages)
+        writes = sim.stats['socket_writes']
+        began = sim.clock.now
+        for _ in range(cycles):
+            cycle(accel)
+        elapsed = (sim.clock.now - began) / cycles
+        writes = (sim.stats['socket_writes'] - writes) / cycles
+        delivered = (len(sim.broker.messages) - delivered) / cycles
+    finally:
+        sim.uninstall()
+    return elapsed, writes, delivered
+
+
+def main(argv):
+    cycles = int(argv[1]) if len(argv) > 1 else 20
+    print("{} cycles, {} accelerometer samples {} s apart".format(cycles, SAMPLES + 1, SAMPLE_INTERVAL))
+    print("{:8} {:9} {:>12} {:>14} {:>10}".format('network', 'client', 'wake (s)', 'socket writes', 'published'))
+    for name, rtt in NETWORKS:
+        results = {}
+        for label, cycle in (('blocking', blocking_cycle), ('async', async_cycle)):
+            results[label] = run(cycle, rtt, cycles)
+            elapsed, writes, delivered = results[label]
+            print("{:8} {:9} {:12.3f} {:14.1f} {:10.1f}".format(name, label, elapsed, writes, delivered))
+        saved = results['blocking'][0] - results['async'][0]
+        print("{:8} {:9} {:12.3f} ({:.0%} of the blocking wake)".format(name, 'saved', saved,
+                                                                     saved / results['blocking'][0]))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
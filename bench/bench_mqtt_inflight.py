@@ -0,0 +1,114 @@
+# Host side benchmark of flushing a backlog of positions with QoS 1 and 2
+# through lib/mqtt.MQTTClient at in-flight windows of 1, 8 and 32, run on the
+# simulator (sim package) with the round trip time of an LTE-M link.
+# Also drops the connection in the middle of a flush and reconnects, to check
+# the messages in flight are resent (DUP) and none is lost.
+# Reports simulated flush time, messages/sec and socket writes per message
+# usage: python bench/bench_mqtt_inflight.py [messages] [rtt seconds]
+# author: callen
+#
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator, NetModel  # noqa: E402
+
+WINDOWS = (1, 8, 32)
+TOPIC = '/motorcycle/location'
+
+
+def start(rtt):
+    sim = Simulator(net=NetModel(rtt=rtt)).install()
+    from network import WLAN
+    ap = sim.wifi.access_points[0]
+    WLAN().connect(ap.ssid, auth=(WLAN.WPA2, ap.password))
+    sim.clock.advance_to(sim.wifi.connected_at)
+    return sim
+
+
+def positions(count):
+    return [b'{"lat": 42.%05d, "lon": -71.05977, "ts": %d}' % (i, 1781791500 + i) for i in range(count)]
+
+
+def client(window):
+    from mqtt import MQTTClient
+    from config import ConfigMqtt
+    mqtt = MQTTClient(ConfigMqtt.CLIENT_ID, ConfigMqtt.SERVER, port=ConfigMqtt.PORT, user=ConfigMqtt.USER,
+                      password=ConfigMqtt.PASSWORD, max_inflight=window)
+    mqtt.set_callback(lambda topic, msg: None)
+    mqtt.connect(clean_session=False)
+    return mqtt
+
+
+def delivered(sim, backlog):
+    """(unique backlog messages the broker got, duplicates)"""
+    received = [m.payload for m in sim.broker.published(TOPIC)]
+    unique = set(received) & set(backlog)
+    return len(unique), len(received) - len(unique)
+
+
+def flush(window, qos, backlog, rtt):
+    sim = start(rtt)
+    try:
+        mqtt = client(window)
+        writes = sim.stats['socket_writes']
+        began = sim.clock.now
+        for msg in backlog:
+            mqtt.publish(TOPIC, msg, qos=qos)
+        mqtt.flush()
+        elapsed = sim.clock.now - began
+        writes = sim.stats['socket_writes'] - writes
+        mqtt.disconnect()
+        return elapsed, writes, delivered(sim, backlog)
+    finally:
+        sim.uninstall()
+
+
+def flush_with_drop(window, qos, backlog, rtt):
+    """drops the connection halfway, the client reconnects and resends what was in flight"""
+    sim = start(rtt)
+    try:
+        mqtt = client(window)
+        resent = 0
+        for i, msg in enumerate(backlog):
+            if i == len(backlog) // 2:
+                sim.broker.drop_connections()
+            try:
+                mqtt.publish(TOPIC, msg, qos=qos)
+            except OSError:
+                # The failed publish is in flight as well
+                resent += len(mqtt.inflight)
+                mqtt.connect(clean_session=False)
+        mqtt.flush()
+        mqtt.disconnect()
+        return resent, delivered(sim, backlog)
+    finally:
+        sim.uninstall()
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 200
+    rtt = float(argv[2]) if len(argv) > 2 else 0.6
+    backlog = positions(count)
+    print("{} messages, {} ms round trip".format(count, int(rtt * 1000)))
+    print("{:4} {:>7} {:>10} {:>9} {:>14} {:>10}".format('qos', 'window', 'flush (s)', 'msgs/s', 'writes/msg',
+                                                          'delivered'))
+    for qos in (1, 2):
+        for window in WINDOWS:
+            elapsed, writes, (unique, _) = flush(window, qos, backlog, rtt)
+            print("{:4} {:7} {:10.2f} {:9.1f} {:14.1f} {:10}".format(qos, window, elapsed, count / elapsed,
+                                                                   writes / count, unique))
+    print()
+    print("connection dropped halfway")
+    print("{:4} {:>7} {:>10} {:>10} {:>11}".format('qos', 'window', 'resent', 'delivered', 'duplicates'))
+    for qos in (1, 2):
+        for window in WINDOWS:
+            resent, (unique, duplicates) = flush_with_drop(window, qos, backlog, rtt)
+            print("{:4} {:7} {:10} {:10} {:11}".format(qos, window, resent, unique, duplicates))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
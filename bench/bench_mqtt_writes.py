@@ -0,0 +1,112 @@
+# Host side benchmark of the socket calls lib/mqtt.MQTTClient makes per packet,
+# against the stock Pycom umqtt client it replaced (the firmware copy under
+# .micropy), run on the simulator (sim package).
+# Counts socket writes, socket reads, payload bytes and bytes on the wire (with
+# the IP / TCP headers of each segment, a write is sent as a segment) for a
+# connect, a subscribe, publishes with QoS 0 and 1 and incoming messages
+# usage: python bench/bench_mqtt_writes.py [messages]
+# author: callen
+#
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator  # noqa: E402
+
+LEGACY = os.path.join(ROOT, '.micropy', 'GPy_v1_11', 'stubs', 'mqtt.py')
+TOPIC = '/motorcycle/location'
+STATE_TOPIC = '/motorcycle/track'
+LOCATION = b'{"lat": 42.35843, "lon": -71.05977}'
+COUNTERS = ('socket_writes', 'socket_reads', 'socket_bytes', 'wire_bytes')
+
+
+def start():
+    sim = Simulator().install()
+    from network import WLAN
+    ap = sim.wifi.access_points[0]
+    WLAN().connect(ap.ssid, auth=(WLAN.WPA2, ap.password))
+    sim.clock.advance_to(sim.wifi.connected_at)
+    return sim
+
+
+def client_class(name):
+    if name == 'umqtt':
+        spec = importlib.util.spec_from_file_location('mqtt_legacy', LEGACY)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.MQTTClient
+    from mqtt import MQTTClient
+    return MQTTClient
+
+
+class Meter:
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.results = []
+
+    def measure(self, operation, count, function):
+        before = dict(self.sim.stats)
+        function()
+        self.results.append((operation, {name: (self.sim.stats[name] - before.get(name, 0)) / count
+                                         for name in COUNTERS}))
+
+
+def run(name, count):
+    sim = start()
+    try:
+        from config import ConfigMqtt
+        received = []
+        cls = client_class(name)
+        mqtt = cls(ConfigMqtt.CLIENT_ID, ConfigMqtt.SERVER, port=ConfigMqtt.PORT, user=ConfigMqtt.USER,
+                   password=ConfigMqtt.PASSWORD)
+        mqtt.set_callback(lambda topic, msg: received.append(msg))
+        meter = Meter(sim)
+        meter.measure('connect', 1, mqtt.connect)
+        meter.measure('subscribe', 1, lambda: mqtt.subscribe(STATE_TOPIC))
+
+        def publish(qos):
+            for _ in range(count):
+                mqtt.publish(TOPIC, LOCATION, qos=qos)
+
+        def receive():
+            for i in range(count):
+                sim.broker.publish(STATE_TOPIC, b'%d' % (i & 1))
+                mqtt.wait_msg()
+
+        meter.measure('publish qos 0', count, lambda: publish(0))
+        meter.measure('publish qos 1', count, lambda: publish(1))
+        meter.measure('incoming', count, receive)
+        mqtt.disconnect()
+        assert len(received) == count
+        return meter.results
+    finally:
+        sim.uninstall()
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 50
+    results = {name: run(name, count) for name in ('umqtt', 'mqtt')}
+    print("{} messages, {} B location on {}".format(count, len(LOCATION), TOPIC))
+    print("{:<14} {:<7} {:>7} {:>7} {:>10} {:>8}".format('operation', 'client', 'writes', 'reads', 'payload B',
+                                                         'wire B'))
+    for i, (operation, _) in enumerate(results['mqtt']):
+        for name in ('umqtt', 'mqtt'):
+            stats = results[name][i][1]
+            print("{:<14} {:<7} {:7.1f} {:7.1f} {:10.1f} {:8.1f}".format(operation, name, stats['socket_writes'],
+                                                                      stats['socket_reads'],
+                                                                      stats['socket_bytes'],
+                                                                      stats['wire_bytes']))
+    legacy = results['umqtt'][3][1]
+    single = results['mqtt'][3][1]
+    print("qos 1 publish: {:.1f}x fewer syscalls, {:.1f}x fewer bytes on the wire".format(
+        (legacy['socket_writes'] + legacy['socket_reads']) / (single['socket_writes'] + single['socket_reads']),
+        legacy['wire_bytes'] / single['wire_bytes']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
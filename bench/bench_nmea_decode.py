@@ -0,0 +1,136 @@
+# Host side benchmark of NMEA sentence decoding in L76GNSV4
+# Compares the previous endswith() chain, which built a hash for every sentence,
+# with the table driven decoder that only decodes subscribed sentence types.
+# Runs over the mixed GN/GP/GL capture for the subscriptions the driver uses,
+# and shows the heap kept alive per decoded sentence (hash vs Fix record)
+# usage: python bench/bench_nmea_decode.py [capture.nmea]
+# author: callen
+#
+
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lib'))
+
+from nmea import NMEAStream, Subscription, parse, mixhash  # noqa: E402
+
+DEFAULT_CAPTURE = os.path.join(ROOT, 'bench', 'captures', 'l76_ride.nmea')
+# messagetype tuples as passed to _read_message by the driver
+SUBSCRIPTIONS = (
+    ('get_fix', ('RMC', 'VTG', 'GLL', 'GGA', 'GSA')),
+    ('coordinates', ('RMC', 'GGA', 'GLL')),
+    ('get_location', ('GGA',)),
+)
+
+
+def legacy_decode(nmea):
+    """the previous _decodeNMEA, keywords built per call and a hash for every type"""
+    nmea_sentence = nmea.split(',')
+    sentence = nmea_sentence[0]
+    if sentence.endswith('RMC'):
+        return mixhash(['NMEA', 'UTCTime', 'dataValid', 'Latitude', 'NS', 'Longitude', 'EW',
+                        'Speed', 'COG', 'Date', '', '', 'PositioningMode'], nmea_sentence)
+    if sentence.endswith('VTG'):
+        return mixhash(['NMEA', 'COG-T', 'T', 'COG-M', 'M', 'SpeedKnots', 'N', 'SpeedKm', 'K',
+                        'PositioningMode'], nmea_sentence)
+    if sentence.endswith('GGA'):
+        return mixhash(['NMEA', 'UTCTime', 'Latitude', 'NS', 'Longitude', 'EW',
+                        'FixStatus', 'NumberOfSV', 'HDOP',
+                        'Altitude', 'M', 'GeoIDSeparation', 'M', 'DGPSAge', 'DGPSStationID'], nmea_sentence)
+    if sentence.endswith('GSA'):
+        return mixhash(['NMEA', 'Mode', 'FixStatus',
+                        'SatelliteUsed01', 'SatelliteUsed02', 'SatelliteUsed03',
+                        'SatelliteUsed04', 'SatelliteUsed05', 'SatelliteUsed06',
+                        'SatelliteUsed07', 'SatelliteUsed08', 'SatelliteUsed09',
+                        'SatelliteUsed10', 'SatelliteUsed11', 'SatelliteUsed12',
+                        'PDOP', 'HDOP', 'VDOP'], nmea_sentence)
+    if sentence.endswith('GSV'):
+        return mixhash(['NMEA', 'NofMessage', 'SequenceNr', 'SatellitesInView',
+                        'SatelliteID1', 'Elevation1', 'Azimuth1', 'SNR1',
+                        'SatelliteID2', 'Elevation2', 'Azimuth2', 'SNR2',
+                        'SatelliteID3', 'Elevation3', 'Azimuth3', 'SNR3',
+                        'SatelliteID4', 'Elevation4', 'Azimuth4', 'SNR4'], nmea_sentence)
+    if sentence.endswith('GLL'):
+        return mixhash(['NMEA', 'Latitude', 'NS', 'Longitude', 'EW',
+                        'UTCTime', 'dataValid', 'PositioningMode'], nmea_sentence)
+    return None
+
+
+def bodies(capture):
+    """every sentence of the capture as tokenized by NMEAStream"""
+    stream = NMEAStream(size=len(capture) + 1)
+    stream.feed(capture)
+    out = []
+    while True:
+        sentence = stream.next_sentence()
+        if sentence is None:
+            return out
+        out.append(bytes(sentence))
+
+
+def run_legacy(sentences, kinds):
+    decoded = 0
+    for body in sentences:
+        # the old code decoded every sentence, then compared the type
+        msg = legacy_decode(body.decode('utf-8'))
+        if msg is not None and msg['NMEA'][2:] in kinds:
+            decoded += 1
+    return decoded
+
+
+def run_table(sentences, kinds):
+    subscription = Subscription(kinds)
+    decoded = 0
+    for body in sentences:
+        if subscription.wants(body):
+            # read a value like get_fix does, Fix records parse lazily
+            if parse(body).valid is not None:
+                decoded += 1
+    return decoded
+
+
+def rate(func, sentences, kinds, rounds=10):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decoded = func(sentences, kinds)
+    return decoded, len(sentences) * rounds / (time.perf_counter() - start)
+
+
+def retained(decoder, sentences):
+    """heap bytes kept alive per decoded sentence, values read once"""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    kept = []
+    for body in sentences:
+        msg = decoder(body)
+        if isinstance(msg, dict):
+            msg.get('Latitude')
+        else:
+            msg.latitude
+        kept.append(msg)
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return used / len(kept)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CAPTURE
+    with open(path, 'rb') as f:
+        sentences = bodies(f.read())
+    print("{} sentences in capture".format(len(sentences)))
+    print("{:<14} {:>9} {:>14} {:>14} {:>8}".format('subscription', 'decoded', 'before sent/s', 'after sent/s', 'speedup'))
+    for name, kinds in SUBSCRIPTIONS:
+        decoded, before = rate(run_legacy, sentences, kinds)
+        decoded_after, after = rate(run_table, sentences, kinds)
+        assert decoded == decoded_after
+        print("{:<14} {:>9} {:>14.0f} {:>14.0f} {:>7.1f}x".format(name, decoded, before, after, after / before))
+    fixes = [body for body in sentences if body[2:5] in (b'RMC', b'GGA')]
+    print("heap per RMC/GGA sentence: hash {:.0f} B, Fix record {:.0f} B".format(
+        retained(lambda body: legacy_decode(body.decode('utf-8')), fixes), retained(parse, fixes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Host side benchmark of the NMEA tokenizer used by L76GNSV4._read_message
+# Replays a recorded L76 capture in 255 byte I2C sized reads and compares the
+# old decode/split per read approach with lib/nmea.NMEAStream.
+# Reports sentences recovered, sentences/sec and transient heap bytes per sentence
+# usage: python bench/bench_nmea_stream.py [capture.nmea]
+# author: callen
+#
+
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lib'))
+
+from nmea import NMEAStream  # noqa: E402
+
+DEFAULT_CAPTURE = os.path.join(ROOT, 'bench', 'captures', 'l76_ride.nmea')
+I2C_READ_SIZE = 255
+# Sentence types L76GNSS.get_fix asks _read_message for
+WANTED = ('RMC', 'VTG', 'GLL', 'GGA', 'GSA')
+WANTED_BYTES = tuple(m.encode() for m in WANTED)
+
+
+def i2c_reads(capture):
+    """
+    split a capture into the chunks the I2C bus would return. The L76 outputs one
+    burst of sentences per second (starting with RMC), the last read of a burst
+    is padded with '\n' and followed by an idle read of padding only
+    """
+    reads = []
+    for burst in capture.split(b'$GNRMC')[1:]:
+        burst = b'$GNRMC' + burst
+        for i in range(0, len(burst), I2C_READ_SIZE):
+            chunk = burst[i:i + I2C_READ_SIZE]
+            reads.append(chunk + b'\n' * (I2C_READ_SIZE - len(chunk)))
+        reads.append(b'\n' * I2C_READ_SIZE)
+    return reads
+
+
+class Legacy:
+    """the previous _read_message logic: str per read, split per wanted type"""
+
+    def process(self, reg):
+        found = fixed = 0
+        if len(set(reg)) < 10:
+            return found, fixed
+        nmea_buffer = reg.decode('utf-8')
+        for m in WANTED:
+            if nmea_buffer.find(m):
+                for segment in nmea_buffer.split("\r\n"):
+                    if segment.find(m) > 0:
+                        if segment.startswith("$") and segment[len(segment)-3:len(segment)-2] == "*":
+                            found += 1
+                            if m == 'RMC' and segment[18] == 'A':
+                                fixed += 1
+        return found, fixed
+
+
+class Streamed:
+    """NMEAStream fed from the same reads, same wanted types"""
+
+    def __init__(self):
+        self.stream = NMEAStream()
+
+    def process(self, reg):
+        found = fixed = 0
+        stream = self.stream
+        stream.feed(reg)
+        while True:
+            sentence = stream.next_sentence()
+            if sentence is None:
+                return found, fixed
+            if sentence[2:5] in WANTED_BYTES:
+                found += 1
+                if sentence[2] == 0x52 and sentence[17] == 0x41:
+                    fixed += 1
+
+
+def run(decoder, reads):
+    found = 0
+    first_fix = None
+    for n, reg in enumerate(reads):
+        f, fixed = decoder.process(reg)
+        found += f
+        if fixed and first_fix is None:
+            first_fix = n
+    return found, first_fix
+
+
+def measure(name, factory, reads, total, rounds=20):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        found, first_fix = run(factory(), reads)
+    elapsed = time.perf_counter() - start
+
+    # Sum of the per read heap peaks, i.e. how much garbage each read produces
+    decoder = factory()
+    tracemalloc.start()
+    churn = 0
+    for reg in reads:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        decoder.process(reg)
+        churn += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    print("{:<10} {:>6}/{:<6} {:>10.0f} {:>12.1f} {:>10}".format(
+        name, found, total, found * rounds / elapsed, churn / max(found, 1), first_fix))
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CAPTURE
+    with open(path, 'rb') as f:
+        capture = f.read()
+    total = sum(1 for line in capture.split(b'\r\n') if line[3:6] in WANTED_BYTES)
+    reads = i2c_reads(capture)
+    print("{} reads of {} bytes, {} {} sentences in capture".format(len(reads), I2C_READ_SIZE, total, '+'.join(WANTED)))
+    print("{:<10} {:>13} {:>10} {:>12} {:>13}".format('decoder', 'found', 'sent/s', 'heap B/sent', '1st fix@read'))
+    measure('legacy', Legacy, reads, total)
+    measure('stream', Streamed, reads, total)
+
+
+if __name__ == '__main__':
+    main()
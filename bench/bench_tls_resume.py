@@ -0,0 +1,164 @@
+# Host side benchmark of a full TLS handshake against a resumed one, up to
+# the MQTT CONNACK, with a local TLS broker (CPython ssl, TLS 1.2 like the
+# mbedTLS of the firmware, self-signed certificate made with the openssl
+# command line tool).
+# The client runs its TLS over memory BIOs so every byte and every wait for
+# the broker is counted. Reports bytes each way, round trips, the localhost time and the
+# time the same exchange takes at the LTE-M round trip and bandwidth of the
+# simulator (sim.NetModel), plus what sim/fake/ussl.py charges for both
+# usage: python bench/bench_tls_resume.py [connections] [rtt seconds]
+# author: callen
+#
+
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import NetModel  # noqa: E402
+from sim.fake import ussl as sim_ussl  # noqa: E402
+
+CONNECT = b'\x10\x17\x00\x04MQTT\x04\x02\x00\x00\x00\x0bmotorcycle1'
+CONNACK = b'\x20\x02\x00\x00'
+
+
+def certificate(directory):
+    cert = os.path.join(directory, 'broker.pem')
+    key = os.path.join(directory, 'broker.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj',
+                    '/CN=localhost', '-keyout', key, '-out', cert], check=True, capture_output=True)
+    return cert, key
+
+
+class Broker(threading.Thread):
+    """answers the CONNECT of every TLS connection with a CONNACK"""
+
+    def __init__(self, cert, key):
+        super().__init__(daemon=True)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.maximum_version = ssl.TLSVersion.TLSv1_2
+        self.context.load_cert_chain(cert, key)
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            sock, _ = self.listener.accept()
+            try:
+                with self.context.wrap_socket(sock, server_side=True) as tls:
+                    if tls.recv(len(CONNECT)) == CONNECT:
+                        tls.sendall(CONNACK)
+                        tls.recv(1)
+            except (OSError, ssl.SSLError):
+                pass
+
+
+class Exchange:
+    """one client connection up to the CONNACK, counting bytes and round trips"""
+
+    def __init__(self, context, port, session=None):
+        self.sent = self.received = self.round_trips = 0
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.incoming = ssl.MemoryBIO()
+        self.outgoing = ssl.MemoryBIO()
+        self.tls = context.wrap_bio(self.incoming, self.outgoing, server_hostname='localhost', session=session)
+
+    def _flush(self):
+        data = self.outgoing.read()
+        if data:
+            self.sock.sendall(data)
+            self.sent += len(data)
+
+    def _wait(self):
+        self._flush()
+        data = self.sock.recv(65536)
+        if not data:
+            raise OSError('broker closed the connection')
+        self.received += len(data)
+        self.round_trips += 1
+        self.incoming.write(data)
+
+    def run(self):
+        while True:
+            try:
+                self.tls.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                self._wait()
+        self.tls.write(CONNECT)
+        while True:
+            try:
+                answer = self.tls.read(len(CONNACK))
+                break
+            except ssl.SSLWantReadError:
+                self._wait()
+        assert answer == CONNACK
+        session, reused = self.tls.session, self.tls.session_reused
+        self.sock.close()
+        return session, reused
+
+
+def measure(context, port, connections):
+    results = {}
+    session = None
+    for i in range(connections):
+        start = time.perf_counter()
+        exchange = Exchange(context, port, session if i else None)
+        session, reused = exchange.run()
+        elapsed = time.perf_counter() - start
+        kind = 'resumed' if reused else 'full'
+        results.setdefault(kind, []).append((exchange.sent, exchange.received, exchange.round_trips, elapsed))
+    return results
+
+
+def main(argv):
+    connections = int(argv[1]) if len(argv) > 1 else 20
+    net = NetModel(rtt=float(argv[2]) if len(argv) > 2 else 0.6)
+    if shutil.which('openssl') is None:
+        print("openssl command line tool not found, it makes the broker certificate")
+        return
+    directory = tempfile.mkdtemp()
+    try:
+        cert, key = certificate(directory)
+        broker = Broker(cert, key)
+        broker.start()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+        context.load_verify_locations(cert)
+        results = measure(context, broker.port, connections)
+    finally:
+        shutil.rmtree(directory)
+
+    print("{} connections to a local TLS 1.2 broker (RSA 2048, self-signed), {} ms round trip, {} kB/s".format(
+        connections, int(net.rtt * 1000), net.bandwidth // 1000))
+    print("{:<9} {:>6} {:>8} {:>10} {:>12} {:>14} {:>12}".format('handshake', 'count', 'sent B', 'received B',
+                                                                 'round trips', 'localhost ms', 'lte-m s'))
+    projected = {}
+    for kind in ('full', 'resumed'):
+        runs = results.get(kind, [])
+        if not runs:
+            continue
+        sent, received, trips, elapsed = [sum(values) / len(runs) for values in zip(*runs)]
+        # Round trips plus the transfer, with the IP / TCP headers of a segment per flight
+        projected[kind] = trips * net.rtt + (sent + received + 2 * trips * net.packet_overhead) / net.bandwidth
+        print("{:<9} {:6} {:8.0f} {:10.0f} {:12.1f} {:14.2f} {:12.2f}".format(kind, len(runs), sent, received, trips,
+                                                                             elapsed * 1000, projected[kind]))
+    if len(projected) == 2:
+        print("resumed: {:.2f} s and {:.0f}% of the bytes of a full handshake".format(
+            projected['full'] - projected['resumed'],
+            100 * sum(results['resumed'][0][:2]) / sum(results['full'][0][:2])))
+    print("sim/fake/ussl.py charges {} B / {} round trips for a full handshake, {} B / {} for a resumed one".format(
+        sim_ussl.FULL_HANDSHAKE_BYTES, sim_ussl.FULL_HANDSHAKE_ROUND_TRIPS, sim_ussl.RESUMED_HANDSHAKE_BYTES,
+        sim_ussl.RESUMED_HANDSHAKE_ROUND_TRIPS))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,58 @@
+# Host side benchmark of the wifi bring up in boot.py, run on the simulator
+# (sim package): the time from the wakeup to the association (dhcp included)
+# with a full scan on every boot (the cache of lib/wificache.py dropped before
+# each wakeup), connecting straight to the cached access point, with the
+# cached address as well (ConfigNetwork.WIFI_CACHE_IP), and with the access
+# point replaced after the first wakeup (the cached one does not answer, boot
+# scans again)
+# usage: python bench/bench_wifi_reconnect.py [wakes]
+# author: callen
+#
+
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator  # noqa: E402
+
+# ConfigNetwork.NVS_WIFI_* keys
+CACHE_KEYS = ('wifissid', 'wifibssid', 'wifichannel', 'wifiip0', 'wifiip1', 'wifiip2', 'wifiip3')
+REPLACED_BSSID = b'\x50\xc7\xbf\x00\x00\x02'
+
+
+def run(wakes, cache=True, cache_ip=False, replace=False):
+    sim = Simulator(config={'ConfigNetwork.WIFI_CACHE_IP': cache_ip})
+    connect = []
+    awake = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(wakes):
+            if not cache:
+                for key in CACHE_KEYS:
+                    sim.nvs.pop(key, None)
+            if replace and i == 1:
+                sim.wifi.access_points[0].bssid = REPLACED_BSSID
+            record = sim.run(wakes=1)[-1]
+            if i:
+                # The first wakeup (power on) scans in every case
+                connect.append(sim.wifi.connected_at - record.start if sim.wifi.connected_at is not None else None)
+                awake.append(record.awake)
+    connected = [c for c in connect if c is not None]
+    return (sum(connected) / len(connected), len(connect) - len(connected), sim.wifi.scans,
+            sum(awake) / len(awake))
+
+
+def main(argv):
+    wakes = int(argv[1]) if len(argv) > 1 else 20
+    print("{} wakeups".format(wakes))
+    print("{:<16} {:>10} {:>12} {:>6} {:>8}".format('boot', 'connect s', 'unconnected', 'scans', 'awake s'))
+    for name, kwargs in (('scan', {'cache': False}), ('cached ap', {}), ('cached ap + ip', {'cache_ip': True}),
+                         ('ap replaced', {'replace': True})):
+        print("{:<16} {:10.2f} {:12} {:6} {:8.2f}".format(name, *run(wakes, **kwargs)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
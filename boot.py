@@ -6,46 +6,65 @@
 
 import os
 import machine
-from config import ConfigNetwork
+import utime
+from config import ConfigNetwork, ConfigProfile
+from lib import profiler
 
 uart = machine.UART(0, baudrate=115200)
 os.dupterm(uart)
 
-# Do not initialize any wireless settings
-useWifi = True
+profiler.enable(ConfigProfile.ENABLED, ConfigProfile.FILE)
+
+# Do not initialize any wireless settings (lte is brought up by main.py)
+useWifi = not ConfigNetwork.USE_LTE
 
 if useWifi and machine.reset_cause() != machine.SOFT_RESET:
-    from network import WLAN
-    wl = WLAN()
-    wl.mode(WLAN.STA)
-    def_ssid = 'chris-gpy'
-    def_auth = (WLAN.WPA2, 'micropython')
-
-    print("Scanning for known wifi networks")
-    available_networks = wl.scan()
-    networks = frozenset([e.ssid for e in available_networks])
-
-    known_network_names = frozenset([key for key in ConfigNetwork.KNOWN_NETWORKS])
-    network_to_use = list(networks & known_network_names)
-
-    try:
-        network_to_use = network_to_use[0]
-        network_props = ConfigNetwork.KNOWN_NETWORKS[network_to_use]
-        pwd = network_props['pwd']
-        sec = [e.sec for e in available_networks if e.ssid == network_to_use][0]
-        if 'config' in network_props:
-            wl.ifconfig(config=network_props['config'])
-        wl.connect(network_to_use, (sec, pwd), timeout=10000)
-        while not wl.isconnected():
-            machine.idle()  # save power while waiting for connection to succeed
-        print("Connected to " + network_to_use + " with IP address: " + wl.ifconfig()[0])
-
-    except Exception as e:
-        print("Failed to connect to any known network... Exception: {}".format(e))
-        print("Going into AP mode")
-
-        print("Setting with default ssid: {0} and default auth {1}".format(def_ssid, def_auth))
-        wl.init(mode=WLAN.AP, ssid=def_ssid, auth=def_auth, channel=6, antenna=WLAN.INT_ANT, hidden=False)
+    # Time of the wifi bring up, the first phase of the wakeup (lib/profiler.py)
+    with profiler.span(profiler.BOOT):
+        from network import WLAN
+        from lib.wificache import WifiCache
+        wl = WLAN()
+        wl.mode(WLAN.STA)
+        def_ssid = 'chris-gpy'
+        def_auth = (WLAN.WPA2, 'micropython')
+        # The whole bring up, main.py waits on its own for an association still going on
+        deadline = utime.ticks_add(utime.ticks_ms(), ConfigNetwork.WIFI_DEADLINE * 1000)
+        wifiCache = WifiCache(debug=ConfigNetwork.DEBUG)
+
+        # Straight to the access point of the last association, without a scan (and dhcp with a cached address)
+        network_to_use = wifiCache.connectCached(wl)
+        if network_to_use is not None:
+            print("Connecting to " + network_to_use)
+            if not ConfigNetwork.CONCURRENT_BRINGUP:
+                while not wl.isconnected() and not wifiCache.expired(wl):
+                    machine.idle()
+                if not wl.isconnected():
+                    wifiCache.fallback(wl)
+                    network_to_use = None
+
+        if network_to_use is None:
+            try:
+                remaining = max(utime.ticks_diff(deadline, utime.ticks_ms()), 0)
+                network_to_use = wifiCache.scanConnect(wl, remaining)
+                if ConfigNetwork.CONCURRENT_BRINGUP:
+                    # The association goes on in the background, main.py uses the gps meanwhile
+                    print("Connecting to " + network_to_use)
+                else:
+                    while not wl.isconnected() and utime.ticks_diff(deadline, utime.ticks_ms()) > 0:
+                        machine.idle()  # save power while waiting for connection to succeed
+
+            except Exception as e:
+                print("Failed to connect to any known network... Exception: {}".format(e))
+                print("Going into AP mode")
+
+                print("Setting with default ssid: {0} and default auth {1}".format(def_ssid, def_auth))
+                wl.init(mode=WLAN.AP, ssid=def_ssid, auth=def_auth, channel=6, antenna=WLAN.INT_ANT, hidden=False)
+
+        if not ConfigNetwork.CONCURRENT_BRINGUP and network_to_use is not None:
+            if wl.isconnected():
+                print("Connected to " + network_to_use + " with IP address: " + wl.ifconfig()[0])
+            else:
+                print("Not connected to " + network_to_use + " after {} seconds".format(ConfigNetwork.WIFI_DEADLINE))
 
 #TODO For now going to tests module. Remove this
 machine.main('tests.py')
@@ -14,6 +14,37 @@ class ConfigNetwork:
         'TP-LINK_89F7': {'pwd': config_auth.NETWORK_1_PASS, 'config': ('192.168.0.185', '255.255.255.0', '192.168.0.1', '192.168.0.1')},
         'Nuthouse': {'pwd': config_auth.NETWORK_2_PASS}
     }
+    # Bring the network up in the background while the gps and the accelerometer are used (boot.py does not wait
+    # for the association). False waits for the network in boot.py and Tracker.init first
+    CONCURRENT_BRINGUP = True
+    CONNECT_TIMEOUT = 30  # Seconds a wakeup waits for the network, then the messages stay in the outbox
+    USE_LTE = False  # Lte (lib/ltesession.py) instead of wifi
+    # boot.py connects straight to the access point of the last association (lib/wificache.py), scanning only if it
+    # does not answer within WIFI_FAST_TIMEOUT. The wifi bring up gives up after WIFI_DEADLINE
+    WIFI_FAST_TIMEOUT = 3  # Seconds
+    WIFI_DEADLINE = 15  # Seconds
+    WIFI_CACHE_IP = False  # Reuse the address dhcp gave as a static one (skips dhcp, the router has to keep the lease)
+    DEBUG = False  # Print what the wifi cache of boot.py does (connect, fallback, scan)
+    NVS_WIFI_SSID = "wifissid"  # Keys to save to NVS the access point of the last association
+    NVS_WIFI_BSSID = "wifibssid"
+    NVS_WIFI_CHANNEL = "wifichannel"
+    NVS_WIFI_IP = "wifiip"  # + 0 to 3, ip, netmask, gateway and dns
+
+# Configurations for the LTE modem (lib/ltesession.py). The modem keeps them through resets, they are only sent again
+# when they change
+class ConfigLTE:
+    APN = "soracom.io"
+    AUTH = (1, "sora", "sora")  # AT+CGAUTH type (1 PAP), user, password
+    BANDS = (26, 18)  # Bands the modem scans, all of them if empty
+    # Power saving mode: the modem stays registered through the deep sleeps, until the network has not heard from it
+    # for PSM_PERIOD seconds (periodic TAU, longer than the sleeps). It listens for PSM_ACTIVE seconds after a wakeup
+    PSM = True
+    PSM_PERIOD = 14400  # 4 hours
+    PSM_ACTIVE = 2
+    EDRX_CYCLE = None  # eDRX paging cycle (seconds, 5.12 to 10485.76) while awake, None disables it
+    ATTACH_TIMEOUT = 60  # Seconds the attach may take before the modem is provisioned again on the next wakeup
+    POLL_MS = 100  # Interval the modem state is checked at while waiting on it
+    NVS_PROFILE = "lteprofile"  # Key to save to NVS the hash of the configuration the modem is provisioned with
 
 # Configurations for MQTT Settings
 class ConfigMqtt:
@@ -22,9 +53,38 @@ class ConfigMqtt:
     # Server and port to connect MQTT to
     SERVER = config_auth.MQTT_SERVER
     PORT = 1883
+    # TLS to the broker (PORT is usually 8883 then), SSL_PARAMS are given to ussl.wrap_socket
+    SSL = False
+    SSL_PARAMS = {}
     # User authentication for MQTT server
     USER = config_auth.MQTT_USER
     PASSWORD = config_auth.MQTT_PASSWORD
+    # Persistent session: the broker keeps the subscriptions and queues the QoS 1 messages for the tracker
+    # across deep sleeps, so they are not subscribed again on every wakeup (CLIENT_ID must stay the same)
+    CLEAN_SESSION = False
+    SUBSCRIBE_QOS = 1
+    NVS_SUBSCRIBED = "mqttsubscribed"  # Key to save to NVS once the broker session has the subscriptions
+    # Broker address cache (lib/resolver.py), looked up again in the background once older than DNS_TTL
+    # seconds (0 looks it up on every connect). SERVER_IPS are tried if there is neither DNS nor a cached address
+    DNS_TTL = 86400
+    SERVER_IPS = ()
+    NVS_BROKER_IP = "brokerip"  # Keys to save to NVS the cached address, the time it was looked up and the
+    NVS_BROKER_IP_TIME = "brokeriptime"  # host it is for
+    NVS_BROKER_HOST = "brokerhost"
+    # Connection manager (lib/mqttconn.py)
+    KEEPALIVE = 60  # Seconds, a PINGREQ is sent every half of it while the tracker is connected
+    SOCKET_TIMEOUT = 10  # Seconds a read waits for the broker before the connection is taken as half open
+    CONNECT_BACKOFF_MS = 500  # Delay after the first failed connect attempt, doubled on every failure (half random)
+    CONNECT_BACKOFF_MAX_MS = 8000
+    CONNECT_BUDGET_MS = 20000  # Time a wakeup may spend connecting, then the messages wait in the outbox
+    # QoS 1/2 messages sent before publish waits for acknowledgements (1 waits on every message)
+    MAX_INFLIGHT = 8
+    # Store and forward queue every message goes through (lib/outbox.py), replayed with QoS 1
+    OUTBOX_FILE = "/flash/outbox.q"
+    OUTBOX_MAX_BYTES = 32768  # Oldest messages are dropped past this size
+    OUTBOX_BATCH_BYTES = 2048  # Read and acknowledged at once on replay
+    OUTBOX_QOS = 1
+    NVS_OUTBOX_HEAD = "outboxhead"  # Key to save to NVS the file offset of the first message not acknowledged
 
     # Topics to publish to
     # Sending heartbeat message to record timestamp (sent on both timer wakeup and accelerometer wakeup)
@@ -34,6 +94,19 @@ class ConfigMqtt:
     # Topic to send GPS coordinates 
     TOPIC_GPS = "/motorcycle/location"
     TOPIC_GPS_NOT_AVAILABLE = "/motorcycle/locationunavailable"
+    # Payload format of the locations per topic, "binary" (lib/location.py, 19 bytes), "json" or "batch"
+    # (while tracking, fixes are kept on flash and sent together as deltas)
+    LOCATION_FORMATS = {TOPIC_GPS: "batch"}
+    BATCH_FILE = "/flash/fixes.bin"
+    BATCH_MAX_FIXES = 10  # A batch is sent once it has this many fixes
+    BATCH_MAX_SECONDS = 600  # or once its oldest fix is this old, or when the ride ends
+    # Topics to request (publish) and receive (subscribe) the EPO file for assisted gps fixes
+    TOPIC_EPO_REQUEST = "/motorcycle/epo/request"
+    TOPIC_EPO = "/motorcycle/epo/data"
+    # Topic of the wake cycle phase timings (lib/profiler.py)
+    TOPIC_TELEMETRY = "/motorcycle/telemetry"
+    # Topic of the energy totals (lib/energy.py), json
+    TOPIC_ENERGY = "/motorcycle/energy"
     # Topic to send error info to
     TOPIC_EXCEPTION_ENCOUNTERED = "/motorcycle/exception"
     # Topic to subscribe to for disabling the tracker
@@ -41,6 +114,7 @@ class ConfigMqtt:
     DISABLE_TRACKING_MSG = "OFF"
     ENABLE_TRACKING_MSG = "ON"
     SLEEP_TIME_MQTT_DISABLE = 21600  # 6 hours default sleep time
+    NVS_TRACKING_OFF = "trackingoff"  # Key to save to NVS the time tracking is disabled until (0 until enabled again)
 
 # Configurations for Accelerometer Settings
 class ConfigAccelerometer:
@@ -60,12 +134,63 @@ class ConfigGPS:
     NVS_SLEEP_CONTINUE_GPS_READ = "sleepgpsread"  # Key to save to NVS for continuing to read GPS after deep sleep
     NVS_LAST_LOCATION_LOG_TIME = "locationlogts"  # Key to save to NVS the timestamp of the last time GPS coordinates were logged.
     LOCATION_LOG_INTERVAL = 86400  # Log location at least once a day (in seconds)
+    # Sentences the gps outputs while tracking (PMTK314 rates for GLL, RMC, VTG, GGA, GSA, GSV).
+    # Only RMC + GGA keeps the I2C stream (and the time spent reading it) small
+    NMEA_OUTPUT_TRACKING = (0, 1, 0, 1, 0, 0)
+    FIX_INTERVAL_MS = 1000  # Position fix interval while tracking (PMTK220)
+    FIX_POLL = 1  # Seconds the gps is read for a fix before the network is checked on again
+    # Start strategy (lib/gpsstart.py). Index 0 is hot, 1 warm, 2 cold and 3 cold start assisted with EPO data
+    START_TIMEOUTS = (45, 120, LOCK_TIMEOUT, 120)  # Timeout (in seconds) of one fix attempt per strategy
+    TTFF_ESTIMATES = (5, 35, 60, 15)  # Expected time to first fix (in seconds) until there are measured values
+    EPHEMERIS_VALID_TIME = 7200  # Ephemeris from the last fix is usable for a hot start for about 2 hours
+    ACQUIRE_CURRENT_MA = 25  # Current drawn by the gps while acquiring a fix
+    RETAIN_CURRENT_MA = 18  # Current drawn by the gps when left powered during deep sleep
+    NVS_LAST_FIX_TIME = "gpsfixts"  # Key to save to NVS the timestamp of the last gps fix
+    NVS_LAST_FIX_LAT = "gpsfixlat"  # Key to save to NVS the latitude of the last fix (offset micro degrees)
+    NVS_LAST_FIX_LON = "gpsfixlon"  # Key to save to NVS the longitude of the last fix (offset micro degrees)
+    NVS_GPS_BACKUP = "gpsbackup"  # Key to save to NVS if the gps stayed powered during the last sleep
+    NVS_TTFF_PREFIX = "ttff"  # NVS key prefix of the ttff statistics (ttff + h/w/c/a + n/t/f)
+    # EPO (extended prediction orbit) assistance for cold starts (lib/epo.py)
+    EPO_FILE = "/flash/mtk7.epo"  # EPO file downloaded over mqtt
+    EPO_MAX_SETS = 28  # Sets (6 hours each) sent to the gps, 7 days
+    EPO_REFRESH_HOURS = 48  # Download a new file when the one on flash covers less than 2 days
+    EPO_DOWNLOAD_TIMEOUT = 60  # Max time (in seconds) to wait for the file chunks over mqtt
+    EPO_RETRY_BACKOFF = 21600  # After a download that got no file, no new one is requested for 6 hours (in seconds)
+    EPO_ACK_TIMEOUT = 1  # Max time (in seconds) to wait for the gps to ack one binary EPO packet
+    EPO_PACKET_RETRIES = 3  # Times an EPO packet is sent before the upload is given up
+    NVS_EPO_LOADED = "epoloaded"  # Key to save to NVS the end (gps hour) of the EPO data loaded in the gps
+    NVS_EPO_RETRY = "eporetry"  # Key to save to NVS the time before which no EPO file is requested again
 
 class ConfigWakeup:
     WAKE_REASON_ACCELEROMATER = 100
     WAKE_CONTINUE_GPS = 200
     WAKE_REASON_TIMEOUT = 300
     SLEEP_TIME_OWNER_NEARBY = 1800  # 30 minutes
+    NVS_WAKE_TIME = "waketime"  # Key to save to NVS the time the sleep ends, sets the rtc on wakeup until ntp syncs it
+
+# Energy accounting (lib/energy.py). Average current (mA) of each component while it is on
+class ConfigEnergy:
+    CPU_ACTIVE_MA = 45  # GPy awake
+    WIFI_MA = 80  # Wifi station associated, on top of the cpu
+    LTE_ATTACH_MA = 120  # Modem searching and attaching (boot and init)
+    LTE_TX_MA = 180  # Connecting to the broker and publishing
+    LTE_IDLE_MA = 15  # Modem attached, idle
+    GPS_TRACK_MA = 20  # L76 tracking, ConfigGPS.ACQUIRE_CURRENT_MA while getting a fix
+    BLE_SCAN_MA = 50  # Bluetooth scan for the owner
+    DEEP_SLEEP_MA = 0.02  # GPy and Pytrack in deep sleep, ConfigGPS.RETAIN_CURRENT_MA more if the gps stays powered
+    BATTERY_MAH = 2000  # Capacity of the battery, for the projections of tools/battery_projection.py
+    PUBLISH_WAKES = 96  # The totals are sent on TOPIC_ENERGY every this many wakeups
+    NVS_PREFIX = "energy"  # NVS key prefix of the charge totals (energy + c/w/l/g/b/s)
+    NVS_SLEEP = "energysleep"  # Key to save to NVS the planned sleep, charged on the next wakeup
+    NVS_WAKES = "energywakes"  # Key to save to NVS the wakeups counted
+    NVS_SENT = "energysent"  # Key to save to NVS the wakeups counted when the totals were last sent
+
+# Wake cycle phase profiler (lib/profiler.py)
+class ConfigProfile:
+    ENABLED = True
+    RING_WAKES = 64  # Wakeups kept on flash (20 bytes each) until they are sent
+    FILE = "/flash/profile.bin"  # The ring of wakeups, RTC memory does not survive the Pytrack deep sleep
+    FLUSH_WAKES = 16  # The ring is sent as one message on TOPIC_TELEMETRY once it holds this many
 
 class ConfigBluetooth:
     SCAN_ALLOW_TIME = 10  # Allow 10 seconds to scan to see if owner is nearby (bluetooth tracker)
@@ -11,26 +11,49 @@
 # RMC -> added NavigationaalStatus
 # GSA -> added GNSSSystemID
 # GSV -> added SignalID
+# v7 streaming tokenizer (nmea.py), sentences survive across I2C reads
+#    table driven decoding, only subscribed sentence types are decoded
+#    fix sentences become compact Fix records, hashes only with dict_messages
+#    accessors share one epoch snapshot (FixState) instead of reading per call
+#    PMTK314/PMTK220 sentence output and fix interval, with acked round trips
+#    PMTK request/response engine, pipelined commands with a total deadline
+#    chip identification on demand only, cached in NVS
+#    PMTK740/741 reference time and position, raw access for binary (EPO) packets
 # based upon the original L76GLNSS library
 # and the modifications by neuromystix
-# every lookup of coordinates or other GPS data has to wait for the
-# right GPS message, no caching of GPS data
+# every lookup of coordinates or other GPS data is answered from the
+# last complete epoch (RMC+GGA+GSA+VTG), read again once it is stale
 # MIT licence
 
 from machine import Timer
 import time
 import gc
 import binascii
+import pycom
+from nmea import NMEAStream, Subscription, Fix, FixState, EPOCH_TYPES, parse
+from nmea import EPOCH_RMC, EPOCH_GGA, EPOCH_GSA, EPOCH_VTG, EPOCH_ALL
+import nvsutil
 
 # TODO: annotate sattelites in view
 
+KNOTS_TO_KMH = 1.852
+
+# PMTK001 ack flags
+PMTK_ACK_INVALID = const(0)
+PMTK_ACK_UNSUPPORTED = const(1)
+PMTK_ACK_FAILED = const(2)
+PMTK_ACK_OK = const(3)
+
 
 class L76GNSS:
 
     GPS_I2CADDR = const(0x10)
-    NMEA410 = const(410)
+    # NVS keys of the cached chip identification
+    NVS_RELEASE = 'l76release'
+    NVS_NMEA_VERSION = 'l76nmeaver'
 
-    def __init__(self, pytrack=None, sda='P22', scl='P21', timeout=180, debug=False):
+    def __init__(self, pytrack=None, sda='P22', scl='P21', timeout=180, debug=False, dict_messages=False,
+                 epoch_max_age=1.5, pmtk_timeout=1, cold_start=False):
         if pytrack is not None:
             self.i2c = pytrack.i2c
         else:
@@ -42,13 +65,24 @@ class L76GNSS:
         self.timeout_status = True
         self.reg = bytearray(1)
         self.i2c.writeto(GPS_I2CADDR, self.reg)
+        # Raw I2C data is tokenized in place, partial sentences survive between reads
+        self.stream = NMEAStream()
+        self._subscriptions = {}
         self.fix = False
         self.Latitude = None
         self.Longitude = None
         self.debug = debug
         self.timeLastFix = 0
         self.ttf = -1
-        self.lastmessage = {}
+        # Last decoded sentence, a Fix record for GGA/RMC/GLL/VTG/GSA/GSV
+        self.lastmessage = None
+        # gps_message returns the old hash per sentence instead of Fix records
+        self.dict_messages = dict_messages
+        # Snapshot of the last complete epoch, the accessors answer from it as long
+        # as it is younger than epoch_max_age seconds instead of reading the gps again
+        self.state = FixState()
+        self.epoch_chrono = Timer.Chrono()
+        self.epoch_max_age = epoch_max_age
         self.NMEAVersion = 301
         self.ChipVersionID = None
         self.release = 1.0
@@ -56,158 +90,40 @@ class L76GNSS:
         self.BuildID = None
         self.ProductModel = None
         self.SDK = None
-        self.get_dt_release(debug=False)
-        self.get_chip_version(debug=False)
+        # The chip is only identified (or its identification loaded from NVS)
+        # when NMEA 4.10 handling is needed, see nmea_version()
+        self.pmtk_timeout = pmtk_timeout
+        self._identified = False
+        # Powered up from nothing (not a wakeup), the chip may have been replaced
+        # or flashed since the NVS cache was made, nmea_version() checks it
+        self.cold_start = cold_start
 
 
     def _read(self):
-        """read the data stream form the gps"""
-        # Changed from 64 to 128 - I2C L76 says it can read till 255 bytes
-        reg = b""
-        while len(set(reg)) < 10: # Throw away empty buffers
-            reg = self.i2c.readfrom(GPS_I2CADDR, 255)
-        return reg
-
-    @staticmethod
-    def _convert_coord(coord, orientation):
-        """convert a ddmm.mmmm to dd.dddddd degrees"""
-        coord = (float(coord) // 100) + ((float(coord) % 100) / 60)
-        if orientation == 'S' or orientation == 'W':
-            coord *= -1
-        return coord
+        """read the data stream form the gps into the sentence buffer"""
+        # I2C L76 says it can read till 255 bytes. Empty reads are just '\n'
+        # padding which the tokenizer skips, so no need to filter them here
+        window = self.stream.window(255)
+        self.i2c.readfrom_into(GPS_I2CADDR, window)
+        self.stream.commit(len(window))
 
     def time_fixed(self):
         """how long till the last fix"""
         return int(time.ticks_ms()/1000) - self.timeLastFix
 
-    def _mixhash(self, keywords, sentence):
-        """return hash with keywords filled with sentence"""
-        ret = {}
-        while len(keywords) - len(sentence) > 0:
-            sentence += ('',)
-        if len(keywords) == len(sentence):
-            # for k, s in zip(keywords, sentence):
-            #     ret[k] = s
-            ret = dict(zip(keywords, sentence))
-            try:
-                ret['Latitude'] = self._convert_coord(ret['Latitude'], ret['NS'])
-            except:
-                pass
-            try:
-                ret['Longitude'] = self._convert_coord(ret['Longitude'], ret['EW'])
-            except:
-                pass
-            return ret
-        else:
-            return None
-
-    def _GGA(self, sentence):
-        """essentials fix and accuracy data"""
-        keywords = ['NMEA', 'UTCTime', 'Latitude', 'NS', 'Longitude', 'EW',
-                    'FixStatus', 'NumberOfSV', 'HDOP',
-                    'Altitude', 'M', 'GeoIDSeparation', 'M', 'DGPSAge', 'DGPSStationID']
-        return self._mixhash(keywords, sentence)
-
-    def _GLL(self, sentence):
-        """GLL sentence (geolocation)"""
-        keywords = ['NMEA', 'Latitude', 'NS', 'Longitude', 'EW',
-                    'UTCTime', 'dataValid', 'PositioningMode']
-        return self._mixhash(keywords, sentence)
-
-    def _RMC(self, sentence):
-        """required minimum position data"""
-        if len(sentence) == 11:
-            sentence.append('N')
-        keywords = ['NMEA', 'UTCTime', 'dataValid', 'Latitude', 'NS', 'Longitude', 'EW',
-                    'Speed', 'COG', 'Date', '', '', 'PositioningMode']
-        # if len(sentence) > len(keywords):
-        if self.NMEAVersion >= NMEA410:
-            keywords.append('NavigationaalStatus')
-        return self._mixhash(keywords, sentence)
-
-    def _VTG(self, sentence):
-        """track and ground speed"""
-        keywords = ['NMEA', 'COG-T', 'T', 'COG-M', 'M', 'SpeedKnots', 'N', 'SpeedKm', 'K',
-                    'PositioningMode']
-        return self._mixhash(keywords, sentence)
-
-    def _GSA(self, sentence):
-        """fix state, the sattelites used and DOP info"""
-        keywords = ['NMEA', 'Mode', 'FixStatus',
-                    'SatelliteUsed01', 'SatelliteUsed02', 'SatelliteUsed03',
-                    'SatelliteUsed04', 'SatelliteUsed05', 'SatelliteUsed06',
-                    'SatelliteUsed07', 'SatelliteUsed08', 'SatelliteUsed09',
-                    'SatelliteUsed10', 'SatelliteUsed11', 'SatelliteUsed12',
-                    'PDOP', 'HDOP', 'VDOP']
-        # if len(sentence) > len(keywords):
-        if self.NMEAVersion >= NMEA410:
-            keywords.append('GNSSSystemID')
-        return self._mixhash(keywords, sentence)
-
-    def _GSV(self, sentence):
-        """four of the sattelites seen"""
-        keywords = ['NMEA', 'NofMessage', 'SequenceNr', 'SatellitesInView',
-                    'SatelliteID1', 'Elevation1', 'Azimuth1', 'SNR1',
-                    'SatelliteID2', 'Elevation2', 'Azimuth2', 'SNR2',
-                    'SatelliteID3', 'Elevation3', 'Azimuth3', 'SNR3',
-                    'SatelliteID4', 'Elevation4', 'Azimuth4', 'SNR4']
-        # if len(sentence) > len(keywords):
-        if self.NMEAVersion >= NMEA410:
-            keywords.append('SignalID')
-        return self._mixhash(keywords, sentence)
-
-    def _pmtk_dt_release(self, sentence):
-        """convert the release information from the message"""
-        keywords = ['PMTK','ReleaseString', 'BuildID','ProductModel','SDK']
-        return self._mixhash(keywords, sentence)
-
-    def _pmtkAck(self, sentence):
-        """convert the ack message"""
-        keywords = ['PMTK', 'command', 'flag']
-        return self._mixhash(keywords, sentence)
-
-    def _pqverno(self, sentence):
-        """convert the version message"""
-        keywords = ['PMTK', 'command', 'ChipVersionID','date','time']
-        return self._mixhash(keywords, sentence)
-
-    def _pmtk(self, sentence, debug=False):
-        """convert the anonymous pmtk message"""
-        if debug:
-            print(sentence[0])
-        return dict(PMTK=sentence[0], msg=sentence)
-
     def _decodeNMEA(self, nmea, debug=False):
-        """turns a message into a hash"""
-        nmea_sentence = nmea[:-3].split(',')
-        # sentence = nmea_sentence[0][3:]
-        sentence = nmea_sentence[0][1:]
-        nmea_sentence[0] = sentence
+        """turns a message (without $ and checksum) into a Fix record or a hash (PMTK)"""
         if debug:
-            print(sentence, "->", nmea_sentence)
-        if sentence.endswith('RMC'):
-            return self._RMC(nmea_sentence)
-        if sentence.endswith('VTG'):
-            return self._VTG(nmea_sentence)
-        if sentence.endswith('GGA'):
-            return self._GGA(nmea_sentence)
-        if sentence.endswith('GSA'):
-            return self._GSA(nmea_sentence)
-        if sentence.endswith('GSV'):
-            return self._GSV(nmea_sentence)
-        if sentence.endswith('GLL'):
-            return self._GLL(nmea_sentence)
-        if sentence == 'PMTK705':
-            return self._pmtk_dt_release(nmea_sentence)
-        if sentence == 'PMTKLOG':
-            return self._pmtk(nmea_sentence)
-        if sentence == 'PMTK001':
-            return self._pmtkAck(nmea_sentence)
-        if sentence == 'PQVERNO':
-            return self._pqverno(nmea_sentence)
-        # if sentence.startswith('PMTK'):
-        #     return self._pmtk(nmea_sentence)
-        return None
+            print("decode", nmea)
+        return parse(nmea, self.NMEAVersion)
+
+    def _subscription(self, messagetype):
+        """the (cached) Subscription for a messagetype tuple"""
+        subscription = self._subscriptions.get(messagetype)
+        if subscription is None:
+            subscription = Subscription(messagetype)
+            self._subscriptions[messagetype] = subscription
+        return subscription
 
     def _read_message(self, messagetype=('GLL',), timeout=None, debug=False):
         """read and decode a nmea sentence according to a messagetype"""
@@ -217,64 +133,82 @@ class L76GNSS:
                 messagetype = (messagetype,)
         if debug:
             print("messagetype", messagetype)
-        messagefound = False
+        subscription = self._subscription(messagetype)
+        nmea_message = None
         if timeout is None:
             timeout = self.timeout
+        stream = self.stream
         self.chrono.reset()
         self.chrono.start()
-        chrono_running = True
-        while not messagefound and chrono_running:
-            if debug:
-                print("--Checking Mesages--")
-                print("Wanted messagetype(s)", messagetype)
-            nmea_buffer = self._read().decode('utf-8')
-            # Is messagetype present in the data
-            for m in messagetype:
-                if messagefound:
+        while nmea_message is None:
+            sentence = stream.next_sentence()
+            if sentence is None:
+                # Nothing complete left in the buffer, read some more
+                if self.chrono.read() > timeout:
                     break
-                if nmea_buffer.find(m):
-                    # break apart the long string into segments
-                    # NMEA messages end with \r\n
-                    for segment in nmea_buffer.split("\r\n"):
-                        if messagefound:
-                            break
-                        if debug:
-                            print("segment", segment)
-                        # Does this segment contain the message we're looking for?
-                        if segment.find(m) > 0:
-                            # Validate the whole message is present in segment
-                            if segment.startswith("$") and segment[len(segment)-3:len(segment)-2] == "*":
-                                # We now have what we want
-                                # Decode segment
-                                nmea_message = self._decodeNMEA(segment)
-                                if debug:
-                                    print("Decoded nmea_message", nmea_message)
-                                self.lastmessage = nmea_message
-                                messagefound = True
-            if debug:
-                print("found message?", messagefound)
-            if self.chrono.read() > timeout or messagefound:
-                self.chrono.stop()
-                chrono_running = False
-        if messagefound:
-            return nmea_message
-        else:
-            return None
+                self._read()
+                continue
+            # Sentences nobody asked for are dropped after looking at the header
+            if subscription.wants(sentence):
+                nmea_message = self._decodeNMEA(sentence, debug=debug)
+                if debug:
+                    print("Decoded nmea_message", nmea_message)
+                if isinstance(nmea_message, Fix):
+                    # PMTK answers come back as dicts, only fixes are kept for fixed()
+                    self.lastmessage = nmea_message
+        self.chrono.stop()
+        if debug:
+            print("found message?", nmea_message is not None)
+        return nmea_message
+
+    def read_epoch(self, timeout=None, debug=False):
+        """
+        reads one complete epoch (RMC, GGA, GSA and VTG of the same fix interval)
+        into self.state. Returns the state or None on timeout
+        """
+        if timeout is None:
+            timeout = self.timeout
+        state = self.state
+        state.reset()
+        chrono = Timer.Chrono()
+        chrono.reset()
+        chrono.start()
+        while chrono.read() <= timeout:
+            nmea_message = self._read_message(EPOCH_TYPES, timeout=timeout - chrono.read(), debug=debug)
+            if nmea_message is None:
+                break
+            if state.update(nmea_message):
+                chrono.stop()
+                self.epoch_chrono.reset()
+                self.epoch_chrono.start()
+                if debug:
+                    print("epoch complete in", chrono.read(), "seconds")
+                return state
+        chrono.stop()
+        state.reset()
+        return None
+
+    def _snapshot(self, debug=False):
+        """the last epoch if it is still fresh, otherwise reads a new one"""
+        if self.state.complete() and self.epoch_chrono.read() <= self.epoch_max_age:
+            return self.state
+        return self.read_epoch(debug=debug)
 
     def fixed(self):
         """fixed yet? returns true or false"""
-        nmea_message = self.lastmessage
-        pm = fs = False
-        if nmea_message != {}:
-            if nmea_message['NMEA'][2:] in ('RMC', 'GLL'):  # 'VTG',
-                pm = nmea_message['PositioningMode'] != 'N'
-            if nmea_message['NMEA'][2:] in ('GGA',):  # 'GSA'
-                fs = int(nmea_message['FixStatus']) >= 1
-        if pm or fs:
+        state = self.state
+        if state.complete():
+            fixed, latitude, longitude = state.valid, state.latitude, state.longitude
+        else:
+            nmea_message = self.lastmessage
+            fixed = nmea_message is not None and nmea_message.kind in ('RMC', 'GLL', 'GGA') and nmea_message.valid
+            if fixed:
+                latitude, longitude = nmea_message.latitude, nmea_message.longitude
+        if fixed:
             self.fix = True
             self.timeLastFix = int(time.ticks_ms() / 1000)
-            self.Latitude = nmea_message['Latitude']
-            self.Longitude = nmea_message['Longitude']
+            self.Latitude = latitude
+            self.Longitude = longitude
         else:
             self.fix = False
             self.timeLastFix = 0xffffffff
@@ -296,23 +230,15 @@ class L76GNSS:
         chrono_running = True
 
         while chrono_running and not self.fix:
-            nmea_message = self._read_message(('RMC', 'VTG', 'GLL', 'GGA', 'GSA'), debug=debug)
-            if nmea_message is not None:
-                pm = fs = False
-                try:
-                    if nmea_message['NMEA'][2:] in ('RMC', 'GLL'):  #'VTG',
-                        pm = nmea_message['PositioningMode'] != 'N'
-                    if nmea_message['NMEA'][2:] in ('GGA', ):  #'GSA'
-                        fs = int(nmea_message['FixStatus']) >= 1
-                    if pm or fs:
-                        chrono.stop()
-                        self.fix = True
-                        self.timeLastFix = int(time.ticks_ms() / 1000) - self.timeLastFix
-                        self.ttf = round(self.chrono.read())
-                        self.Latitude = nmea_message['Latitude']
-                        self.Longitude = nmea_message['Longitude']
-                except:
-                    pass
+            # A whole epoch is read, so the accessors can answer from it afterwards
+            state = self.read_epoch(timeout=timeout, debug=debug)
+            if state is not None and state.valid:
+                chrono.stop()
+                self.fix = True
+                self.timeLastFix = int(time.ticks_ms() / 1000) - self.timeLastFix
+                self.ttf = round(chrono.read())
+                self.Latitude = state.latitude
+                self.Longitude = state.longitude
             if chrono.read() > timeout:
                 chrono_running = False
         chrono.stop()
@@ -321,105 +247,153 @@ class L76GNSS:
         return self.fix
 
     def gps_message(self, messagetype=None, debug=False):
-        """returns the last message from the L76 gps"""
-        return self._read_message(messagetype=messagetype, debug=debug)
+        """returns the last message from the L76 gps (a hash when dict_messages is set)"""
+        msg = self._read_message(messagetype=messagetype, debug=debug)
+        if self.dict_messages and isinstance(msg, Fix):
+            # Only the hash view depends on the NMEA 4.10 fields
+            return msg.as_dict(self.nmea_version())
+        return msg
 
     def coordinates(self, debug=False):
         """you are here"""
-        msg, latitude, longitude = None, None, None
         if not self.fix:
             self.get_fix(debug=debug)
-        msg = self._read_message(('RMC', 'GGA', 'GLL'), debug=debug)
-        if msg is not None:
-            self.Latitude = msg['Latitude']
-            self.Longitude = msg['Longitude']
+        state = self._snapshot(debug=debug)
+        if state is not None and state.latitude is not None:
+            self.Latitude = state.latitude
+            self.Longitude = state.longitude
         return dict(latitude=self.Latitude, longitude=self.Longitude, ttf=self.ttf)
 
     def get_speed_RMC(self):
-        """returns your speed and direction as return by the ..RMC message"""
-        msg, speed, COG = None, None, None
-        msg = self._read_message(messagetype='RMC')
-        if msg is not None:
-            speed = msg['Speed']
-            COG = msg['COG']
+        """returns your speed (knots) and direction as return by the ..RMC message"""
+        speed, COG = None, None
+        state = self._snapshot()
+        if state is not None:
+            speed = state.speed
+            COG = state.cog
         return dict(speed=speed, COG=COG)
 
     def get_speed(self):
-        """returns your speed and direction in degrees"""
-        msg, speed, COG = None, None, None
-        msg = self._read_message(messagetype='VTG')
-        if msg is not None:
-            speed = msg['SpeedKm']
-            COG = msg['COG-T']
+        """returns your speed (km/h) and direction in degrees"""
+        speed, COG = None, None
+        state = self._snapshot()
+        if state is not None:
+            if state.speed is not None:
+                speed = state.speed * KNOTS_TO_KMH
+            COG = state.cog
         return dict(speed=speed, COG=COG)
 
     def get_location(self, MSL=False,debug=False):
         """location, altitude and HDOP"""
-        msg, latitude, longitude, HDOP, altitude = None, None, None, None, None
+        latitude, longitude, HDOP, altitude = None, None, None, None
         if not self.fix:
             self.get_fix(debug=debug)
-        msg = self._read_message(messagetype='GGA')
-        if msg is not None:
-            latitude = msg['Latitude']
-            longitude = msg['Longitude']
-            HDOP = msg['HDOP']
+        state = self._snapshot(debug=debug)
+        if state is not None:
+            latitude = state.latitude
+            longitude = state.longitude
+            HDOP = state.hdop
             if MSL:
-                altitude = msg['GeoIDSeparation']
+                altitude = state.geoid
             else:
-                altitude = msg['Altitude']
+                altitude = state.altitude
         return dict(latitude=latitude, longitude=longitude, HDOP=HDOP, altitude=altitude, ttf=self.ttf)
 
     def getUTCTime(self, debug=False):
         """return UTC time or None when nothing if found"""
-        msg = self._read_message(('GLL','RMC','GGA'), debug=debug)
-        if msg is not None:
-            utc_time = msg['UTCTime']
-            return "{}:{}:{}".format(utc_time[0:2], utc_time[2:4], utc_time[4:6])
+        state = self._snapshot(debug=debug)
+        if state is not None and state.utc is not None:
+            utc_time = state.utc
+            return "{:02d}:{:02d}:{:02d}".format(utc_time // 10000, utc_time // 100 % 100, utc_time % 100)
         else:
             return None
 
     def getUTCDateTime(self, debug=False):
         """return UTC date time or None when nothing if found"""
-        msg = self._read_message(messagetype='RMC', debug=debug)
-        if msg is not None:
-            utc_time = msg['UTCTime']
-            utc_date = msg['Date']
-            if str(utc_date)[-2:] == '80':
-                return None
-            return "20{}-{}-{}T{}:{}:{}+00:00".format(utc_date[4:6], utc_date[2:4], utc_date[0:2],
-                                                      utc_time[0:2], utc_time[2:4], utc_time[4:6])
-        else:
+        utc = self.getUTCDateTimeTuple(debug=debug)
+        if utc is None:
             return None
+        return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}+00:00".format(*utc)
 
     def getUTCDateTimeTuple(self, debug=False):
         """return UTC date time or None when nothing if found"""
-        msg = self._read_message(messagetype='RMC', debug=debug)
-        if msg is not None:
-            utc_time = msg['UTCTime']
-            utc_date = msg['Date']
+        state = self._snapshot(debug=debug)
+        if state is not None and state.utc is not None and state.date is not None:
+            utc_time = state.utc
+            utc_date = state.date
             if debug:
-                print('utc_date type: %s' % type(utc_date))
-            if str(utc_date)[-2:] == '80':
+                print('utc_date: %06d' % utc_date)
+            # The chip reports 2080 until it has a valid date
+            if utc_date % 100 == 80:
                 return None
-            year = '20'
-            year += utc_date[4:6]
-            return (int(year), int(utc_date[2:4]), int(utc_date[0:2]), int(utc_time[0:2]), int(utc_time[2:4]), int(utc_time[4:6]))
+            return (2000 + utc_date % 100, utc_date // 100 % 100, utc_date // 10000,
+                    utc_time // 10000, utc_time // 100 % 100, utc_time % 100)
         else:
             return None
 
-    def _query_pmtk(self, message=None, checksum=None, returnmessage=None, timeout=5, tries=12, debug=False):
-        """query the gps chip for pmtk messages"""
-        while tries >= 0:
-            tries -= 1
+    def _pmtk_transact(self, commands, timeout=2, resend=0.5, debug=False):
+        """
+        PMTK request/response engine.
+        commands is a list of (message, answer): message is the sentence body
+        ('PMTK220,1000'), answer the header of the answer of a query ('PMTK705')
+        or None to wait for the PMTK001 ack of the command.
+        All commands are sent at once and the answers are matched in the same read
+        pass, commands without answer are resent every resend seconds until timeout.
+        Returns per command the ack flag (PMTK_ACK_*), the answer hash or None
+        """
+        results = [None] * len(commands)
+        waiting = list(range(len(commands)))
+        expected = ['PMTK001']
+        for message, answer in commands:
+            if answer is not None and answer not in expected:
+                expected.append(answer)
+        expected = tuple(expected)
+        chrono = Timer.Chrono()
+        chrono.reset()
+        chrono.start()
+        next_send = 0
+        while waiting and chrono.read() < timeout:
+            if chrono.read() >= next_send:
+                for i in waiting:
+                    message = commands[i][0]
+                    self._send_message(message=message, checksum=self._get_checksum(message), debug=debug)
+                next_send = chrono.read() + resend
+            pmtk_answer = self._read_message(messagetype=expected, timeout=min(next_send, timeout) - chrono.read(),
+                                             debug=debug)
+            if not isinstance(pmtk_answer, dict):
+                continue
             if debug:
-                print("*"*20,tries,"*"*20)
-            self._send_message(message=message, checksum=checksum, debug=debug)
-            pmtk_answer = self._read_message(messagetype=returnmessage, timeout=timeout, debug=debug)
-            if pmtk_answer is not None:
-                if debug:
-                    print(pmtk_answer)
-                return pmtk_answer
-        return None
+                print(pmtk_answer)
+            header = pmtk_answer['PMTK']
+            for i in waiting:
+                message, answer = commands[i]
+                if header == 'PMTK001':
+                    # acks carry the command id, PMTK314 -> '314'
+                    if pmtk_answer['command'] != message.split(',')[0][4:]:
+                        continue
+                    flag = int(pmtk_answer['flag'])
+                    if answer is None:
+                        results[i] = flag
+                    elif flag == PMTK_ACK_OK:
+                        # query acknowledged, the answer is still to come
+                        continue
+                elif header == answer:
+                    results[i] = pmtk_answer
+                else:
+                    continue
+                waiting.remove(i)
+                break
+        chrono.stop()
+        if debug:
+            print("pmtk", [c[0] for c in commands], "->", results, "in", chrono.read(), "seconds")
+        return results
+
+    def _query_pmtk(self, message=None, checksum=None, returnmessage=None, timeout=2, debug=False):
+        """query the gps chip for pmtk messages, returns the answer hash or None"""
+        if checksum is not None and checksum != self._get_checksum(message):
+            print(self._get_checksum(message), "<>", checksum)
+            return None
+        return self._pmtk_transact([(message, returnmessage)], timeout=timeout, debug=debug)[0]
 
     def get_locus_query_status(self, debug=False):
         """get the locus messages"""
@@ -427,17 +401,88 @@ class L76GNSS:
         locus_status = self._query_pmtk(message='PMTK183', checksum='38', returnmessage='PMTKLOG')
         return locus_status
 
-    def get_chip_version(self, debug=False):
-        """get the version of the chip (non published command) """
-        version = self._query_pmtk(message='PQVERNO,R',checksum='3F',returnmessage='PQVERNO',debug=debug)
-        if debug:
-            print(version)
+    def identify(self, timeout=None, debug=False):
+        """release info and chip version, both queries pipelined in one read pass"""
+        if timeout is None:
+            timeout = self.pmtk_timeout
+        dt_release, version = self._pmtk_transact([('PMTK605', 'PMTK705'), ('PQVERNO,R', 'PQVERNO')],
+                                                  timeout=timeout, debug=debug)
+        self._set_dt_release(dt_release)
+        self._set_chip_version(version)
+        return dt_release, version
+
+    def _save_identification(self):
+        """caches the identification of the chip in NVS, it doesnt change between wakeups"""
+        if self.ChipVersionID is None or self.ReleaseString is None:
+            return
+        pycom.nvs_set(self.NVS_RELEASE, self.release)
+        pycom.nvs_set(self.NVS_NMEA_VERSION, self.NMEAVersion)
+
+    def invalidate_identification(self):
+        """forget the cached chip identification, the next nmea_version() asks the chip again"""
+        for key in (self.NVS_RELEASE, self.NVS_NMEA_VERSION):
+            nvsutil.erase(key)
+        self.NMEAVersion = 301
+        self._identified = False
+
+    def nmea_version(self, debug=False):
+        """
+        NMEA version of the chip (301 or 410). Loaded from the NVS cache, or on the
+        first use identifies the chip and caches the result. On a cold start the
+        cache is only used if the chip still has the release it was made for
+        """
+        if not self._identified:
+            release = nvsutil.get(self.NVS_RELEASE)
+            version = nvsutil.get(self.NVS_NMEA_VERSION)
+            if release is not None and version is not None:
+                self.release = release
+                self.NMEAVersion = version
+                self._identified = True
+                if self.cold_start:
+                    # One round trip, a different release drops the cache (_set_dt_release)
+                    self.cold_start = False
+                    dt_release = self._pmtk_transact([('PMTK605', 'PMTK705')], timeout=self.pmtk_timeout,
+                                                     debug=debug)[0]
+                    self._set_dt_release(dt_release)
+            if not self._identified:
+                self.identify(debug=debug)
+                self._save_identification()
+                # Dont ask again on every call if the chip didnt answer
+                self._identified = True
+        return self.NMEAVersion
+
+    def _set_chip_version(self, version):
         # keywords = ['PMTK', 'command', 'ChipVersionID','date','time']
+        if version is None:
+            return
         self.ChipVersionID = version['ChipVersionID']
         if int(version['ChipVersionID'][6:8]) > 1:
             self.NMEAVersion = 410
         else:
             self.NMEAVersion = 301
+        self._identified = True
+
+    def _set_dt_release(self, dt_release):
+        if dt_release is None:
+            return
+        rs = (dt_release['ReleaseString'].split('_'))[1]
+        self.release = int('{}{:02d}'.format(rs.split('.')[0],int(rs.split('.')[1])))
+        cached = nvsutil.get(self.NVS_RELEASE)
+        if cached is not None and cached != self.release:
+            # Other gps firmware than the one the cache was made for
+            self.invalidate_identification()
+        self.ReleaseString = dt_release['ReleaseString']
+        self.BuildID = dt_release['BuildID']
+        self.ProductModel = dt_release['ProductModel']
+        self.SDK = dt_release['SDK']
+
+    def get_chip_version(self, debug=False):
+        """get the version of the chip (non published command) """
+        version = self._query_pmtk(message='PQVERNO,R',checksum='3F',returnmessage='PQVERNO',debug=debug)
+        if debug:
+            print(version)
+        self._set_chip_version(version)
+        self._save_identification()
         return version
 
     def get_dt_release(self, debug=False):
@@ -445,13 +490,8 @@ class L76GNSS:
         dt_release = self._query_pmtk(message='PMTK605', checksum='31', returnmessage='PMTK705')
         if debug:
             print(dt_release)
-        if dt_release is not None:
-            rs = (dt_release['ReleaseString'].split('_'))[1]
-            self.release = int('{}{:02d}'.format(rs.split('.')[0],int(rs.split('.')[1])))
-            self.ReleaseString = dt_release['ReleaseString']
-            self.BuildID = dt_release['BuildID']
-            self.ProductModel = dt_release['ProductModel']
-            self.SDK = dt_release['SDK']
+        self._set_dt_release(dt_release)
+        self._save_identification()
         return dt_release
 
     def _send_message(self, message, checksum, debug=False):
@@ -460,7 +500,7 @@ class L76GNSS:
         if checksum == checksum_calc:
             if debug:
                 print(checksum, "ok")
-            message = bytearray('${}*{}\r\n'.format(message,checksum))
+            message = '${}*{}\r\n'.format(message, checksum).encode()
             self.i2c.writeto(GPS_I2CADDR, message)
         else:
             print(checksum_calc , "<>", checksum)
@@ -474,6 +514,7 @@ class L76GNSS:
         """ HotStart the receiver, using data in nv store"""
         message = bytearray('$PMTK101*32\r\n')
         self.i2c.writeto(GPS_I2CADDR, message)
+        self.stream.reset()
         self.fix = False
         # return self._read_message(messagetype='001', debug=debug)
 
@@ -481,6 +522,7 @@ class L76GNSS:
         """ warmStart the receiver, not using data in nv store, using last know messages"""
         message = bytearray('$PMTK102*31\r\n')
         self.i2c.writeto(GPS_I2CADDR, message)
+        self.stream.reset()
         self.fix = False
         # return self._read_message(messagetype='001', debug=debug)
 
@@ -488,6 +530,7 @@ class L76GNSS:
         """ coldStart the receiver, not using any data """
         message = bytearray('$PMTK103*30\r\n')
         self.i2c.writeto(GPS_I2CADDR, message)
+        self.stream.reset()
         self.fix = False
         # return self._read_message(messagetype='001', debug=debug)
 
@@ -495,6 +538,7 @@ class L76GNSS:
         """ full cold start the receiver, as cold start as in powercycle"""
         message = bytearray('$PMTK104*37\r\n')
         self.i2c.writeto(GPS_I2CADDR, message)
+        self.stream.reset()
         self.fix = False
         # return self._read_message(messagetype='001', debug=debug)
 
@@ -526,22 +570,111 @@ class L76GNSS:
     def setAlwaysOn(self, debug=False):
         self.setPeriodicMode(mode=0)
 
-    def setAlwaysLocateMode(self, mode=8, debug=False):
-        if mode in (8, 9):
-            message = 'PMTK225,{}'.format(mode)
-            checksum = self._get_checksum(message)
-            message = bytearray('${}*{}\r\n'.format(message, checksum))
-            if debug:
-                print("setAlwaysLocateMode",message)
-            self.i2c.writeto(GPS_I2CADDR, message)
-            return True
-            # response = self._read_message(messagetype='001', debug=debug)
-            # if debug:
-            #     print("response",response)
-            # if response['response'] == 3:
-            #     return True
-            # else:
-            #     return False
+    @staticmethod
+    def _pmtk_message(command, args=()):
+        """sentence body of a PMTK command, _pmtk_message(220, (1000,)) -> 'PMTK220,1000'"""
+        message = 'PMTK{}'.format(command)
+        for arg in args:
+            message += ',{}'.format(arg)
+        return message
+
+    def _pmtk_ack(self, command, args=(), timeout=1, debug=False):
+        """
+        send $PMTK<command>,<args> and wait for the PMTK001 ack of that command.
+        returns the ack flag (PMTK_ACK_OK when the setting is applied) or None without ack
+        """
+        return self._pmtk_transact([(self._pmtk_message(command, args), None)], timeout=timeout, debug=debug)[0]
+
+    def _set_epoch_sentences(self, output):
+        """an epoch is complete once all the enabled sentences (PMTK314 rates) came in"""
+        gll, rmc, vtg, gga, gsa, gsv = output
+        want = 0
+        for rate, bit in ((rmc, EPOCH_RMC), (gga, EPOCH_GGA), (gsa, EPOCH_GSA), (vtg, EPOCH_VTG)):
+            if rate == 1:
+                want |= bit
+        self.state.want = want or EPOCH_ALL
+        self.state.reset()
+
+    def set_nmea_output(self, gll=0, rmc=1, vtg=1, gga=1, gsa=1, gsv=1, debug=False):
+        """
+        PMTK314, select the sentences the L76 outputs. Each value is the output rate
+        in fixes: 0 off, 1 every fix, n every n-th fix. Returns True when acknowledged
+        e.g. set_nmea_output(rmc=1, gga=1, vtg=0, gsa=0, gsv=0) for tracking
+        """
+        output = (gll, rmc, vtg, gga, gsa, gsv)
+        if self._pmtk_ack(314, output + (0,) * 13, debug=debug) != PMTK_ACK_OK:
+            return False
+        self._set_epoch_sentences(output)
+        return True
+
+    def set_nmea_default_output(self, debug=False):
+        """PMTK314,-1 back to the default sentence output of the chip"""
+        if self._pmtk_ack(314, (-1,), debug=debug) != PMTK_ACK_OK:
+            return False
+        self.state.want = EPOCH_ALL
+        self.state.reset()
+        return True
+
+    def set_fix_interval(self, interval=1000, debug=False):
+        """PMTK220, position fix interval in ms (100 - 10000). Returns True when acknowledged"""
+        return self._pmtk_ack(220, (interval,), debug=debug) == PMTK_ACK_OK
+
+    def configure(self, periodic_mode=None, nmea_output=None, fix_interval=None, timeout=1, debug=False):
+        """
+        applies several settings with the commands pipelined in one read pass:
+        periodic_mode (PMTK225 mode, 0 is always on), nmea_output (PMTK314 rates as
+        (gll, rmc, vtg, gga, gsa, gsv)) and fix_interval (PMTK220 ms).
+        An nmea_output without ack falls back to the default output (PMTK314,-1).
+        Returns True when every given setting was acknowledged
+        """
+        commands = []
+        output_index = None
+        if periodic_mode is not None:
+            commands.append((self._pmtk_message(225, (periodic_mode,)), None))
+        if nmea_output is not None:
+            output_index = len(commands)
+            commands.append((self._pmtk_message(314, tuple(nmea_output) + (0,) * 13), None))
+        if fix_interval is not None:
+            commands.append((self._pmtk_message(220, (fix_interval,)), None))
+        results = self._pmtk_transact(commands, timeout=timeout, debug=debug)
+        if output_index is not None:
+            if results[output_index] == PMTK_ACK_OK:
+                self._set_epoch_sentences(nmea_output)
+            else:
+                # Without the ack it isnt known which sentences the chip outputs now,
+                # back to its default output so the epochs match state.want again
+                self._pmtk_ack(314, (-1,), timeout=timeout, debug=debug)
+                self.state.want = EPOCH_ALL
+                self.state.reset()
+        for flag in results:
+            if flag != PMTK_ACK_OK:
+                return False
+        return True
+
+    def set_reference(self, utc, latitude=None, longitude=None, altitude=0, timeout=1, debug=False):
+        """
+        aiding for a cold start: PMTK740 reference UTC time and, with a position,
+        PMTK741 reference location (decimal degrees, altitude in m).
+        utc is a (year, month, day, hour, minute, second, ...) tuple.
+        Returns True when acknowledged
+        """
+        when = tuple(utc[:6])
+        commands = [(self._pmtk_message(740, when), None)]
+        if latitude is not None and longitude is not None:
+            position = ('{:.6f}'.format(latitude), '{:.6f}'.format(longitude), '{:.1f}'.format(altitude))
+            commands.append((self._pmtk_message(741, position + when), None))
+        for flag in self._pmtk_transact(commands, timeout=timeout, debug=debug):
+            if flag != PMTK_ACK_OK:
+                return False
+        return True
+
+    def write_raw(self, data):
+        """writes bytes to the gps as they are (binary packets)"""
+        self.i2c.writeto(GPS_I2CADDR, data)
+
+    def read_raw(self, buf):
+        """reads from the gps into buf, bypassing the sentence stream"""
+        self.i2c.readfrom_into(GPS_I2CADDR, buf)
 
     def _get_checksum(self, message):
         """calculates the checksum"""
@@ -0,0 +1,150 @@
+# Energy accounting of the wake cycles
+# Estimates the charge every wakeup and sleep draws from the battery: the
+# phase timings of lib/profiler.py times the current of what is powered during
+# each phase (ConfigEnergy, ConfigGPS), plus the deep sleep (with or without
+# the gps kept powered) charged on the next wakeup for the time it really
+# lasted. Running totals per activity are kept in NVS and published every
+# ConfigEnergy.PUBLISH_WAKES wakeups with the battery voltage.
+# Without the profiler only the time awake is known: cpu, radio and a
+# tracking gps for all of it
+# author: callen
+#
+# NVS: ConfigEnergy.NVS_PREFIX + activity letter, uint32 totals in 0.01 uAh
+# (wrap at 42.9 Ah)
+#
+
+import utime
+import pycom
+from config import ConfigEnergy, ConfigGPS
+from lib import profiler
+from lib.pycoproc import WAKE_REASON_ACCELEROMETER
+from lib import nvsutil
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+CPU = const(0)
+WIFI = const(1)
+LTE = const(2)
+GPS = const(3)
+BLE = const(4)
+SLEEP = const(5)
+ACTIVITY_NAMES = ('cpu', 'wifi', 'lte', 'gps', 'ble', 'sleep')
+
+# Charge unit in NVS, 0.01 uAh: a 15 s deep sleep is 8 of them
+_UNITS_PER_MAH = const(100000)
+# 1 mA for 1 ms in units
+_MA_MS = _UNITS_PER_MAH / 3600000
+# Bit of ConfigEnergy.NVS_SLEEP set if the gps stayed powered
+_SLEEP_GPS = const(0x80000000)
+
+
+class EnergyMeter:
+
+    def __init__(self, pytrack, debug=False):
+        self.pytrack = pytrack
+        self.debug = debug
+        # Radio the wakeup uses (WIFI or LTE), set by the tracker
+        self.radio = WIFI
+        # Charge (units) measured directly in this wakeup, e.g. a bluetooth scan
+        self._extra = [0] * len(ACTIVITY_NAMES)
+
+    @staticmethod
+    def _key(activity):
+        return ConfigEnergy.NVS_PREFIX + ACTIVITY_NAMES[activity][0]
+
+    def _store(self, charges):
+        for activity, charge in enumerate(charges):
+            units = int(charge + 0.5)
+            if units:
+                key = self._key(activity)
+                pycom.nvs_set(key, ((nvsutil.get(key) or 0) + units) & 0xFFFFFFFF)
+
+    def wakeup(self):
+        '''
+        Charges the sleep that just ended. An accelerometer wakeup ends the sleep early, the Pytrack
+        tells how much of it was left
+        '''
+        planned = nvsutil.get(ConfigEnergy.NVS_SLEEP)
+        if planned is None:
+            return
+        pycom.nvs_erase(ConfigEnergy.NVS_SLEEP)
+        seconds = planned & ~_SLEEP_GPS
+        try:
+            if self.pytrack.get_wake_reason() == WAKE_REASON_ACCELEROMETER:
+                seconds = max(seconds - self.pytrack.get_sleep_remaining(), 0)
+        except Exception as e:
+            if self.debug:
+                print("Exception reading the sleep remaining: {}".format(e))
+        current = ConfigEnergy.DEEP_SLEEP_MA + (ConfigGPS.RETAIN_CURRENT_MA if planned & _SLEEP_GPS else 0)
+        charges = [0] * len(ACTIVITY_NAMES)
+        charges[SLEEP] = current * seconds * 1000 * _MA_MS
+        self._store(charges)
+
+    def add(self, activity, ms, current):
+        """charges ms at current (mA) to activity, for what the phases do not cover"""
+        self._extra[activity] += current * ms * _MA_MS
+
+    def _awakeCharges(self, phases, awakeMs):
+        """charge (units) per activity of a wakeup from its phase times (ms, None without the profiler)"""
+        charges = list(self._extra)
+        charges[CPU] += ConfigEnergy.CPU_ACTIVE_MA * awakeMs * _MA_MS
+        gpsMs = 0
+        txMs = 0
+        attachMs = 0
+        if phases is not None:
+            gpsMs = phases[profiler.GPS_INIT] + phases[profiler.GPS_FIX]
+            txMs = phases[profiler.MQTT_CONNECT] + phases[profiler.PUBLISH]
+            attachMs = phases[profiler.BOOT] + phases[profiler.INIT]
+        # The Pytrack powers the gps from boot, it is acquiring during a fix and tracking the rest of the time
+        charges[GPS] += (ConfigGPS.ACQUIRE_CURRENT_MA * gpsMs + ConfigEnergy.GPS_TRACK_MA * (awakeMs - gpsMs)) * _MA_MS
+        if self.radio == LTE:
+            charges[LTE] += (ConfigEnergy.LTE_ATTACH_MA * attachMs + ConfigEnergy.LTE_TX_MA * txMs +
+                             ConfigEnergy.LTE_IDLE_MA * max(awakeMs - attachMs - txMs, 0)) * _MA_MS
+        else:
+            charges[WIFI] += ConfigEnergy.WIFI_MA * awakeMs * _MA_MS
+        return charges
+
+    def sleep(self, sleepTime, gpsPowered, phases=None):
+        '''
+        Adds the charge of this wakeup to the totals and remembers the coming sleep (sleepTime seconds,
+        gpsPowered if the gps stays powered), charged on the next wakeup.
+        phases - times (ms) per profiler phase, as profiler.end_wake returns them
+        '''
+        awakeMs = phases[profiler.AWAKE] if phases is not None else utime.ticks_ms()
+        self._store(self._awakeCharges(phases, awakeMs))
+        self._extra = [0] * len(ACTIVITY_NAMES)
+        pycom.nvs_set(ConfigEnergy.NVS_SLEEP, min(int(sleepTime), _SLEEP_GPS - 1) |
+                      (_SLEEP_GPS if gpsPowered else 0))
+        pycom.nvs_set(ConfigEnergy.NVS_WAKES, (nvsutil.get(ConfigEnergy.NVS_WAKES) or 0) + 1)
+
+    def totals(self):
+        """mAh drawn per activity name"""
+        return {name: (nvsutil.get(self._key(activity)) or 0) / _UNITS_PER_MAH
+                for activity, name in enumerate(ACTIVITY_NAMES)}
+
+    def due(self):
+        """true if the totals were not published for ConfigEnergy.PUBLISH_WAKES wakeups"""
+        wakes = nvsutil.get(ConfigEnergy.NVS_WAKES) or 0
+        return wakes - (nvsutil.get(ConfigEnergy.NVS_SENT) or 0) >= ConfigEnergy.PUBLISH_WAKES
+
+    def message(self):
+        '''
+        Telemetry message of the totals: {"mAh": {activity: mAh}, "total": mAh, "wakes": wakeups counted,
+        "battery": volts}
+        '''
+        totals = self.totals()
+        wakes = nvsutil.get(ConfigEnergy.NVS_WAKES) or 0
+        try:
+            battery = round(self.pytrack.read_battery_voltage(), 2)
+        except Exception:
+            battery = None
+        return {'mAh': {name: round(mAh, 3) for name, mAh in totals.items()},
+                'total': round(sum(totals.values()), 3), 'wakes': wakes, 'battery': battery}
+
+    def sent(self):
+        """the message is queued, the next one is due in ConfigEnergy.PUBLISH_WAKES wakeups"""
+        pycom.nvs_set(ConfigEnergy.NVS_SENT, nvsutil.get(ConfigEnergy.NVS_WAKES) or 0)
@@ -0,0 +1,279 @@
+# EPO (extended prediction orbit) assistance for the quectel L76
+# The EPO file is downloaded over mqtt in chunks and kept on flash. Before a
+# cold start the sets that are still valid are sent to the L76 as MTK binary
+# packets (3 satellites per packet, every packet acked by the chip), then the
+# reference time (PMTK740) and position (PMTK741) are injected from the rtc
+# and the last known fix
+# author: callen
+#
+# EPO file: sets of 32 satellite records of 72 bytes, each set is valid for 6
+# hours. The first 3 bytes (little endian) of a record are its GPS hour.
+#
+# MQTT download: the tracker publishes the GPS hour it wants the file to start
+# at on ConfigMqtt.TOPIC_EPO_REQUEST, the server answers on ConfigMqtt.TOPIC_EPO
+# with the file in chunks of <index:uint16><count:uint16><data> (big endian)
+#
+
+import os
+import time
+import ustruct as struct
+import pycom
+from config import ConfigGPS
+from lib import nvsutil
+from lib import timeutil
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+EPO_SAT_SIZE = const(72)
+EPO_SET_SIZE = const(2304)  # 32 satellites
+EPO_SET_HOURS = const(6)
+
+# MTK binary packets: 0x04 0x24, length, command, payload, xor checksum, \r\n
+BIN_ACK = const(2)
+BIN_EPO = const(722)
+BIN_SET_NMEA = const(253)
+_BIN_OVERHEAD = const(9)
+_PACKET_SATS = const(3)
+EPO_PACKET_SIZE = const(227)  # 2 byte sequence and 3 satellites
+EPO_SEQ_END = const(0xFFFF)
+_ACK_SIZE = const(12)
+
+# PMTK253,1,0 switches the L76 from NMEA to binary packets at the current baudrate
+_PMTK_BINARY_MODE = b'$PMTK253,1,0*37\r\n'
+
+_GPS_EPOCH_DAYS = const(3657)  # 1980-01-06 in days since 1970-01-01
+
+
+def gps_hour(utc):
+    """hours since the GPS epoch of a (year, month, day, hour, ...) utc tuple"""
+    return (timeutil.days_from_civil(utc[0], utc[1], utc[2]) - _GPS_EPOCH_DAYS) * 24 + utc[3]
+
+
+def _seal(packet):
+    """fills in length, checksum and tail of a binary packet (payload already in place)"""
+    size = len(packet)
+    packet[0] = 0x04
+    packet[1] = 0x24
+    packet[2] = size & 0xFF
+    packet[3] = size >> 8
+    checksum = 0
+    for i in range(2, size - 3):
+        checksum ^= packet[i]
+    packet[size - 3] = checksum
+    packet[size - 2] = 0x0D
+    packet[size - 1] = 0x0A
+    return packet
+
+
+def binary_packet(command, payload=b''):
+    """a complete MTK binary packet"""
+    packet = bytearray(len(payload) + _BIN_OVERHEAD)
+    packet[4] = command & 0xFF
+    packet[5] = command >> 8
+    packet[6:6 + len(payload)] = payload
+    return _seal(packet)
+
+
+def find_ack(data):
+    """
+    looks for the binary ack of an EPO packet in data.
+    Returns (sequence, result, end) of the first valid ack or None, end is the index after it
+    """
+    start = data.find(b'\x04\x24')
+    while 0 <= start <= len(data) - _ACK_SIZE:
+        if data[start + 2] == _ACK_SIZE and data[start + 3] == 0 and data[start + 4] == BIN_ACK \
+                and data[start + 5] == 0:
+            checksum = 0
+            for i in range(start + 2, start + _ACK_SIZE - 3):
+                checksum ^= data[i]
+            if checksum == data[start + _ACK_SIZE - 3]:
+                return (data[start + 6] | data[start + 7] << 8, data[start + 8], start + _ACK_SIZE)
+        start = data.find(b'\x04\x24', start + 1)
+    return None
+
+
+class EPOLoader:
+
+    def __init__(self, gps=None, path=None, debug=False):
+        self.gps = gps
+        self.path = path or ConfigGPS.EPO_FILE
+        self.debug = debug
+        # File being received over mqtt and the chunk expected next
+        self._download = None
+        self._nextChunk = 0
+        self._packet = bytearray(EPO_PACKET_SIZE)
+        self._rx = bytearray(255)
+
+    def sets(self, nowHour):
+        """
+        the sets of the file on flash that are (still) valid at nowHour:
+        (index of the first one, number of sets, GPS hour the last one ends) or None
+        """
+        try:
+            size = os.stat(self.path)[6]
+        except OSError:
+            return None
+        first = None
+        end = None
+        loaded = 0
+        with open(self.path, 'rb') as f:
+            for i in range(size // EPO_SET_SIZE):
+                f.seek(i * EPO_SET_SIZE)
+                head = f.read(3)
+                hour = head[0] | head[1] << 8 | head[2] << 16
+                if hour + EPO_SET_HOURS <= nowHour:
+                    continue
+                if first is None:
+                    first = i
+                end = hour + EPO_SET_HOURS
+                loaded += 1
+                if loaded == ConfigGPS.EPO_MAX_SETS:
+                    break
+        if first is None:
+            return None
+        return (first, loaded, end)
+
+    def validHours(self, nowHour):
+        """hours of prediction the file on flash still covers"""
+        sets = self.sets(nowHour)
+        return 0 if sets is None else sets[2] - nowHour
+
+    def needsDownload(self, nowHour):
+        return self.validHours(nowHour) < ConfigGPS.EPO_REFRESH_HOURS
+
+    def startDownload(self):
+        """opens the temporary file the mqtt chunks are written to"""
+        self._download = open(self.path + '.part', 'wb')
+        self._nextChunk = 0
+
+    def handleChunk(self, msg):
+        '''
+        Writes one chunk received on ConfigMqtt.TOPIC_EPO to flash.
+        Returns True once the last chunk is in and the file replaced the previous one
+        '''
+        if self._download is None or len(msg) < 4:
+            return False
+        index, count = struct.unpack_from('!HH', msg, 0)
+        if index != self._nextChunk:
+            # Lost or repeated chunk, the whole file is requested again next time
+            if self.debug:
+                print("EPO chunk {} while expecting {}".format(index, self._nextChunk))
+            self.abortDownload()
+            return False
+        self._download.write(memoryview(msg)[4:])
+        self._nextChunk += 1
+        if self._nextChunk < count:
+            return False
+        self._download.close()
+        self._download = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        os.rename(self.path + '.part', self.path)
+        return True
+
+    def abortDownload(self):
+        if self._download is not None:
+            self._download.close()
+            self._download = None
+            os.remove(self.path + '.part')
+
+    def _waitAck(self, seq, timeout):
+        """reads the gps until the ack of packet seq, returns its result or None on timeout"""
+        gps = self.gps
+        pending = b''
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < timeout * 1000:
+            gps.read_raw(self._rx)
+            pending = pending[-(_ACK_SIZE - 1):] + self._rx
+            ack = find_ack(pending)
+            while ack is not None:
+                if ack[0] == seq:
+                    return ack[1]
+                pending = pending[ack[2]:]
+                ack = find_ack(pending)
+        return None
+
+    def _sendPacket(self, seq):
+        """sends the packet in self._packet, resending it until acked. Returns True when acked"""
+        for attempt in range(ConfigGPS.EPO_PACKET_RETRIES):
+            self.gps.write_raw(self._packet)
+            if self._waitAck(seq, ConfigGPS.EPO_ACK_TIMEOUT):
+                return True
+        if self.debug:
+            print("EPO packet {} not acknowledged".format(seq))
+        return False
+
+    def upload(self, nowHour, force=False):
+        '''
+        Sends the valid EPO sets to the L76 (binary mode, one acked packet per 3 satellites).
+        The L76 keeps them, so the same file is only sent once unless force is set.
+        Returns True when the gps holds valid EPO data
+        '''
+        sets = self.sets(nowHour)
+        if sets is None:
+            return False
+        first, count, end = sets
+        if not force and nvsutil.get(ConfigGPS.NVS_EPO_LOADED) == end:
+            return True
+
+        gps = self.gps
+        packet = self._packet
+        view = memoryview(packet)
+        seq = 0
+        ok = True
+        gps.write_raw(_PMTK_BINARY_MODE)
+        time.sleep_ms(100)
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(first * EPO_SET_SIZE)
+                records = count * EPO_SET_SIZE // EPO_SAT_SIZE
+                while ok and records > 0:
+                    sats = min(records, _PACKET_SATS)
+                    packet[4] = BIN_EPO & 0xFF
+                    packet[5] = BIN_EPO >> 8
+                    packet[6] = seq & 0xFF
+                    packet[7] = seq >> 8
+                    f.readinto(view[8:8 + sats * EPO_SAT_SIZE])
+                    for i in range(8 + sats * EPO_SAT_SIZE, EPO_PACKET_SIZE - 3):
+                        packet[i] = 0
+                    _seal(packet)
+                    ok = self._sendPacket(seq)
+                    records -= sats
+                    seq += 1
+            # Sequence 0xFFFF with no data ends the transfer
+            for i in range(4, EPO_PACKET_SIZE - 3):
+                packet[i] = 0
+            packet[4] = BIN_EPO & 0xFF
+            packet[5] = BIN_EPO >> 8
+            packet[6] = packet[7] = 0xFF
+            if ok:
+                _seal(packet)
+                self._sendPacket(EPO_SEQ_END)
+        finally:
+            # Back to NMEA output at the current baudrate
+            gps.write_raw(binary_packet(BIN_SET_NMEA, b'\x00\x00\x00\x00\x00'))
+            gps.stream.reset()
+        if ok:
+            pycom.nvs_set(ConfigGPS.NVS_EPO_LOADED, end)
+        if self.debug:
+            print("EPO upload of {} sets ({} packets) {}".format(count, seq, 'done' if ok else 'failed'))
+        return ok
+
+    def assist(self, utc, position=None, force=False):
+        '''
+        Prepares a cold start: uploads the EPO file (if not loaded yet) and injects the
+        reference time and last known position. utc is a (year, month, day, hour, minute, second) tuple
+        from a synced rtc, position a (latitude, longitude) tuple or None.
+        Returns True when the gps has EPO data and acknowledged the reference
+        '''
+        loaded = self.upload(gps_hour(utc), force=force)
+        if position is None:
+            position = (None, None)
+        referenced = self.gps.set_reference(utc, position[0], position[1])
+        return loaded and referenced
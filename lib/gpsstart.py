@@ -0,0 +1,148 @@
+# GPS start strategy for the tracker
+# Keeps track (in NVS) of when and where the last fix was and whether the gps
+# stayed powered during sleep. From that it picks a hot, warm or cold start
+# with a matching timeout per attempt, decides if keeping the gps powered over
+# the next sleep is worth its current, and records the time to first fix (TTFF)
+# per strategy
+# author: callen
+#
+
+import utime
+import pycom
+from config import ConfigGPS
+from lib import nvsutil
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+START_HOT = const(0)
+START_WARM = const(1)
+START_COLD = const(2)
+# Cold start with EPO data, reference time and position injected (lib/epo.py)
+START_ASSISTED = const(3)
+STRATEGY_NAMES = ('hot', 'warm', 'cold', 'assisted')
+
+# Latitude / longitude are kept as positive micro degrees, NVS only holds 32 bit integers
+_LAT_OFFSET = const(90000000)
+_LON_OFFSET = const(180000000)
+
+
+class GpsStartStrategy:
+
+    def __init__(self, debug=False):
+        self.debug = debug
+
+    @staticmethod
+    def _now(now):
+        return utime.time() if now is None else now
+
+    def lastFixAge(self, now=None):
+        """seconds since the last fix, None when unknown (or the clock is not set)"""
+        lastFix = nvsutil.get(ConfigGPS.NVS_LAST_FIX_TIME)
+        now = self._now(now)
+        if lastFix is None or now < lastFix:
+            return None
+        return now - lastFix
+
+    def lastFixPosition(self):
+        """(latitude, longitude) of the last fix or None"""
+        lat = nvsutil.get(ConfigGPS.NVS_LAST_FIX_LAT)
+        lon = nvsutil.get(ConfigGPS.NVS_LAST_FIX_LON)
+        if lat is None or lon is None:
+            return None
+        return ((lat - _LAT_OFFSET) / 1000000, (lon - _LON_OFFSET) / 1000000)
+
+    def choose(self, now=None):
+        '''
+        Picks the start strategy for this wakeup:
+        hot if the gps kept its data and the ephemeris of the last fix is still valid,
+        warm if the gps kept its data (almanac, time and position) but the ephemeris is stale,
+        cold otherwise
+        '''
+        age = self.lastFixAge(now)
+        if not nvsutil.get(ConfigGPS.NVS_GPS_BACKUP) or age is None:
+            strategy = START_COLD
+        elif age < ConfigGPS.EPHEMERIS_VALID_TIME:
+            strategy = START_HOT
+        else:
+            strategy = START_WARM
+        if self.debug:
+            print("GPS start strategy {} (last fix age {})".format(STRATEGY_NAMES[strategy], age))
+        return strategy
+
+    @staticmethod
+    def timeout(strategy):
+        """timeout (seconds) of one fix attempt with the given strategy"""
+        return ConfigGPS.START_TIMEOUTS[strategy]
+
+    @staticmethod
+    def fallback(strategy):
+        """strategy for the next attempt after a failed one, an assisted start falls back to a plain cold start"""
+        return min(strategy + 1, START_COLD)
+
+    @staticmethod
+    def apply(gps, strategy, escalated=False):
+        '''
+        Prepares the gps for a fix attempt. On the first attempt the gps simply uses
+        whatever data it kept. After a failed attempt the data it holds is suspect,
+        so the receiver is restarted without ephemeris (warm) or without anything (cold)
+        '''
+        if not escalated:
+            return
+        if strategy == START_WARM:
+            gps.warmStart()
+        elif strategy == START_COLD:
+            gps.coldStart()
+
+    def recordFix(self, strategy, ttff, latitude=None, longitude=None, now=None):
+        """saves the time and position of a fix and adds its ttff to the strategy statistics"""
+        pycom.nvs_set(ConfigGPS.NVS_LAST_FIX_TIME, self._now(now))
+        if latitude is not None and longitude is not None:
+            pycom.nvs_set(ConfigGPS.NVS_LAST_FIX_LAT, int(round(latitude * 1000000)) + _LAT_OFFSET)
+            pycom.nvs_set(ConfigGPS.NVS_LAST_FIX_LON, int(round(longitude * 1000000)) + _LON_OFFSET)
+        self._addStat(strategy, 'n', 1)
+        self._addStat(strategy, 't', int(ttff))
+
+    def recordFailure(self, strategy):
+        self._addStat(strategy, 'f', 1)
+
+    def _addStat(self, strategy, field, value):
+        key = '{}{}{}'.format(ConfigGPS.NVS_TTFF_PREFIX, STRATEGY_NAMES[strategy][0], field)
+        pycom.nvs_set(key, (nvsutil.get(key) or 0) + value)
+
+    def stats(self):
+        '''
+        Time to first fix statistics per strategy:
+        {'hot': (fixes, mean ttff in seconds or None, failed attempts), ...}
+        '''
+        result = {}
+        for strategy, name in enumerate(STRATEGY_NAMES):
+            prefix = ConfigGPS.NVS_TTFF_PREFIX + name[0]
+            count = nvsutil.get(prefix + 'n') or 0
+            total = nvsutil.get(prefix + 't') or 0
+            result[name] = (count, total / count if count else None, nvsutil.get(prefix + 'f') or 0)
+        return result
+
+    def meanTtff(self, strategy):
+        """measured mean ttff of a strategy, the configured estimate until there are measurements"""
+        count, mean, failures = self.stats()[STRATEGY_NAMES[strategy]]
+        return mean if mean is not None else ConfigGPS.TTFF_ESTIMATES[strategy]
+
+    def retainBackup(self, sleepTime, now=None):
+        '''
+        True if the gps should stay powered (keeping its data) during a sleep of sleepTime seconds.
+        Only if the ephemeris is still valid at wakeup and the acquisition time saved by a hot
+        start costs more than keeping the gps powered over the sleep
+        '''
+        age = self.lastFixAge(now)
+        if age is None or age + sleepTime >= ConfigGPS.EPHEMERIS_VALID_TIME:
+            return False
+        saved = self.meanTtff(START_COLD) - self.meanTtff(START_HOT)
+        return saved * ConfigGPS.ACQUIRE_CURRENT_MA > sleepTime * ConfigGPS.RETAIN_CURRENT_MA
+
+    def setBackup(self, retained):
+        """remembers if the gps stays powered (keeps its data) over the coming sleep"""
+        pycom.nvs_set(ConfigGPS.NVS_GPS_BACKUP, 1 if retained else 0)
@@ -0,0 +1,276 @@
+# Compact binary location payload published on ConfigMqtt.TOPIC_GPS
+# A location is 19 bytes on the wire instead of ~70 for the json / dict
+# form, which means shorter LTE-M transmissions and less data per month.
+# While tracking, fixes can also be batched (FixBatch) and sent as one
+# message of deltas. Pure python so the server side can import it (with
+# timeutil.py) to decode the payloads (decode_points / decode_any), the
+# encoders run on the tracker
+# author: callen
+#
+# Version 1, big endian:
+#   <version:uint8><flags:uint8><latitude:int32><longitude:int32><time:uint32>
+#   <hdop:uint8><speed:uint16><heading:uint16>
+# latitude / longitude in micro degrees, time in seconds since 1970 (UTC),
+# hdop in tenths (255 unknown), speed in tenths of km/h and heading in
+# hundredths of a degree (65535 unknown). Flags: bit 0 fix valid, bit 1
+# differential fix
+#
+# Version 2, a batch of fixes:
+#   <version:uint8><count:varint><first fix: version 1 without the version byte>
+#   then per fix <flags:uint8> and the zigzag varint deltas to the previous fix
+#   of latitude, longitude, time, hdop, speed and heading
+# The deltas are taken on the integer values above, so the server gets back
+# exactly the fixes version 1 would have carried
+#
+
+import os
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+from timeutil import days_from_civil
+
+VERSION = const(1)
+VERSION_BATCH = const(2)
+_FORMAT = '!BBiiIBHH'
+_FIX_FORMAT = '!BiiIBHH'
+SIZE = const(19)
+
+FLAG_VALID = const(0x01)
+FLAG_DGPS = const(0x02)
+
+_HDOP_UNKNOWN = const(0xFF)
+_UNKNOWN = const(0xFFFF)
+_KNOTS_TO_KMH = 1.852
+
+# Payload formats a topic can be published with (ConfigMqtt.LOCATION_FORMATS)
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+FORMAT_BATCH = 'batch'
+
+
+def unix_time(date, utc):
+    """seconds since 1970 of an NMEA date (ddmmyy) and time (hhmmss), None if either is missing"""
+    if date is None or utc is None:
+        return None
+    days = days_from_civil(2000 + date % 100, date // 100 % 100, date // 10000)
+    return days * 86400 + utc // 10000 * 3600 + utc // 100 % 100 * 60 + utc % 100
+
+
+def encode(latitude, longitude, timestamp, hdop=None, speed=None, heading=None, valid=True, dgps=False, buf=None):
+    '''
+    Version 1 payload of a location. latitude / longitude in degrees, timestamp in
+    seconds since 1970, speed in knots and heading in degrees (as in nmea.Fix).
+    Packs into buf (a bytearray of SIZE) when given, returns the payload
+    '''
+    flags = (FLAG_VALID if valid else 0) | (FLAG_DGPS if dgps else 0)
+    if hdop is None:
+        hdop = _HDOP_UNKNOWN
+    else:
+        hdop = min(int(hdop * 10 + 0.5), _HDOP_UNKNOWN - 1)
+    speed = _UNKNOWN if speed is None else min(int(speed * _KNOTS_TO_KMH * 10 + 0.5), _UNKNOWN - 1)
+    heading = _UNKNOWN if heading is None else int(heading * 100 + 0.5) % 36000
+    values = (VERSION, flags, int(round(latitude * 1000000)), int(round(longitude * 1000000)),
+              int(timestamp or 0), hdop, speed, heading)
+    if buf is None:
+        return struct.pack(_FORMAT, *values)
+    struct.pack_into(_FORMAT, buf, 0, *values)
+    return buf
+
+
+def encode_state(state, timestamp=None, buf=None):
+    """version 1 payload of an nmea.FixState epoch, timestamp defaults to the epoch's own UTC date and time"""
+    if timestamp is None:
+        timestamp = unix_time(state.date, state.utc)
+    return encode(state.latitude, state.longitude, timestamp, hdop=state.hdop, speed=state.speed,
+                  heading=state.cog, valid=state.valid, dgps=state.quality == 2, buf=buf)
+
+
+def _fix_dict(flags, latitude, longitude, timestamp, hdop, speed, heading):
+    return {
+        'latitude': latitude / 1000000,
+        'longitude': longitude / 1000000,
+        'time': timestamp or None,
+        'hdop': None if hdop == _HDOP_UNKNOWN else hdop / 10,
+        'speed': None if speed == _UNKNOWN else speed / 10,
+        'heading': None if heading == _UNKNOWN else heading / 100,
+        'valid': bool(flags & FLAG_VALID),
+        'dgps': bool(flags & FLAG_DGPS),
+    }
+
+
+def decode(payload):
+    '''
+    Location dict of a version 1 payload: latitude / longitude (degrees), time
+    (seconds since 1970), hdop, speed (km/h), heading (degrees), valid and dgps.
+    Unknown values are None. Raises ValueError on an unknown version or size
+    '''
+    if len(payload) < 1 or payload[0] != VERSION:
+        raise ValueError('unknown location payload version')
+    if len(payload) != SIZE:
+        raise ValueError('location payload of {} bytes'.format(len(payload)))
+    return _fix_dict(*struct.unpack(_FORMAT, payload)[1:])
+
+
+# Batches
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _add_varint(buf, value):
+    while value > 0x7F:
+        buf.append(value & 0x7F | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _varint(payload, offset):
+    """(value, next offset) of the varint at offset"""
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(payload):
+            raise ValueError('location batch cut short')
+        byte = payload[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_batch(fixes):
+    '''
+    Version 2 payload of a list of version 1 payloads (oldest first): the first
+    fix as is, the others as deltas to the one before
+    '''
+    buf = bytearray([VERSION_BATCH])
+    _add_varint(buf, len(fixes))
+    previous = None
+    for fix in fixes:
+        values = struct.unpack(_FORMAT, fix)
+        if previous is None:
+            buf.extend(memoryview(fix)[1:SIZE])
+        else:
+            buf.append(values[1])
+            for i in range(2, 8):
+                _add_varint(buf, _zigzag(values[i] - previous[i]))
+        previous = values
+    return bytes(buf)
+
+
+def decode_batch(payload):
+    """the location dicts (as decode returns them) of a version 2 payload, oldest first"""
+    if len(payload) < 1 or payload[0] != VERSION_BATCH:
+        raise ValueError('unknown location payload version')
+    count, offset = _varint(payload, 1)
+    fixes = []
+    if not count:
+        return fixes
+    if len(payload) < offset + SIZE - 1:
+        raise ValueError('location batch cut short')
+    values = list(struct.unpack_from(_FIX_FORMAT, payload, offset))
+    offset += SIZE - 1
+    fixes.append(_fix_dict(*values))
+    for _ in range(count - 1):
+        if offset >= len(payload):
+            raise ValueError('location batch cut short')
+        values[0] = payload[offset]
+        offset += 1
+        for i in range(1, 7):
+            delta, offset = _varint(payload, offset)
+            values[i] += _unzigzag(delta)
+        fixes.append(_fix_dict(*values))
+    return fixes
+
+
+def decode_points(payload):
+    """list of the location dicts in a version 1 or version 2 payload"""
+    if len(payload) and payload[0] == VERSION_BATCH:
+        return decode_batch(payload)
+    return [decode(payload)]
+
+
+def decode_any(payload):
+    """list of the location dicts of a binary (single or batch) or a json payload"""
+    if payload[:1] in (b'{', '{'):
+        return [json.loads(payload)]
+    return decode_points(payload)
+
+
+class FixBatch:
+    '''
+    Fixes waiting to be sent as one batch, kept on flash across the deep sleeps
+    between the fixes of a ride. A file of version 1 payloads, a fix torn by a
+    reset is dropped before the next one is appended, so it does not shift them
+    '''
+
+    def __init__(self, path, maxFixes, maxSeconds):
+        self.path = path
+        self.maxFixes = maxFixes
+        self.maxSeconds = maxSeconds
+
+    def fixes(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return []
+        return [data[i:i + SIZE] for i in range(0, len(data) - SIZE + 1, SIZE) if data[i] == VERSION]
+
+    def add(self, fix):
+        """appends a version 1 payload"""
+        try:
+            torn = os.stat(self.path)[6] % SIZE
+        except OSError:
+            torn = 0
+        if torn:
+            # No truncate on the GPy, the whole fixes are written again
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            with open(self.path, 'wb') as f:
+                f.write(data[:len(data) - torn] + fix)
+            return
+        with open(self.path, 'ab') as f:
+            f.write(fix)
+
+    def due(self, now=None):
+        """true once maxFixes are in or the oldest is maxSeconds old (at now, defaults to the newest fix)"""
+        fixes = self.fixes()
+        if not fixes:
+            return False
+        if len(fixes) >= self.maxFixes:
+            return True
+        first = struct.unpack_from('!I', fixes[0], 10)[0]
+        if now is None:
+            now = struct.unpack_from('!I', fixes[-1], 10)[0]
+        return bool(first) and now - first >= self.maxSeconds
+
+    def payload(self):
+        """the version 2 payload of the fixes in the batch, None if it is empty"""
+        fixes = self.fixes()
+        return encode_batch(fixes) if fixes else None
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,189 @@
+# LTE session of the tracker
+# The modem saves its configuration (APN, scan bands, PSM and eDRX timers)
+# and keeps it through resets and deep sleeps, so it is only provisioned again
+# (reset, configured with the radio off) when ConfigLTE changed since, or when
+# the last attach did not complete: a hash of what it was provisioned with is
+# kept in NVS. With power saving mode the modem goes to sleep registered and
+# the next attach resumes the registration instead of searching the bands and
+# attaching again. start() only starts the attach, ready() moves the session
+# on (connects once attached) and is polled while the tracker does something
+# else. Waits poll the modem every ConfigLTE.POLL_MS instead of fixed delays.
+# The latencies of the wakeup are kept in stats
+# author: callen
+#
+# NVS: ConfigLTE.NVS_PROFILE, FNV-1a hash of the provisioning AT commands
+#
+
+import utime
+import pycom
+from config import ConfigLTE
+from lib import nvsutil
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+# Units (seconds) of the 3GPP timers and their codes, largest first: T3412 (periodic TAU) and T3324 (active time)
+_T3412_UNITS = ((1152000, 6), (36000, 2), (3600, 1), (600, 0), (60, 5), (30, 4), (2, 3))
+_T3324_UNITS = ((360, 2), (60, 1), (2, 0))
+# eDRX cycles (seconds), the code is the index
+_EDRX_CYCLES = (5.12, 10.24, 20.48, 40.96, 61.44, 81.92, 102.4, 122.88, 143.36, 163.84, 327.68, 655.36,
+                1310.72, 2621.44, 5242.88, 10485.76)
+# Max time the modem takes to answer again after AT^RESET
+_RESET_TIMEOUT_MS = const(10000)
+
+
+def _timer(seconds, units):
+    """3GPP timer bits (AT+CPSMS) for at least seconds, in the smallest unit that holds them"""
+    for unit, code in reversed(units):
+        value = (seconds + unit - 1) // unit
+        if value < 32:
+            return '{:03b}{:05b}'.format(code, value)
+    return '{:03b}{:05b}'.format(units[0][1], 31)
+
+
+def _edrx(seconds):
+    """eDRX cycle bits (AT+CEDRXS), the shortest cycle of at least seconds"""
+    for code, cycle in enumerate(_EDRX_CYCLES):
+        if cycle >= seconds:
+            return '{:04b}'.format(code)
+    return '{:04b}'.format(len(_EDRX_CYCLES) - 1)
+
+
+def _profile():
+    """AT commands that provision the modem with ConfigLTE"""
+    commands = ['AT!="clearscanconfig"']
+    commands += ['AT!="RRC::addScanBand band={}"'.format(band) for band in ConfigLTE.BANDS]
+    commands.append('AT+CGDCONT=1,"IP","{}"'.format(ConfigLTE.APN))
+    if ConfigLTE.AUTH:
+        commands.append('AT+CGAUTH=1,{},"{}","{}"'.format(*ConfigLTE.AUTH))
+    if ConfigLTE.PSM:
+        commands.append('AT+CPSMS=1,,,"{}","{}"'.format(_timer(ConfigLTE.PSM_PERIOD, _T3412_UNITS),
+                                                       _timer(ConfigLTE.PSM_ACTIVE, _T3324_UNITS)))
+    else:
+        commands.append('AT+CPSMS=0')
+    if ConfigLTE.EDRX_CYCLE:
+        # 4 is E-UTRAN (LTE-M)
+        commands.append('AT+CEDRXS=1,4,"{}"'.format(_edrx(ConfigLTE.EDRX_CYCLE)))
+    else:
+        commands.append('AT+CEDRXS=0')
+    return commands
+
+
+def _hash(commands):
+    return nvsutil.fnv1a(''.join(command + '\n' for command in commands))
+
+
+class LTESession:
+
+    def __init__(self, lte, debug=False):
+        self.lte = lte
+        self.debug = debug
+        self._attachStart = None
+        self._connectStart = None
+        self._failed = False
+        self.stats = {
+            'provisioned': 0,  # 1 if the modem was provisioned in this wakeup
+            'attachMs': None,  # From start() to attached
+            'connectMs': None,  # From attached to connected
+        }
+
+    def provisioned(self):
+        """true if the modem holds the configuration of ConfigLTE"""
+        return nvsutil.get(ConfigLTE.NVS_PROFILE) == _hash(_profile())
+
+    @staticmethod
+    def _waitFor(condition, timeoutMs):
+        """polls condition every ConfigLTE.POLL_MS, false if it is not true after timeoutMs"""
+        start = utime.ticks_ms()
+        while not condition():
+            if utime.ticks_diff(utime.ticks_ms(), start) >= timeoutMs:
+                return False
+            utime.sleep_ms(ConfigLTE.POLL_MS)
+        return True
+
+    def _responds(self):
+        try:
+            return 'OK' in self.lte.send_at_cmd('AT')
+        except Exception:
+            return False
+
+    def provision(self):
+        '''
+        Resets the modem and sends it the configuration of ConfigLTE with the radio off (attach turns it
+        back on). Returns true if the modem took all of it
+        '''
+        if self.debug:
+            print("Provisioning the LTE modem")
+        commands = _profile()
+        self.lte.send_at_cmd('AT^RESET')
+        if not self._waitFor(self._responds, _RESET_TIMEOUT_MS):
+            if self.debug:
+                print("LTE modem not answering after a reset")
+            return False
+        for command in ['AT+CFUN=0'] + commands:
+            if 'OK' not in self.lte.send_at_cmd(command):
+                if self.debug:
+                    print("LTE modem refused {}".format(command))
+                return False
+        pycom.nvs_set(ConfigLTE.NVS_PROFILE, _hash(commands))
+        self.stats['provisioned'] = 1
+        return True
+
+    def start(self):
+        '''
+        Starts the attach, provisioning the modem first if needed, and returns without waiting for it.
+        A modem that went to sleep in power saving mode resumes its registration
+        '''
+        lte = self.lte
+        self._attachStart = utime.ticks_ms()
+        if lte.isconnected():
+            return
+        if not self.provisioned() and not self.provision():
+            return
+        if not lte.isattached():
+            lte.attach()
+
+    def ready(self):
+        '''
+        True once connected. Connects once the modem is attached, so it is polled until then. An attach
+        longer than ConfigLTE.ATTACH_TIMEOUT has the modem provisioned again on the next wakeup
+        '''
+        if self._attachStart is None:
+            return False
+        lte = self.lte
+        now = utime.ticks_ms()
+        if lte.isconnected():
+            if self.stats['connectMs'] is None and self._connectStart is not None:
+                self.stats['connectMs'] = utime.ticks_diff(now, self._connectStart)
+            return True
+        if self._connectStart is None:
+            if lte.isattached():
+                self.stats['attachMs'] = utime.ticks_diff(now, self._attachStart)
+                self._connectStart = now
+                lte.connect()
+            elif not self._failed and utime.ticks_diff(now, self._attachStart) > ConfigLTE.ATTACH_TIMEOUT * 1000:
+                self._failed = True
+                if self.debug:
+                    print("LTE not attached after {} seconds".format(ConfigLTE.ATTACH_TIMEOUT))
+                nvsutil.erase(ConfigLTE.NVS_PROFILE)
+        return False
+
+    def sleep(self):
+        '''
+        Before the deep sleep. In power saving mode the modem stays registered for the next wakeup,
+        otherwise it detaches
+        '''
+        lte = self.lte
+        try:
+            if ConfigLTE.PSM and lte.isattached() and self.provisioned():
+                lte.deinit(detach=False)
+            else:
+                if lte.isconnected():
+                    lte.disconnect()
+                lte.deinit()
+        except Exception as e:
+            if self.debug:
+                print("Exception putting the LTE modem to sleep: {}".format(e))
@@ -15,40 +15,111 @@ from ubinascii import hexlify
 class MQTTException(Exception):
     pass
 
+def _bytes(s):
+    return s.encode() if isinstance(s, str) else s
+
 class MQTTClient:
 
     def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
-                 ssl=False, ssl_params={}):
+                 ssl=False, ssl_params={}, max_inflight=1, timeout=None, addr=None, ssl_session=None):
         if port == 0:
             port = 8883 if ssl else 1883
         self.client_id = client_id
         self.sock = None
-        self.addr = socket.getaddrinfo(server, port)[0][-1]
+        # addr is the (ip, port) of the server when it is already resolved
+        self.addr = addr or socket.getaddrinfo(server, port)[0][-1]
         self.ssl = ssl
         self.ssl_params = ssl_params
+        # TLS session of an earlier connection to resume (abbreviated handshake), then the one of this connection
+        self.ssl_session = ssl_session
         self.pid = 0
         self.cb = None
         self.user = user
         self.pswd = password
         self.keepalive = keepalive
+        # Seconds a blocking read or write waits before OSError (None waits forever)
+        self.timeout = timeout
+        # PINGREQ sent since the last PINGRESP
+        self.pings = 0
         self.lw_topic = None
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # QoS 1/2 publishes not acknowledged yet, [pid, qos, topic, msg, retain, released]
+        # in the order they were sent. publish only blocks once max_inflight are out
+        self.max_inflight = max_inflight
+        self.inflight = []
+        # Packet ids of incoming QoS 2 messages delivered but not released yet
+        self._rcv_qos2 = []
+        # Every packet is assembled in _wbuf and sent with a single write, every
+        # incoming one is read whole into _rbuf. Both grow to the largest packet
+        # seen and are reused after that
+        self._wbuf = bytearray(self.BUF_SIZE)
+        self._rbuf = bytearray(self.BUF_SIZE)
+        # SUBACK of the last subscribe, (pid msb, pid lsb, return code)
+        self._suback = None
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    BUF_SIZE = 128
 
-    def _recv_len(self):
-        n = 0
-        sh = 0
-        while 1:
+    def _packet(self, op, sz):
+        """the send buffer holding the fixed header of a packet of sz bytes, (buffer, offset after the header)"""
+        assert sz < 2097152
+        if sz + 4 > len(self._wbuf):
+            self._wbuf = bytearray(sz + 4)
+        pkt = self._wbuf
+        pkt[0] = op
+        i = 1
+        while sz > 0x7f:
+            pkt[i] = (sz & 0x7f) | 0x80
+            sz >>= 7
+            i += 1
+        pkt[i] = sz
+        return pkt, i + 1
+
+    @staticmethod
+    def _put(pkt, i, data):
+        n = len(data)
+        pkt[i:i + n] = data
+        return i + n
+
+    @staticmethod
+    def _put_str(pkt, i, s):
+        struct.pack_into("!H", pkt, i, len(s))
+        return MQTTClient._put(pkt, i + 2, s)
+
+    def _read_frame(self):
+        '''
+        Reads a whole packet: (first byte, memoryview of the rest), valid until the
+        next read. None if the socket is non-blocking and there is nothing to read
+        '''
+        # The fixed header is at least 2 bytes, a single byte is left of it only
+        # when a non-blocking read caught it in the middle
+        res = self.sock.read(2)
+        self.sock.settimeout(self.timeout)
+        if res is None:
+            return None
+        if len(res) == 1:
+            res += self.sock.read(1)
+        if len(res) < 2:
+            raise OSError(-1)
+        op = res[0]
+        b = res[1]
+        sz = b & 0x7f
+        sh = 7
+        while b & 0x80:
             b = self.sock.read(1)[0]
-            n |= (b & 0x7f) << sh
-            if not b & 0x80:
-                return n
+            sz |= (b & 0x7f) << sh
             sh += 7
+        if sz > len(self._rbuf):
+            self._rbuf = bytearray(sz)
+        body = memoryview(self._rbuf)[:sz]
+        n = 0
+        while n < sz:
+            got = self.sock.readinto(body[n:], sz - n)
+            if not got:
+                raise OSError(-1)
+            n += got
+        return op, body
 
     def set_callback(self, f):
         self.cb = f
@@ -63,38 +134,49 @@ class MQTTClient:
 
     def connect(self, clean_session=True):
         self.sock = socket.socket()
+        self.sock.settimeout(self.timeout)
         self.sock.connect(self.addr)
+        self.pings = 0
         if self.ssl:
             import ussl
-            self.sock = ussl.wrap_socket(self.sock, **self.ssl_params)
-        msg = bytearray(b"\x10\0\0\x04MQTT\x04\x02\0\0")
-        msg[1] = 10 + 2 + len(self.client_id)
-        msg[9] = clean_session << 1
-        if self.user is not None:
-            msg[1] += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[9] |= 0xC0
-        if self.keepalive:
-            assert self.keepalive < 65536
-            msg[10] |= self.keepalive >> 8
-            msg[11] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            msg[1] += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[9] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[9] |= self.lw_retain << 5
-        self.sock.write(msg)
-        #print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
+            params = self.ssl_params
+            if self.ssl_session is not None:
+                params = dict(params, saved_session=self.ssl_session)
+            self.sock = ussl.wrap_socket(self.sock, **params)
+            try:
+                self.ssl_session = ussl.save_session(self.sock)
+            except (AttributeError, OSError):
+                # Firmware without session resumption
+                self.ssl_session = None
+        fields = [_bytes(self.client_id)]
+        flags = clean_session << 1
         if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
+            fields.append(_bytes(self.lw_topic))
+            fields.append(_bytes(self.lw_msg))
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
         if self.user is not None:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
-        resp = self.sock.read(4)
-        assert resp[0] == 0x20 and resp[1] == 0x02
-        if resp[3] != 0:
-            raise MQTTException(resp[3])
-        return resp[2] & 1
+            fields.append(_bytes(self.user))
+            fields.append(_bytes(self.pswd))
+            flags |= 0xC0
+        assert self.keepalive < 65536
+        sz = 10
+        for field in fields:
+            sz += 2 + len(field)
+        pkt, i = self._packet(0x10, sz)
+        i = self._put(pkt, i, b"\0\x04MQTT\x04")
+        struct.pack_into("!BH", pkt, i, flags, self.keepalive)
+        i += 3
+        for field in fields:
+            i = self._put_str(pkt, i, field)
+        #print(hex(i), hexlify(pkt[:i], ":"))
+        self.sock.write(pkt, i)
+        op, resp = self._read_frame()
+        assert op == 0x20 and len(resp) == 2
+        if resp[1] != 0:
+            raise MQTTException(resp[1])
+        self._resend()
+        return resp[0] & 1
 
     def disconnect(self):
         self.sock.write(b"\xe0\0")
@@ -102,96 +184,154 @@ class MQTTClient:
 
     def ping(self):
         self.sock.write(b"\xc0\0")
+        self.pings += 1
 
-    def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
+    def _next_pid(self):
+        while 1:
+            self.pid = self.pid % 65535 + 1
+            if self._find(self.pid) is None:
+                return self.pid
+
+    def _find(self, pid):
+        for entry in self.inflight:
+            if entry[0] == pid:
+                return entry
+        return None
+
+    def _send_publish(self, topic, msg, retain, qos, pid, dup):
+        topic = _bytes(topic)
+        msg = _bytes(msg)
         sz = 2 + len(topic) + len(msg)
         if qos > 0:
             sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7f:
-            pkt[i] = (sz & 0x7f) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        #print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        pkt, i = self._packet(0x30 | dup << 3 | qos << 1 | retain, sz)
+        i = self._put_str(pkt, i, topic)
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            struct.pack_into("!H", pkt, i, pid)
+            i += 2
+        i = self._put(pkt, i, msg)
+        #print(hex(i), hexlify(pkt[:i], ":"))
+        self.sock.write(pkt, i)
+
+    def _send_ack(self, op, pid):
+        pkt, i = self._packet(op, 2)
+        struct.pack_into("!H", pkt, i, pid)
+        self.sock.write(pkt, i + 2)
+
+    # Retransmits what was still in flight when the connection was lost:
+    # publishes with the DUP flag, PUBREL for QoS 2 messages the broker
+    # already received
+    def _resend(self):
+        for pid, qos, topic, msg, retain, released in self.inflight:
+            if released:
+                self._send_ack(0x62, pid)
+            else:
+                self._send_publish(topic, msg, retain, qos, pid, True)
+
+    # Publishes a message. QoS 0 is written and forgotten. QoS 1 and 2 are kept
+    # in self.inflight until the broker acknowledges them; publish only waits
+    # for acknowledgements once max_inflight messages are outstanding (with the
+    # default of 1 it returns once this one is acknowledged). Returns the pid
+    def publish(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        if qos == 0:
+            self._send_publish(topic, msg, retain, 0, 0, False)
+            return None
+        pid = self._next_pid()
+        # Tracked before it is written, so a failed write is resent on reconnect
+        self.inflight.append([pid, qos, topic, msg, retain, False])
+        self._send_publish(topic, msg, retain, qos, pid, False)
+        while len(self.inflight) >= self.max_inflight:
+            self.wait_msg()
+        return pid
+
+    # Waits until every QoS 1/2 message in flight is acknowledged
+    def flush(self):
+        while self.inflight:
+            self.wait_msg()
+
+    # PUBACK, PUBREC, PUBREL and PUBCOMP
+    def _handle_ack(self, op, pid):
+        if op == 0x62:
+            # Broker released an incoming QoS 2 message
+            if pid in self._rcv_qos2:
+                self._rcv_qos2.remove(pid)
+            self._send_ack(0x70, pid)
+            return
+        entry = self._find(pid)
+        if entry is None:
+            return
+        if op == 0x50:
+            entry[5] = True
+            self._send_ack(0x62, pid)
+        else:
+            self.inflight.remove(entry)
 
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        #print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, 'little'))
+        topic = _bytes(topic)
+        pid = self._next_pid()
+        pkt, i = self._packet(0x82, 2 + 2 + len(topic) + 1)
+        struct.pack_into("!H", pkt, i, pid)
+        i = self._put_str(pkt, i + 2, topic)
+        pkt[i] = qos
+        #print(hex(i + 1), hexlify(pkt[:i + 1], ":"))
+        self.sock.write(pkt, i + 1)
+        self._suback = None
         while 1:
-            op = self.wait_msg()
-            if op == 0x90:
-                resp = self.sock.read(4)
-                #print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
-                if resp[3] == 0x80:
-                    raise MQTTException(resp[3])
+            self.wait_msg()
+            if self._suback is not None:
+                resp = self._suback
+                if resp[0] << 8 | resp[1] != pid:
+                    self._suback = None
+                    continue
+                if resp[2] == 0x80:
+                    raise MQTTException(resp[2])
                 return
 
     # Wait for a single incoming MQTT message and process it.
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
-    # messages processed internally.
+    # messages processed internally. Returns the packet type
+    # (None for PINGRESP)
     def wait_msg(self):
-        res = self.sock.read(1)
-        self.sock.setblocking(True)
-        if res is None:
+        frame = self._read_frame()
+        if frame is None:
             return None
-        if res == b"":
-            raise OSError(-1)
-        if res == b"\xd0":  # PINGRESP
-            sz = self.sock.read(1)[0]
-            assert sz == 0
+        op, body = frame
+        if op == 0xd0:  # PINGRESP
+            assert len(body) == 0
+            self.pings = 0
             return None
-        op = res[0]
+        if op in (0x40, 0x50, 0x62, 0x70):
+            assert len(body) == 2
+            self._handle_ack(op, body[0] << 8 | body[1])
+            return op
+        if op == 0x90:
+            self._suback = bytes(body[:3])
+            return op
         if op & 0xf0 != 0x30:
             return op
-        sz = self._recv_len()
-        topic_len = self.sock.read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
-        sz -= topic_len + 2
+        topic_len = body[0] << 8 | body[1]
+        i = 2 + topic_len
+        topic = bytes(body[2:i])
         if op & 6:
-            pid = self.sock.read(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-        msg = self.sock.read(sz)
+            pid = body[i] << 8 | body[i + 1]
+            i += 2
+        msg = bytes(body[i:])
+        # Acknowledged before the callback runs: a callback that does not return
+        # (e.g. goes to deep sleep) would otherwise get the message again on every
+        # connection of a persistent session
+        if op & 6 == 4:
+            # QoS 2: delivered once, a resent copy before the PUBREL is dropped
+            self._send_ack(0x50, pid)
+            if pid in self._rcv_qos2:
+                return op
+            self._rcv_qos2.append(pid)
+        elif op & 6 == 2:
+            self._send_ack(0x40, pid)
         self.cb(topic, msg)
-        if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
-        elif op & 6 == 4:
-            assert 0
+        return op
 
     # Checks whether a pending message from server is available.
     # If not, returns immediately with None. Otherwise, does
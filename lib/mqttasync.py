@@ -0,0 +1,396 @@
+# Non-blocking MQTT 3.1.1 client for uasyncio (asyncio on the host)
+# Same connect/publish/subscribe/callback surface as lib/mqtt.MQTTClient, but the
+# broker round trips are awaited instead of blocking the GPy. One reader task
+# owns the receive side of the socket: it frames incoming packets, hands
+# PUBLISHes to the callback and completes whoever waits on a CONNACK, SUBACK or
+# PUBACK. Incoming messages are acknowledged before the callback runs, as
+# MQTTClient.wait_msg does, and QoS 2 ones are delivered once (PUBREC, then
+# PUBCOMP when the broker releases them). Packets are assembled
+# before they are written, so a writer never leaves half a packet on the socket
+# for the next one to interleave with.
+# Meanwhile the GPS and accelerometer tasks keep running. The TCP connect does
+# not block either, the address lookup (once, or preset addr) and the TLS
+# handshake do: the firmware's ussl only handshakes on a blocking socket.
+# main.py is still a blocking loop and uses MQTTClient (lib/mqttconn.py), this
+# client is for uasyncio code on the device, bench/bench_mqtt_async.py compares
+# the two on the same wake cycle.
+# author: callen
+#
+
+import usocket as socket
+import uselect as select
+import ustruct as struct
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from lib.mqtt import MQTTException
+
+# Packet types (upper nibble of the fixed header)
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PUBREC = 0x50
+PUBREL = 0x60
+PUBCOMP = 0x70
+SUBACK = 0x90
+PINGRESP = 0xD0
+
+# errno of a non-blocking socket with nothing to read / no room to write / still connecting
+_EAGAIN = (11, 115, 119)
+
+
+def _remaining_length(pkt, size):
+    """appends the variable length encoding of size to pkt"""
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        if size:
+            pkt.append(byte | 0x80)
+        else:
+            pkt.append(byte)
+            return pkt
+
+
+def _add_str(pkt, s):
+    if isinstance(s, str):
+        s = s.encode()
+    pkt.extend(struct.pack("!H", len(s)))
+    pkt.extend(s)
+    return pkt
+
+
+class _Waiter:
+    """an answer from the broker somebody is awaiting"""
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.result = None
+
+
+class MQTTClientAsync:
+
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
+                 ssl=False, ssl_params={}, timeout=10, poll_ms=20):
+        if port == 0:
+            port = 8883 if ssl else 1883
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.sock = None
+        self.addr = None
+        self.ssl = ssl
+        self.ssl_params = ssl_params
+        self.pid = 0
+        self.cb = None
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 0
+        self.lw_retain = False
+        # Seconds to wait for an answer from the broker
+        self.timeout = timeout
+        # How often the reader task looks at the socket while there is nothing to read
+        self.poll_ms = poll_ms
+        # (packet type, packet id) -> _Waiter
+        self._waiters = {}
+        self._rx = bytearray()
+        self._reader = None
+        # Packet ids of incoming QoS 2 messages delivered but not released yet
+        self._rcv_qos2 = []
+        # Exception that ended the connection (read by the waiters)
+        self._error = None
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    def isconnected(self):
+        return self.sock is not None and self._error is None
+
+    # socket
+
+    async def _open(self):
+        if self.addr is None:
+            # Blocks, there is no asynchronous getaddrinfo
+            self.addr = socket.getaddrinfo(self.server, self.port)[0][-1]
+        sock = socket.socket()
+        try:
+            sock.setblocking(False)
+            try:
+                sock.connect(self.addr)
+            except OSError as e:
+                if e.args[0] not in _EAGAIN:
+                    raise
+            poller = select.poll()
+            poller.register(sock, select.POLLOUT)
+            await asyncio.wait_for(self._connected(poller), self.timeout)
+            if self.ssl:
+                import ussl
+                sock.setblocking(True)
+                sock = ussl.wrap_socket(sock, **self.ssl_params)
+                sock.setblocking(False)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _connected(self, poller):
+        """yields until the socket of poller is connected (writable)"""
+        while True:
+            for sock, events in poller.poll(0):
+                if events & (select.POLLERR | select.POLLHUP):
+                    raise OSError(-1)
+                return
+            await asyncio.sleep(self.poll_ms / 1000)
+
+    def _recv(self):
+        try:
+            return self.sock.read(256)
+        except OSError as e:
+            if e.args[0] in _EAGAIN:
+                return None
+            raise
+
+    async def _write(self, pkt):
+        """writes a whole packet, yielding while the socket has no room"""
+        data = memoryview(pkt)
+        while data:
+            if self._error is not None:
+                raise self._error
+            try:
+                n = self.sock.write(data)
+            except OSError as e:
+                if e.args[0] not in _EAGAIN:
+                    raise
+                n = None
+            if n:
+                data = data[n:]
+            else:
+                await asyncio.sleep(self.poll_ms / 1000)
+
+    # answers
+
+    def _expect(self, kind, pid=0):
+        waiter = _Waiter()
+        self._waiters[(kind, pid)] = waiter
+        return waiter
+
+    async def _wait(self, kind, pid, waiter):
+        try:
+            await asyncio.wait_for(waiter.event.wait(), self.timeout)
+        finally:
+            self._waiters.pop((kind, pid), None)
+        if waiter.result is None:
+            raise self._error or OSError(-1)
+        return waiter.result
+
+    def _complete(self, kind, pid, result):
+        waiter = self._waiters.get((kind, pid))
+        if waiter is not None:
+            waiter.result = result
+            waiter.event.set()
+
+    def _fail(self, error):
+        self._error = error
+        for waiter in self._waiters.values():
+            waiter.event.set()
+
+    # reader task
+
+    async def _read_loop(self):
+        try:
+            while self._error is None:
+                data = self._recv()
+                if data is None:
+                    await asyncio.sleep(self.poll_ms / 1000)
+                    continue
+                if data == b"":
+                    raise OSError(-1)
+                self._rx.extend(data)
+                await self._dispatch()
+        except Exception as e:
+            if self._error is None:
+                self._fail(e)
+
+    def _frame(self):
+        """(first byte, body) of the next complete packet in the receive buffer, or None"""
+        rx = self._rx
+        size = 0
+        shift = 0
+        i = 1
+        while True:
+            if i >= len(rx):
+                return None
+            byte = rx[i]
+            size |= (byte & 0x7F) << shift
+            i += 1
+            if not byte & 0x80:
+                break
+            shift += 7
+        if len(rx) < i + size:
+            return None
+        packet = (rx[0], bytes(rx[i:i + size]))
+        self._rx = rx[i + size:]
+        return packet
+
+    async def _dispatch(self):
+        while True:
+            packet = self._frame()
+            if packet is None:
+                return
+            op, body = packet
+            kind = op & 0xF0
+            if kind == PUBLISH:
+                await self._received(op, body)
+            elif kind == CONNACK:
+                self._complete(CONNACK, 0, body)
+            elif kind in (PUBACK, SUBACK):
+                self._complete(kind, body[0] << 8 | body[1], body)
+            elif kind == PUBREL:
+                # Broker released an incoming QoS 2 message
+                pid = body[0] << 8 | body[1]
+                if pid in self._rcv_qos2:
+                    self._rcv_qos2.remove(pid)
+                await self._ack(PUBCOMP, pid)
+            elif kind == PINGRESP:
+                self._complete(PINGRESP, 0, body)
+
+    async def _received(self, op, body):
+        topic_len = body[0] << 8 | body[1]
+        topic = body[2:2 + topic_len]
+        offset = 2 + topic_len
+        if op & 6:
+            pid = body[offset] << 8 | body[offset + 1]
+            offset += 2
+        if op & 6 == 2:
+            await self._ack(PUBACK, pid)
+        elif op & 6 == 4:
+            # QoS 2: delivered once, a resent copy before the PUBREL is dropped
+            await self._ack(PUBREC, pid)
+            if pid in self._rcv_qos2:
+                return
+            self._rcv_qos2.append(pid)
+        if self.cb is not None:
+            self.cb(topic, body[offset:])
+
+    async def _ack(self, kind, pid):
+        pkt = bytearray([kind, 2, 0, 0])
+        struct.pack_into("!H", pkt, 2, pid)
+        await self._write(pkt)
+
+    # mqtt
+
+    async def connect(self, clean_session=True):
+        self._error = None
+        self._rx = bytearray()
+        self.sock = await self._open()
+        flags = clean_session << 1
+        # The payload goes first, the remaining length counts its encoded bytes
+        payload = _add_str(bytearray(), self.client_id)
+        if self.keepalive:
+            assert self.keepalive < 65536
+        if self.lw_topic:
+            _add_str(payload, self.lw_topic)
+            _add_str(payload, self.lw_msg)
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
+        if self.user is not None:
+            _add_str(payload, self.user)
+            _add_str(payload, self.pswd)
+            flags |= 0xC0
+        pkt = _remaining_length(bytearray(b"\x10"), 10 + len(payload))
+        pkt.extend(b"\0\x04MQTT\x04")
+        pkt.append(flags)
+        pkt.extend(struct.pack("!H", self.keepalive))
+        pkt.extend(payload)
+        waiter = self._expect(CONNACK)
+        self._reader = asyncio.create_task(self._read_loop())
+        await self._write(pkt)
+        resp = await self._wait(CONNACK, 0, waiter)
+        if resp[1] != 0:
+            raise MQTTException(resp[1])
+        return resp[0] & 1
+
+    async def disconnect(self):
+        try:
+            if self._error is None:
+                await self._write(b"\xe0\0")
+        finally:
+            self._close()
+
+    def _close(self):
+        if self._error is None:
+            self._fail(OSError(-1))
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    async def ping(self):
+        waiter = self._expect(PINGRESP)
+        await self._write(b"\xc0\0")
+        await self._wait(PINGRESP, 0, waiter)
+
+    def _next_pid(self):
+        self.pid = self.pid % 65535 + 1
+        return self.pid
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        assert qos < 2, "QoS 2 is not supported"
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        size = 2 + len(topic) + len(msg)
+        if qos > 0:
+            size += 2
+        assert size < 2097152
+        pkt = _remaining_length(bytearray([0x30 | qos << 1 | retain]), size)
+        _add_str(pkt, topic)
+        if qos > 0:
+            pid = self._next_pid()
+            pkt.extend(struct.pack("!H", pid))
+            waiter = self._expect(PUBACK, pid)
+        pkt.extend(msg)
+        await self._write(pkt)
+        if qos == 1:
+            await self._wait(PUBACK, pid, waiter)
+
+    async def subscribe(self, topic, qos=0):
+        assert self.cb is not None, "Subscribe callback is not set"
+        pid = self._next_pid()
+        if isinstance(topic, str):
+            topic = topic.encode()
+        pkt = _remaining_length(bytearray(b"\x82"), 2 + 2 + len(topic) + 1)
+        pkt.extend(struct.pack("!H", pid))
+        _add_str(pkt, topic)
+        pkt.append(qos)
+        waiter = self._expect(SUBACK, pid)
+        await self._write(pkt)
+        resp = await self._wait(SUBACK, pid, waiter)
+        if resp[2] == 0x80:
+            raise MQTTException(resp[2])
+
+    async def check_msg(self):
+        """
+        Gives the reader task a chance to deliver what arrived. Messages reach the
+        callback on their own, this is only for code written against MQTTClient.
+        Raises the error that ended the connection, if any
+        """
+        await asyncio.sleep(0)
+        if self._error is not None:
+            raise self._error
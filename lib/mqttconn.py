@@ -0,0 +1,164 @@
+# Owns the MQTT connection of a wakeup for the tracker
+# Connects with jittered exponential backoff, keeps the connection alive with
+# PINGREQ while the tracker is busy with something else and drops it when it
+# turns out half open (no PINGRESP, or a read / write times out) so the next
+# use reconnects. A wakeup only spends ConfigMqtt.CONNECT_BUDGET_MS on
+# connecting: after that it gives up until the next wakeup and the messages
+# stay in the outbox (lib/outbox.py) instead of keeping the radio on.
+# The counters in stats are kept for telemetry
+# author: callen
+#
+
+import utime
+import uerrno
+import machine
+from config import ConfigMqtt
+from lib import profiler
+
+
+class MQTTConnection:
+
+    def __init__(self, factory, onConnect=None, ready=None, debug=False):
+        '''
+        factory - returns a new MQTTClient, not connected yet. Called with retry true after a failed attempt
+        onConnect - called with (client, sessionPresent) after every successful connect
+        ready - returns true once the network is up. Until then connect returns None without an attempt
+        '''
+        self.factory = factory
+        self.onConnect = onConnect
+        self.ready = ready
+        self.debug = debug
+        # The connected client, None while there is no connection
+        self.client = None
+        # Milliseconds of this wakeup spent connecting and backing off
+        self.spentMs = 0
+        # Failed attempts since the last successful connect
+        self._failedAttempts = 0
+        self._lastPing = 0
+        # TLS session of the last connection, resumed by the next one (the full handshake costs seconds on LTE-M)
+        self.tlsSession = None
+        self.stats = {
+            'attempts': 0,  # Connect attempts
+            'connects': 0,  # Successful ones
+            'failures': 0,  # Failed attempts and connections lost afterwards
+            'halfOpen': 0,  # Connections dropped because the broker stopped answering
+            'pings': 0,
+            'connectMs': 0,  # Latency of the last successful connect (tcp, tls and CONNACK)
+            'connectMsTotal': 0,
+        }
+
+    def exhausted(self):
+        """true once the connection budget of the wakeup is spent"""
+        return self.spentMs >= ConfigMqtt.CONNECT_BUDGET_MS
+
+    def _backoff(self):
+        """delay (ms) before the next attempt: exponential, half of it random"""
+        delay = min(ConfigMqtt.CONNECT_BACKOFF_MS << (self._failedAttempts - 1), ConfigMqtt.CONNECT_BACKOFF_MAX_MS)
+        return delay // 2 + machine.rng() % (delay // 2 + 1)
+
+    @profiler.timed(profiler.MQTT_CONNECT)
+    def connect(self):
+        '''
+        Returns the connected client, connecting first if there is no connection.
+        Returns None if the broker could not be reached within what is left of the budget, or if the
+        network is not up yet
+        '''
+        if self.client is None and self.ready is not None and not self.ready():
+            return None
+        while self.client is None:
+            if self.exhausted():
+                return None
+            if self._failedAttempts:
+                delay = self._backoff()
+                if self.spentMs + delay >= ConfigMqtt.CONNECT_BUDGET_MS:
+                    # Not worth another attempt in this wakeup
+                    self.spentMs = ConfigMqtt.CONNECT_BUDGET_MS
+                    break
+                utime.sleep_ms(delay)
+                self.spentMs += delay
+            self.stats['attempts'] += 1
+            start = utime.ticks_ms()
+            client = None
+            try:
+                client = self.factory(self._failedAttempts > 0)
+                if client.ssl and self._failedAttempts < 2:
+                    # Not after two failures in a row, in case the resumption is what fails
+                    client.ssl_session = self.tlsSession
+                sessionPresent = client.connect(clean_session=ConfigMqtt.CLEAN_SESSION)
+                self.tlsSession = client.ssl_session
+                elapsed = utime.ticks_diff(utime.ticks_ms(), start)
+                self.stats['connects'] += 1
+                self.stats['connectMs'] = elapsed
+                self.stats['connectMsTotal'] += elapsed
+                self.client = client
+                self._failedAttempts = 0
+                self._lastPing = utime.ticks_ms()
+                if self.onConnect is not None:
+                    self.onConnect(client, sessionPresent)
+            except Exception as e:
+                if self.debug:
+                    print("Exception connecting to mqtt broker: {}".format(e))
+                self._close(client)
+                self.client = None
+                self._failedAttempts += 1
+                self.stats['failures'] += 1
+            self.spentMs += utime.ticks_diff(utime.ticks_ms(), start)
+        if self.client is None and self.debug:
+            print("Mqtt connection budget spent after {} attempts".format(self.stats['attempts']))
+        return self.client
+
+    def failed(self, e=None):
+        """drops the connection after an error using it, the next connect makes a new one"""
+        if self.client is None:
+            return
+        if self.debug:
+            print("Mqtt connection lost: {}".format(e))
+        self.stats['failures'] += 1
+        if isinstance(e, OSError) and e.args and e.args[0] == uerrno.ETIMEDOUT:
+            # The broker stopped answering
+            self.stats['halfOpen'] += 1
+        self._close(self.client)
+        self.client = None
+
+    def poll(self):
+        '''
+        Processes what the broker sent and keeps the connection alive: a PINGREQ every half keepalive,
+        the connection is dropped as half open if no PINGRESP came within ConfigMqtt.SOCKET_TIMEOUT
+        '''
+        client = self.client
+        if client is None:
+            return
+        try:
+            while client.check_msg() is not None:
+                pass
+            sincePing = utime.ticks_diff(utime.ticks_ms(), self._lastPing)
+            if client.pings:
+                if sincePing > ConfigMqtt.SOCKET_TIMEOUT * 1000:
+                    raise OSError(uerrno.ETIMEDOUT, "no PINGRESP")
+            elif ConfigMqtt.KEEPALIVE and sincePing >= ConfigMqtt.KEEPALIVE * 500:
+                client.ping()
+                self._lastPing = utime.ticks_ms()
+                self.stats['pings'] += 1
+        except Exception as e:
+            self.failed(e)
+
+    def close(self):
+        """waits for the acknowledgements still in flight and disconnects"""
+        client = self.client
+        if client is None:
+            return
+        try:
+            client.flush()
+            client.disconnect()
+            self.client = None
+        except Exception as e:
+            self.failed(e)
+
+    @staticmethod
+    def _close(client):
+        if client is None or client.sock is None:
+            return
+        try:
+            client.sock.close()
+        except Exception:
+            pass
@@ -0,0 +1,497 @@
+# NMEA helpers for the quectel L76 GNSS driver (L76GNSV4)
+# NMEAStream is an incremental tokenizer fed straight from the I2C bus.
+# Raw bytes are read into a preallocated buffer, partial sentences are
+# carried over to the next read and checksums are validated in place, so
+# no str or list is built for sentences nobody asked for.
+# Sentences that are wanted are decoded through a table keyed on the type,
+# fix sentences into compact Fix records instead of a hash per sentence.
+# Pure python so it can also be imported on the host (benchmarks)
+# author: callen
+#
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+_DOLLAR = const(0x24)
+_COMMA = const(0x2C)
+_STAR = const(0x2A)
+_CR = const(0x0D)
+_LF = const(0x0A)
+
+# Longest NMEA sentence is 82 chars, PMTK answers from the L76 are a bit longer
+MAX_SENTENCE = const(128)
+
+
+def _hexval(c):
+    """value of an ascii hex digit, -1 if not a hex digit"""
+    if 0x30 <= c <= 0x39:
+        return c - 0x30
+    if 0x41 <= c <= 0x46:
+        return c - 0x37
+    if 0x61 <= c <= 0x66:
+        return c - 0x57
+    return -1
+
+
+def header_endswith(sentence, suffix):
+    """
+    True if the header (first field) of a sentence ends with suffix (bytes).
+    'GNRMC' matches b'RMC', 'PMTK001' matches b'PMTK001' and b'001'
+    """
+    n = len(sentence)
+    h = 0
+    while h < n and sentence[h] != _COMMA:
+        h += 1
+    ls = len(suffix)
+    if ls > h:
+        return False
+    offset = h - ls
+    for i in range(ls):
+        if sentence[offset + i] != suffix[i]:
+            return False
+    return True
+
+
+class NMEAStream:
+    """
+    Incremental NMEA tokenizer backed by a preallocated bytearray.
+    Data is written into window() (e.g. with I2C.readfrom_into) and committed,
+    next_sentence() then returns complete, checksum validated sentences as
+    memoryview slices of the buffer (body only, without '$' and '*hh').
+    A returned slice is only valid until the next window()/feed() call.
+    When the write position reaches the end of the buffer, the pending partial
+    sentence is moved back to the front so returned slices are always contiguous.
+    """
+
+    def __init__(self, size=512):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        # Counters, mostly useful for debugging and benchmarks
+        self.sentences = 0
+        self.bad_checksum = 0
+        self.overflow = 0
+
+    def reset(self):
+        """drop everything that is buffered"""
+        self.start = 0
+        self.end = 0
+
+    def _compact(self):
+        """move the unconsumed bytes to the front of the buffer"""
+        buf = self.buf
+        start = self.start
+        pending = self.end - start
+        if start:
+            # byte copy, the partial sentence is small and this doesn't allocate
+            for i in range(pending):
+                buf[i] = buf[start + i]
+        self.start = 0
+        self.end = pending
+
+    def window(self, size):
+        """returns a writable memoryview of size bytes at the end of the buffered data"""
+        total = len(self.buf)
+        if size > total:
+            size = total
+        if total - self.end < size:
+            self._compact()
+            if total - self.end < size:
+                # Garbage without a line ending filled the buffer, drop it
+                self.overflow += 1
+                self.start = 0
+                self.end = 0
+        return self.mv[self.end:self.end + size]
+
+    def commit(self, size):
+        """marks size bytes written into the last window() as valid data"""
+        self.end += size
+
+    def feed(self, data):
+        """copies raw bytes (e.g. from I2C.readfrom) into the buffer"""
+        mv = self.window(len(data))
+        n = len(mv)
+        if n < len(data):
+            data = data[:n]
+        mv[:] = data
+        self.commit(n)
+
+    def _checksum_ok(self, first, star):
+        """xor of the bytes between '$' and '*' compared to the hex digits after '*'"""
+        buf = self.buf
+        cs = 0
+        for i in range(first, star):
+            cs ^= buf[i]
+        hi = _hexval(buf[star + 1])
+        lo = _hexval(buf[star + 2])
+        return hi >= 0 and lo >= 0 and (hi << 4 | lo) == cs
+
+    def next_sentence(self):
+        """
+        returns the body of the next complete valid sentence as a memoryview
+        or None when no complete sentence is buffered (a partial one is kept)
+        """
+        buf = self.buf
+        i = self.start
+        end = self.end
+        while i < end:
+            if buf[i] != _DOLLAR:
+                i += 1
+                continue
+            j = i + 1
+            while j < end:
+                c = buf[j]
+                if c == _CR or c == _LF or c == _DOLLAR:
+                    break
+                j += 1
+            if j == end:
+                # Partial sentence, wait for the next read to complete it
+                if end - i > MAX_SENTENCE:
+                    self.overflow += 1
+                    i = end
+                break
+            if buf[j] == _DOLLAR:
+                # Truncated sentence, restart at the new one
+                self.bad_checksum += 1
+                i = j
+                continue
+            self.start = j
+            star = j - 3
+            if star > i and buf[star] == _STAR and self._checksum_ok(i + 1, star):
+                self.sentences += 1
+                return self.mv[i + 1:star]
+            self.bad_checksum += 1
+            i = j
+        self.start = i
+        return None
+
+
+# Sentence decoding. Every sentence type has a decoder in DECODERS, talker
+# sentences (GNRMC, GPGSV, ...) are keyed without the talker id. The field names
+# are the keys of the hash the L76GNSS driver has always returned
+NMEA410 = const(410)
+
+_GGA_KEYS = ('NMEA', 'UTCTime', 'Latitude', 'NS', 'Longitude', 'EW',
+             'FixStatus', 'NumberOfSV', 'HDOP',
+             'Altitude', 'M', 'GeoIDSeparation', 'M', 'DGPSAge', 'DGPSStationID')
+_GLL_KEYS = ('NMEA', 'Latitude', 'NS', 'Longitude', 'EW',
+             'UTCTime', 'dataValid', 'PositioningMode')
+_RMC_KEYS = ('NMEA', 'UTCTime', 'dataValid', 'Latitude', 'NS', 'Longitude', 'EW',
+             'Speed', 'COG', 'Date', '', '', 'PositioningMode')
+_VTG_KEYS = ('NMEA', 'COG-T', 'T', 'COG-M', 'M', 'SpeedKnots', 'N', 'SpeedKm', 'K',
+             'PositioningMode')
+_GSA_KEYS = ('NMEA', 'Mode', 'FixStatus',
+             'SatelliteUsed01', 'SatelliteUsed02', 'SatelliteUsed03',
+             'SatelliteUsed04', 'SatelliteUsed05', 'SatelliteUsed06',
+             'SatelliteUsed07', 'SatelliteUsed08', 'SatelliteUsed09',
+             'SatelliteUsed10', 'SatelliteUsed11', 'SatelliteUsed12',
+             'PDOP', 'HDOP', 'VDOP')
+_GSV_KEYS = ('NMEA', 'NofMessage', 'SequenceNr', 'SatellitesInView',
+             'SatelliteID1', 'Elevation1', 'Azimuth1', 'SNR1',
+             'SatelliteID2', 'Elevation2', 'Azimuth2', 'SNR2',
+             'SatelliteID3', 'Elevation3', 'Azimuth3', 'SNR3',
+             'SatelliteID4', 'Elevation4', 'Azimuth4', 'SNR4')
+# V4.10 chips have longer RMC, GSA and GSV messages
+_RMC410_KEYS = _RMC_KEYS + ('NavigationaalStatus',)
+_GSA410_KEYS = _GSA_KEYS + ('GNSSSystemID',)
+_GSV410_KEYS = _GSV_KEYS + ('SignalID',)
+_PMTK705_KEYS = ('PMTK', 'ReleaseString', 'BuildID', 'ProductModel', 'SDK')
+_PMTK001_KEYS = ('PMTK', 'command', 'flag')
+_PQVERNO_KEYS = ('PMTK', 'command', 'ChipVersionID', 'date', 'time')
+
+
+def convert_coord(coord, orientation):
+    """convert a ddmm.mmmm to dd.dddddd degrees"""
+    coord = (float(coord) // 100) + ((float(coord) % 100) / 60)
+    if orientation == 'S' or orientation == 'W':
+        coord *= -1
+    return coord
+
+
+def mixhash(keywords, sentence):
+    """return hash with keywords filled with sentence"""
+    while len(keywords) - len(sentence) > 0:
+        sentence += ('',)
+    if len(keywords) != len(sentence):
+        return None
+    ret = dict(zip(keywords, sentence))
+    try:
+        ret['Latitude'] = convert_coord(ret['Latitude'], ret['NS'])
+    except:
+        pass
+    try:
+        ret['Longitude'] = convert_coord(ret['Longitude'], ret['EW'])
+    except:
+        pass
+    return ret
+
+
+def _rmc(sentence, version):
+    """required minimum position data"""
+    if len(sentence) == 11:
+        sentence.append('N')
+    return mixhash(_RMC410_KEYS if version >= NMEA410 else _RMC_KEYS, sentence)
+
+
+def _gsa(sentence, version):
+    """fix state, the sattelites used and DOP info"""
+    return mixhash(_GSA410_KEYS if version >= NMEA410 else _GSA_KEYS, sentence)
+
+
+def _gsv(sentence, version):
+    """four of the sattelites seen"""
+    return mixhash(_GSV410_KEYS if version >= NMEA410 else _GSV_KEYS, sentence)
+
+
+def _pmtk(sentence, version):
+    """the anonymous pmtk message"""
+    return dict(PMTK=sentence[0], msg=sentence)
+
+
+DECODERS = {
+    'GGA': lambda sentence, version: mixhash(_GGA_KEYS, sentence),
+    'GLL': lambda sentence, version: mixhash(_GLL_KEYS, sentence),
+    'RMC': _rmc,
+    'VTG': lambda sentence, version: mixhash(_VTG_KEYS, sentence),
+    'GSA': _gsa,
+    'GSV': _gsv,
+    'PMTK705': lambda sentence, version: mixhash(_PMTK705_KEYS, sentence),
+    'PMTKLOG': _pmtk,
+    'PMTK001': lambda sentence, version: mixhash(_PMTK001_KEYS, sentence),
+    'PQVERNO': lambda sentence, version: mixhash(_PQVERNO_KEYS, sentence),
+}
+
+
+def sentence_type(header):
+    """registry key of a header, 'GNRMC' -> 'RMC', 'PMTK001' -> 'PMTK001'"""
+    return header[2:] if len(header) == 5 else header
+
+
+def decode(sentence, version=301):
+    """
+    turns a sentence body (str, bytes or memoryview, without $ and checksum) into a hash.
+    Returns None for sentence types without a decoder
+    """
+    if not isinstance(sentence, str):
+        sentence = bytes(sentence).decode('utf-8')
+    fields = sentence.split(',')
+    decoder = DECODERS.get(sentence_type(fields[0]))
+    if decoder is None:
+        return None
+    return decoder(fields, version)
+
+
+# Field positions used by Fix, -1 when a sentence doesn't carry the value:
+# (utc, latitude, longitude, status, mode, satellites, hdop, altitude, geoid, speed, cog, date)
+# status is the fix quality (GGA) or fix type (GSA), mode the A/V or positioning mode letter
+_LAYOUTS = {
+    'GGA': (1, 2, 4, 6, -1, 7, 8, 9, 11, -1, -1, -1),
+    'RMC': (1, 3, 5, -1, 12, -1, -1, -1, -1, 7, 8, 9),
+    'GLL': (5, 1, 3, -1, 7, -1, -1, -1, -1, -1, -1, -1),
+    'VTG': (-1, -1, -1, -1, 9, -1, -1, -1, -1, 5, 1, -1),
+    'GSA': (-1, -1, -1, 2, -1, -1, 16, -1, -1, -1, -1, -1),
+    'GSV': (-1, -1, -1, -1, -1, 3, -1, -1, -1, -1, -1, -1),
+}
+# Position of the A/V data valid field for sentences without a positioning mode (NMEA 3.01)
+_DATA_VALID = {'RMC': 2, 'GLL': 6}
+
+
+def _number(fields, index, kind=float):
+    """numeric value of a field, None when missing or empty"""
+    if index < 0 or index >= len(fields) or not fields[index]:
+        return None
+    try:
+        value = float(fields[index])
+    except ValueError:
+        return None
+    return value if kind is float else kind(value)
+
+
+class Fix:
+    """
+    Compact record of a decoded fix sentence (GGA, RMC, GLL, VTG, GSA or GSV).
+    Only the sentence type and the raw body are stored on creation, the numeric
+    values are parsed the first time any of them is read:
+        valid       sentence reports a position fix (True/False)
+        quality     GGA fix quality / GSA fix type (int)
+        latitude, longitude     degrees (float, negative for S and W)
+        altitude, geoid         meters (float)
+        hdop        (float)
+        speed       speed over ground in knots (float)
+        cog         course over ground, degrees true (float)
+        utc         hhmmss (int), date ddmmyy (int)
+        satellites  used (GGA) or in view (GSV) (int)
+    as_dict() gives the hash the driver used to return, for compatibility
+    """
+    __slots__ = ('kind', 'raw', 'valid', 'quality', 'latitude', 'longitude', 'altitude',
+                 'geoid', 'hdop', 'speed', 'cog', 'utc', 'date', 'satellites')
+
+    def __init__(self, kind, raw):
+        self.kind = kind
+        self.raw = raw
+
+    def __getattr__(self, name):
+        # Only called for values that aren't set yet: parse everything once
+        if name in ('kind', 'raw') or name not in Fix.__slots__:
+            raise AttributeError(name)
+        self._parse()
+        return getattr(self, name)
+
+    def _parse(self):
+        fields = self.raw.split(',')
+        utc, lat, lon, status, mode, sats, hdop, alt, geoid, speed, cog, date = _LAYOUTS[self.kind]
+        self.utc = _number(fields, utc, int)
+        self.date = _number(fields, date, int)
+        self.quality = _number(fields, status, int)
+        self.satellites = _number(fields, sats, int)
+        self.hdop = _number(fields, hdop)
+        self.altitude = _number(fields, alt)
+        self.geoid = _number(fields, geoid)
+        self.speed = _number(fields, speed)
+        self.cog = _number(fields, cog)
+        self.latitude = self.longitude = None
+        if lat >= 0 and len(fields) > lon + 1 and fields[lat] and fields[lon]:
+            try:
+                self.latitude = convert_coord(fields[lat], fields[lat + 1])
+                self.longitude = convert_coord(fields[lon], fields[lon + 1])
+            except ValueError:
+                pass
+        if self.kind == 'GGA':
+            self.valid = (self.quality or 0) >= 1
+        elif self.kind == 'GSA':
+            self.valid = (self.quality or 0) >= 2
+        elif mode >= 0:
+            if len(fields) > mode and fields[mode]:
+                self.valid = fields[mode] != 'N'
+            elif self.kind in _DATA_VALID:
+                self.valid = fields[_DATA_VALID[self.kind]] == 'A'
+            else:
+                self.valid = False
+        else:
+            self.valid = False
+
+    def as_dict(self, version=301):
+        """the hash view of this sentence (the format L76GNSS returned before)"""
+        return decode(self.raw, version)
+
+
+def parse(sentence, version=301):
+    """
+    turns a sentence body (str, bytes or memoryview) into a Fix record for the
+    fix sentence types and into a hash (decode) for everything else (PMTK answers)
+    """
+    if not isinstance(sentence, str):
+        sentence = bytes(sentence).decode('utf-8')
+    comma = sentence.find(',')
+    kind = sentence_type(sentence[:comma] if comma >= 0 else sentence)
+    if kind in _LAYOUTS:
+        return Fix(kind, sentence)
+    return decode(sentence, version)
+
+
+# Sentences of one epoch that FixState merges, as bits for FixState.want
+EPOCH_RMC = const(1)
+EPOCH_GGA = const(2)
+EPOCH_GSA = const(4)
+EPOCH_VTG = const(8)
+EPOCH_ALL = const(15)
+_EPOCH_BITS = {'RMC': EPOCH_RMC, 'GGA': EPOCH_GGA, 'GSA': EPOCH_GSA, 'VTG': EPOCH_VTG}
+EPOCH_TYPES = ('RMC', 'GGA', 'GSA', 'VTG')
+
+
+class FixState:
+    """
+    Coherent snapshot of one NMEA epoch (the burst the L76 outputs every fix interval),
+    merged from the RMC, GGA, GSA and VTG Fix records of that epoch.
+    The L76 starts every epoch with RMC, so an RMC (or a change of UTC time)
+    starts a new snapshot. complete() is true once every type in want was seen.
+    Values use the same units as Fix (speed in knots)
+    """
+    __slots__ = ('want', 'seen', 'valid', 'quality', 'latitude', 'longitude', 'altitude',
+                 'geoid', 'hdop', 'speed', 'cog', 'utc', 'date', 'satellites')
+
+    def __init__(self, want=EPOCH_ALL):
+        self.want = want
+        self.reset()
+
+    def reset(self):
+        self.seen = 0
+        self.valid = False
+        self.quality = None
+        self.latitude = None
+        self.longitude = None
+        self.altitude = None
+        self.geoid = None
+        self.hdop = None
+        self.speed = None
+        self.cog = None
+        self.utc = None
+        self.date = None
+        self.satellites = None
+
+    def complete(self):
+        return self.seen & self.want == self.want
+
+    def update(self, fix):
+        """merges a Fix record into the snapshot, returns True when the epoch is complete"""
+        kind = fix.kind
+        bit = _EPOCH_BITS.get(kind, 0)
+        if not bit:
+            return self.complete()
+        if self.seen and (kind == 'RMC' or (fix.utc is not None and self.utc is not None and fix.utc != self.utc)):
+            self.reset()
+        if fix.utc is not None:
+            self.utc = fix.utc
+        if kind == 'RMC':
+            self.valid = self.valid or fix.valid
+            self.date = fix.date
+            self.speed = fix.speed
+            self.cog = fix.cog
+        elif kind == 'GGA':
+            self.valid = self.valid or fix.valid
+            self.quality = fix.quality
+            self.altitude = fix.altitude
+            self.geoid = fix.geoid
+            self.hdop = fix.hdop
+            self.satellites = fix.satellites
+        elif kind == 'GSA':
+            if self.hdop is None:
+                self.hdop = fix.hdop
+        elif kind == 'VTG':
+            if self.speed is None:
+                self.speed = fix.speed
+            if self.cog is None:
+                self.cog = fix.cog
+        if fix.latitude is not None:
+            self.latitude = fix.latitude
+            self.longitude = fix.longitude
+        self.seen |= bit
+        return self.complete()
+
+
+class Subscription:
+    """
+    The sentence types a caller wants ('RMC', 'GGA', 'PMTK001', ...).
+    wants() only looks at the header bytes of a sentence, so everything else
+    is skipped before anything is decoded for it
+    """
+
+    def __init__(self, kinds):
+        if not isinstance(kinds, tuple):
+            kinds = (kinds,)
+        self.kinds = kinds
+        self.raw = tuple(k.encode() for k in kinds)
+        # talker sentences are matched on the 3 letter type
+        self.types = set(k for k in self.raw if len(k) == 3)
+
+    def wants(self, sentence):
+        if len(sentence) > 5 and sentence[5] == _COMMA:
+            return bytes(sentence[2:5]) in self.types
+        for kind in self.raw:
+            if header_endswith(sentence, kind):
+                return True
+        return False
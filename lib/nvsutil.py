@@ -0,0 +1,43 @@
+# Helpers for the values the tracker keeps in NVS across deep sleeps
+# NVS only holds uint32 values: strings are kept as their FNV-1a hash (enough
+# to tell which of the known ones it was) and IPv4 addresses as integers
+# author: callen
+#
+
+import pycom
+
+
+def get(key):
+    """value stored for key, None if there is none"""
+    try:
+        return pycom.nvs_get(key)
+    except Exception:
+        # key doesnt exist
+        return None
+
+
+def erase(key):
+    """removes key, if it exists"""
+    try:
+        pycom.nvs_erase(key)
+    except Exception:
+        pass
+
+
+def fnv1a(text):
+    """32 bit FNV-1a hash of text"""
+    h = 0x811C9DC5
+    for c in text:
+        h = ((h ^ ord(c)) * 0x01000193) & 0xFFFFFFFF
+    return h
+
+
+def ip_to_int(ip):
+    n = 0
+    for part in ip.split('.'):
+        n = n << 8 | int(part)
+    return n
+
+
+def int_to_ip(n):
+    return '{}.{}.{}.{}'.format(n >> 24 & 0xFF, n >> 16 & 0xFF, n >> 8 & 0xFF, n & 0xFF)
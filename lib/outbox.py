@@ -0,0 +1,258 @@
+# Store and forward queue of the messages the tracker publishes, kept on flash
+# Every message is appended here first and only dropped once the broker
+# acknowledged it, so positions taken where there is no coverage go out on the
+# next connection instead of being lost. Replay reads the queue in batches of
+# ConfigMqtt.OUTBOX_BATCH_BYTES, and the read position is committed to NVS
+# once per acknowledged batch
+# author: callen
+#
+# File: append only records of
+#   <magic:0xA5><flags><topic length:uint8><message length:uint16><checksum:uint16><topic><message>
+# (little endian, flags bit 0 is retain). The checksum (fletcher 16) covers the
+# flags, lengths, topic and message. A record torn by a reset or power loss
+# fails its checksum and is skipped by looking for the next valid record.
+# When the file would grow past ConfigMqtt.OUTBOX_MAX_BYTES the oldest records
+# are dropped: the queue is rewritten to <file>.tmp, the head reset and the
+# .tmp swapped in. A reset before the swap replays the acknowledged records
+# again (sent twice rather than lost), one in the middle of it is finished on
+# the next boot
+#
+
+import os
+import ustruct as struct
+import pycom
+from config import ConfigMqtt
+from lib import nvsutil
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+_MAGIC = const(0xA5)
+_HEADER = '<BBBHH'
+_HEADER_SIZE = const(7)
+_FLAG_RETAIN = const(0x01)
+
+
+def _fletcher16(data, sum1=0, sum2=0):
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return sum1, sum2
+
+
+def checksum(flags, topic, msg):
+    sums = _fletcher16(struct.pack('<BBH', flags, len(topic), len(msg)))
+    sums = _fletcher16(topic, *sums)
+    sum1, sum2 = _fletcher16(msg, *sums)
+    return sum2 << 8 | sum1
+
+
+def record(topic, msg, retain=False):
+    """the bytes of one queued message"""
+    flags = _FLAG_RETAIN if retain else 0
+    header = struct.pack(_HEADER, _MAGIC, flags, len(topic), len(msg), checksum(flags, topic, msg))
+    return header + topic + msg
+
+
+def parse(buf, offset):
+    '''
+    The record at offset of buf: (end, topic, msg, retain), None if buf ends
+    before the record does, or False if there is no valid record at offset
+    '''
+    if len(buf) - offset < _HEADER_SIZE:
+        return None
+    magic, flags, topicLen, msgLen, check = struct.unpack_from(_HEADER, buf, offset)
+    if magic != _MAGIC:
+        return False
+    start = offset + _HEADER_SIZE
+    end = start + topicLen + msgLen
+    if end > len(buf):
+        return None
+    topic = bytes(buf[start:start + topicLen])
+    msg = bytes(buf[start + topicLen:end])
+    if checksum(flags, topic, msg) != check:
+        return False
+    return end, topic, msg, bool(flags & _FLAG_RETAIN)
+
+
+def _encode(value):
+    if isinstance(value, str):
+        return value.encode()
+    return bytes(value)
+
+
+class Outbox:
+
+    def __init__(self, path=None, maxBytes=None, batchBytes=None, debug=False):
+        self.path = path or ConfigMqtt.OUTBOX_FILE
+        self.maxBytes = maxBytes or ConfigMqtt.OUTBOX_MAX_BYTES
+        self.batchBytes = batchBytes or ConfigMqtt.OUTBOX_BATCH_BYTES
+        self.debug = debug
+        self._recover()
+        # File offset of the first record not acknowledged yet
+        self.head = nvsutil.get(ConfigMqtt.NVS_OUTBOX_HEAD) or 0
+        self.size = self._fileSize()
+        if self.head > self.size:
+            # The file was removed or replaced behind our back
+            self._setHead(0)
+
+    def _fileSize(self):
+        try:
+            return os.stat(self.path)[6]
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _exists(path):
+        try:
+            os.stat(path)
+            return True
+        except OSError:
+            return False
+
+    def _recover(self):
+        """finishes or drops an eviction a reset interrupted"""
+        tmp = self.path + '.tmp'
+        if not self._exists(tmp):
+            return
+        if self._exists(self.path):
+            # Reset while writing the .tmp, the queue is whole
+            os.remove(tmp)
+        else:
+            # Reset between the remove and the rename, the head was already reset for the .tmp
+            os.rename(tmp, self.path)
+            if self.debug:
+                print("Outbox recovered from a reset in the middle of an eviction")
+
+    def _setHead(self, head):
+        self.head = head
+        pycom.nvs_set(ConfigMqtt.NVS_OUTBOX_HEAD, head)
+
+    def isEmpty(self):
+        return self.head >= self.size
+
+    def pending(self):
+        """bytes queued and not acknowledged"""
+        return self.size - self.head
+
+    def append(self, topic, msg, retain=False):
+        """queues a message (topic and msg as str or bytes)"""
+        data = record(_encode(topic), _encode(msg), retain)
+        if self.size and self.size + len(data) > self.maxBytes:
+            self._evict(len(data))
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self.size += len(data)
+
+    def batch(self):
+        '''
+        The next records to replay, a list of (end, topic, msg, retain). Committing
+        the end of the last one drops the whole batch from the queue. Empty when
+        the queue is
+        '''
+        records = []
+        while not records and not self.isEmpty():
+            records = self._read(self.head)
+        return records
+
+    def _read(self, offset):
+        """the valid records of one batch from offset, skips what is not valid"""
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            buf = f.read(self.batchBytes)
+            pos = 0
+            while pos < len(buf):
+                found = parse(buf, pos)
+                if found is None:
+                    if records:
+                        break
+                    size = self._recordSize(buf, pos)
+                    if offset + pos + size > self.size:
+                        # Torn by a reset in the middle of an append
+                        found = False
+                    else:
+                        # Longer than what is left of the batch, read it whole
+                        offset += pos
+                        f.seek(offset)
+                        buf = f.read(max(size, self.batchBytes))
+                        pos = 0
+                        continue
+                if found is False:
+                    # Torn or corrupt, look for the next valid record
+                    pos += 1
+                    continue
+                end, topic, msg, retain = found
+                records.append((offset + end, topic, msg, retain))
+                pos = end
+        if not records:
+            # Nothing valid in there, resume the queue after it (or drop it if the
+            # file is shorter than we thought)
+            self.commit(offset + len(buf) if buf else self.size)
+        return records
+
+    @staticmethod
+    def _recordSize(buf, pos):
+        """size of the record at pos from its header, the header size if that is cut short"""
+        if len(buf) - pos < _HEADER_SIZE:
+            return _HEADER_SIZE
+        return _HEADER_SIZE + buf[pos + 2] + (buf[pos + 3] | buf[pos + 4] << 8)
+
+    def commit(self, end):
+        """drops the records before end (acknowledged by the broker)"""
+        if end >= self.size:
+            self.clear()
+        else:
+            self._setHead(end)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.size = 0
+        self._setHead(0)
+
+    def _evict(self, room):
+        '''
+        Rewrites the queue without the records already sent and the oldest ones,
+        leaving room for room bytes and a quarter of the maximum free
+        '''
+        keep = self.maxBytes * 3 // 4 - room
+        skip = self.pending() - keep
+        dropped = 0
+        tmp = self.path + '.tmp'
+        with open(self.path, 'rb') as src, open(tmp, 'wb') as dst:
+            src.seek(self.head)
+            buf = b''
+            while True:
+                chunk = src.read(self.batchBytes)
+                if not chunk:
+                    break
+                buf = buf + chunk
+                pos = 0
+                while True:
+                    found = parse(buf, pos)
+                    if found is None:
+                        break
+                    if found is False:
+                        pos += 1
+                        continue
+                    end = found[0]
+                    if skip > 0:
+                        skip -= end - pos
+                        dropped += 1
+                    else:
+                        dst.write(buf[pos:end])
+                    pos = end
+                buf = buf[pos:]
+        # The head is for the .tmp from here on, see _recover
+        self._setHead(0)
+        os.remove(self.path)
+        os.rename(tmp, self.path)
+        self.size = self._fileSize()
+        if self.debug:
+            print("Outbox full, dropped the {} oldest messages".format(dropped))
@@ -0,0 +1,245 @@
+# Wake cycle phase profiler
+# Spans (profiler.span(PHASE) as a context manager, @profiler.timed(PHASE)
+# on a function) add up the milliseconds
+# spent in each phase of a wakeup. Time in a nested span only counts for the
+# inner phase, so the phases and the time outside of them add up to the time
+# awake. end_wake() keeps the totals of the wakeup as one record of a ring
+# on flash (ConfigProfile.FILE, ConfigProfile.RING_WAKES records: the Pytrack
+# powers the GPy off in deep sleep, RTC memory does not survive it) and
+# payload() is the whole ring, sent as one telemetry message.
+# Disabled (the default until enable()), span returns a shared no-op object.
+# decode() and PHASE_NAMES are plain python for the host side report
+# (tools/profile_report.py)
+# author: callen
+#
+# Payload, big endian:
+#   <version:uint8><phases:uint8><count:uint8>
+#   then count records, oldest first: <wake reason:uint16><time:uint16 per phase>
+# The file is the same without the count, a record torn by a reset is dropped
+# times in tens of milliseconds (65535 for that or more). The last phase
+# (AWAKE) is the whole wakeup, from boot to end_wake
+#
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+try:
+    import uos as os
+except ImportError:
+    import os
+
+try:
+    import utime
+except ImportError:
+    # Host side, only decode
+    utime = None
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+VERSION = const(1)
+
+BOOT = const(0)  # boot.py, wifi scan and association
+INIT = const(1)  # Tracker construction and init
+MQTT_CONNECT = const(2)  # Broker address, tcp / tls connect, CONNACK and subscriptions
+GPS_INIT = const(3)  # L76GNSS construction and configuration
+GPS_FIX = const(4)
+MOTION = const(5)  # Accelerometer sampling (accelInMotion)
+PUBLISH = const(6)  # Queueing and sending messages, waiting for the acknowledgements
+SLEEP = const(7)  # goToSleep until the deep sleep
+AWAKE = const(8)
+PHASES = const(9)
+PHASE_NAMES = ('boot', 'init', 'mqtt connect', 'gps init', 'gps fix', 'motion', 'publish', 'sleep', 'awake')
+
+_HEADER = '!BBB'
+_HEADER_SIZE = const(3)
+_FILE_HEADER = '!BB'
+_FILE_HEADER_SIZE = const(2)
+_RECORD_SIZE = const(2 + 2 * PHASES)
+_UNIT_MS = const(10)
+
+_enabled = False
+_path = '/flash/profile.bin'
+_totals = None
+# Open spans, innermost last
+_stack = []
+_reason = 0
+
+
+class _Span:
+    __slots__ = ('phase', 'start')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        now = utime.ticks_ms()
+        if _stack:
+            # The enclosing phase pauses
+            parent = _stack[-1]
+            _totals[parent.phase] += utime.ticks_diff(now, parent.start)
+        self.start = now
+        _stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        if _stack and _stack[-1] is self:
+            now = utime.ticks_ms()
+            _totals[self.phase] += utime.ticks_diff(now, self.start)
+            _stack.pop()
+            if _stack:
+                _stack[-1].start = now
+        return False
+
+
+class _NoSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enable(flag=True, path=None):
+    '''
+    Starts profiling the wakeup (keeps what was profiled already, e.g. by boot.py).
+    path - file of the ring (ConfigProfile.FILE)
+    '''
+    global _enabled, _totals, _path
+    if flag and _totals is None:
+        _totals = [0] * PHASES
+    if path is not None:
+        _path = path
+    _enabled = flag
+
+
+def enabled():
+    return _enabled
+
+
+def span(phase):
+    """context manager adding the time spent in it to phase"""
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(phase)
+
+
+def timed(phase):
+    """decorator, span of phase around every call of the function"""
+    def decorator(function):
+        def timed_function(*args, **kwargs):
+            with span(phase):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorator
+
+
+def begin(phase):
+    """opens a span of phase that end_wake closes, for the phase a wakeup ends in"""
+    span(phase).__enter__()
+
+
+def set_reason(reason):
+    """wake reason kept with the record of this wakeup"""
+    global _reason
+    _reason = reason
+
+
+def totals():
+    """milliseconds per phase so far"""
+    return list(_totals) if _totals is not None else None
+
+
+def _records():
+    """records (bytes) of the ring on flash, none if it does not hold a ring of this version"""
+    try:
+        with open(_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    if len(data) < _FILE_HEADER_SIZE or struct.unpack_from(_FILE_HEADER, data, 0) != (VERSION, PHASES):
+        return []
+    return [data[i:i + _RECORD_SIZE] for i in range(_FILE_HEADER_SIZE, len(data) - _RECORD_SIZE + 1, _RECORD_SIZE)]
+
+
+def _store(records):
+    with open(_path, 'wb') as f:
+        f.write(struct.pack(_FILE_HEADER, VERSION, PHASES) + b''.join(records))
+
+
+def end_wake(capacity=None):
+    '''
+    Closes the open spans and adds the record of this wakeup to the ring (dropping the oldest one
+    past capacity records). Returns the milliseconds per phase, None when disabled
+    '''
+    if not _enabled:
+        return None
+    now = utime.ticks_ms()
+    while _stack:
+        _stack[-1].__exit__()
+    _totals[AWAKE] = now
+    record = struct.pack('!H' + 'H' * PHASES, _reason & 0xFFFF,
+                         *[min((ms + _UNIT_MS // 2) // _UNIT_MS, 0xFFFF) for ms in _totals])
+    records = _records()
+    try:
+        whole = records and os.stat(_path)[6] == _FILE_HEADER_SIZE + len(records) * _RECORD_SIZE
+    except OSError:
+        whole = False
+    if whole and (capacity is None or len(records) < capacity):
+        with open(_path, 'ab') as f:
+            f.write(record)
+    else:
+        # Rewritten when full, new, of an old version or with a record torn by a reset
+        records.append(record)
+        if capacity is not None and len(records) > capacity:
+            records = records[len(records) - capacity:]
+        _store(records)
+    return list(_totals)
+
+
+def pending():
+    """wakeups recorded in the ring"""
+    return len(_records())
+
+
+def payload():
+    """telemetry message of the ring, None if it is empty"""
+    records = _records()
+    if not records:
+        return None
+    return struct.pack(_HEADER, VERSION, PHASES, len(records)) + b''.join(records)
+
+
+def clear():
+    try:
+        os.remove(_path)
+    except OSError:
+        pass
+
+
+def decode(payload):
+    '''
+    Records of a telemetry message, oldest first: (wake reason, {phase name: seconds}). Phases this
+    version does not know are named by their number. Raises ValueError on an unknown version or size
+    '''
+    if len(payload) < _HEADER_SIZE or payload[0] != VERSION:
+        raise ValueError('unknown profile payload version')
+    _, phases, count = struct.unpack_from(_HEADER, payload, 0)
+    size = 2 + 2 * phases
+    if len(payload) != _HEADER_SIZE + count * size:
+        raise ValueError('profile payload of {} bytes for {} records'.format(len(payload), count))
+    names = [PHASE_NAMES[i] if i < len(PHASE_NAMES) else str(i) for i in range(phases)]
+    records = []
+    for i in range(count):
+        values = struct.unpack_from('!H' + 'H' * phases, payload, _HEADER_SIZE + i * size)
+        records.append((values[0], {name: value * _UNIT_MS / 1000 for name, value in zip(names, values[1:])}))
+    return records
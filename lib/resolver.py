@@ -0,0 +1,85 @@
+# Broker address cache, kept in NVS across deep sleeps
+# Resolving ConfigMqtt.SERVER on every wakeup costs a DNS round trip (over
+# LTE) before the first message can go out. The address is looked up once and
+# reused: a lookup older than ConfigMqtt.DNS_TTL is made again by refresh(),
+# once what the wakeup had to send is sent. When DNS does not answer, the
+# cached address (even if old) or the pinned ConfigMqtt.SERVER_IPS are used
+# author: callen
+#
+
+import usocket as socket
+import utime
+import pycom
+from config import ConfigMqtt
+from lib import nvsutil
+from lib import timeutil
+
+
+class AddressCache:
+
+    def __init__(self, host, port, debug=False):
+        self.host = host
+        self.port = port
+        self.debug = debug
+        self._pinned = 0
+
+    def _cached(self):
+        """(ip, time of the lookup) from NVS, None if there is none for this host"""
+        # The hash of the host tells if the cached address is for the configured one
+        if nvsutil.get(ConfigMqtt.NVS_BROKER_HOST) != nvsutil.fnv1a(self.host):
+            return None
+        ip = nvsutil.get(ConfigMqtt.NVS_BROKER_IP)
+        if not ip:
+            return None
+        return nvsutil.int_to_ip(ip), nvsutil.get(ConfigMqtt.NVS_BROKER_IP_TIME) or 0
+
+    def _lookup(self):
+        ip = socket.getaddrinfo(self.host, self.port)[0][-1][0]
+        now = utime.time()
+        pycom.nvs_set(ConfigMqtt.NVS_BROKER_IP, nvsutil.ip_to_int(ip))
+        pycom.nvs_set(ConfigMqtt.NVS_BROKER_IP_TIME, now if now > timeutil.TIME_KNOWN else 0)
+        pycom.nvs_set(ConfigMqtt.NVS_BROKER_HOST, nvsutil.fnv1a(self.host))
+        return ip
+
+    def resolve(self, fresh=False):
+        '''
+        Address (ip, port) of the broker: the cached one without a DNS lookup, unless there is none,
+        caching is off (ConfigMqtt.DNS_TTL of 0) or fresh (e.g. connecting to the cached one failed)
+        '''
+        cached = self._cached()
+        if cached is not None and not fresh and ConfigMqtt.DNS_TTL:
+            return cached[0], self.port
+        try:
+            return self._lookup(), self.port
+        except Exception as e:
+            if self.debug:
+                print("Exception resolving {}: {}".format(self.host, e))
+        if cached is not None:
+            return cached[0], self.port
+        if not ConfigMqtt.SERVER_IPS:
+            raise OSError("cannot resolve {}".format(self.host))
+        # Next pinned address on every try
+        ip = ConfigMqtt.SERVER_IPS[self._pinned % len(ConfigMqtt.SERVER_IPS)]
+        self._pinned += 1
+        return ip, self.port
+
+    def refresh(self):
+        '''
+        Looks the broker up again if the cached address is older than ConfigMqtt.DNS_TTL (or its age
+        is not known). Returns true if a lookup was made
+        '''
+        cached = self._cached()
+        now = utime.time()
+        if cached is not None:
+            if now < timeutil.TIME_KNOWN or not ConfigMqtt.DNS_TTL:
+                # Without the time the age is not known, check on a wakeup that has it
+                return False
+            if cached[1] and now - cached[1] < ConfigMqtt.DNS_TTL:
+                return False
+        try:
+            self._lookup()
+            return True
+        except Exception as e:
+            if self.debug:
+                print("Exception refreshing the address of {}: {}".format(self.host, e))
+        return False
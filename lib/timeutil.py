@@ -0,0 +1,23 @@
+# Date helpers shared by the tracker modules
+# Pure python (no firmware modules), location.py imports it on the server side too
+# author: callen
+#
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+# The rtc reads later than 2020 once it has the time
+TIME_KNOWN = const(1577836800)
+
+
+def days_from_civil(year, month, day):
+    """days since 1970-01-01 of a (proleptic gregorian) date"""
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
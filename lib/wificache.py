@@ -0,0 +1,142 @@
+# Wifi access point of the last association, kept in NVS across deep sleeps
+# boot.py connects straight to it (bssid and channel, so the station does not
+# scan) and only scans for the known networks when it does not answer within
+# ConfigNetwork.WIFI_FAST_TIMEOUT. With ConfigNetwork.CONCURRENT_BRINGUP boot.py
+# does not wait for it, main.py checks on it (expired) and scans then. The
+# address dhcp gave is kept as well and reused as a static one with
+# ConfigNetwork.WIFI_CACHE_IP (the router has to keep the lease)
+# author: callen
+#
+# NVS (uint32): ConfigNetwork.NVS_WIFI_SSID FNV-1a hash of the ssid,
+# NVS_WIFI_BSSID low 4 bytes of the bssid, NVS_WIFI_CHANNEL
+# <bssid high 2 bytes><security><channel>, NVS_WIFI_IP ip, netmask, gateway
+# and dns (4 keys, suffixes 0-3)
+#
+
+import utime
+import pycom
+from config import ConfigNetwork
+from lib import nvsutil
+
+# Deadline (ticks_ms) of the connect to the cached access point while it is not associated, kept by the module
+# from boot.py to main.py
+_pending = None
+
+
+class WifiCache:
+
+    def __init__(self, debug=False):
+        self.debug = debug
+
+    def load(self):
+        '''
+        (ssid, bssid, security, channel, ifconfig) of the last association, ifconfig None without a
+        cached address. None if there is none or its network is no longer known
+        '''
+        ssidHash = nvsutil.get(ConfigNetwork.NVS_WIFI_SSID)
+        low = nvsutil.get(ConfigNetwork.NVS_WIFI_BSSID)
+        packed = nvsutil.get(ConfigNetwork.NVS_WIFI_CHANNEL)
+        if ssidHash is None or low is None or packed is None:
+            return None
+        # Which of the known networks the cache is for
+        ssid = None
+        for name in ConfigNetwork.KNOWN_NETWORKS:
+            if nvsutil.fnv1a(name) == ssidHash:
+                ssid = name
+        if ssid is None:
+            return None
+        bssid = bytes([packed >> 24 & 0xFF, packed >> 16 & 0xFF, low >> 24 & 0xFF, low >> 16 & 0xFF,
+                       low >> 8 & 0xFF, low & 0xFF])
+        ifconfig = None
+        if ConfigNetwork.WIFI_CACHE_IP:
+            values = [nvsutil.get(ConfigNetwork.NVS_WIFI_IP + str(i)) for i in range(4)]
+            if None not in values:
+                ifconfig = tuple(nvsutil.int_to_ip(value) for value in values)
+        return ssid, bssid, packed >> 8 & 0xFF, packed & 0xFF, ifconfig
+
+    def save(self, ssid, bssid, security, channel):
+        """remembers the access point connected to"""
+        pycom.nvs_set(ConfigNetwork.NVS_WIFI_SSID, nvsutil.fnv1a(ssid))
+        pycom.nvs_set(ConfigNetwork.NVS_WIFI_BSSID, bssid[2] << 24 | bssid[3] << 16 | bssid[4] << 8 | bssid[5])
+        pycom.nvs_set(ConfigNetwork.NVS_WIFI_CHANNEL, bssid[0] << 24 | bssid[1] << 16 | security << 8 | channel)
+
+    def saveIfconfig(self, ifconfig):
+        """remembers the address of the association (ip, netmask, gateway, dns), only what changed is written"""
+        if not ConfigNetwork.WIFI_CACHE_IP:
+            return
+        for i, ip in enumerate(ifconfig[:4]):
+            value = nvsutil.ip_to_int(ip)
+            if nvsutil.get(ConfigNetwork.NVS_WIFI_IP + str(i)) != value:
+                pycom.nvs_set(ConfigNetwork.NVS_WIFI_IP + str(i), value)
+
+    def connectCached(self, wl):
+        '''
+        Starts connecting to the cached access point, without a scan. Returns its ssid, None if there
+        is none. expired() tells if it did not answer
+        '''
+        global _pending
+        cached = self.load()
+        if cached is None:
+            return None
+        ssid, bssid, security, channel, ifconfig = cached
+        props = ConfigNetwork.KNOWN_NETWORKS[ssid]
+        if 'config' in props:
+            wl.ifconfig(config=props['config'])
+        elif ifconfig is not None:
+            wl.ifconfig(config=ifconfig)
+        _pending = utime.ticks_add(utime.ticks_ms(), ConfigNetwork.WIFI_FAST_TIMEOUT * 1000)
+        try:
+            wl.connect(ssid, (security, props['pwd']), bssid=bssid, channel=channel,
+                       timeout=ConfigNetwork.WIFI_FAST_TIMEOUT * 1000)
+        except Exception as e:
+            if self.debug:
+                print("Exception connecting to the cached access point: {}".format(e))
+            _pending = utime.ticks_ms()
+        return ssid
+
+    def expired(self, wl):
+        """true if the cached access point is not associated ConfigNetwork.WIFI_FAST_TIMEOUT after the connect"""
+        global _pending
+        if _pending is None:
+            return False
+        if wl.isconnected():
+            _pending = None
+            return False
+        return utime.ticks_diff(_pending, utime.ticks_ms()) <= 0
+
+    def fallback(self, wl):
+        """gives up on the cached access point, it is dropped from the cache"""
+        global _pending
+        _pending = None
+        if self.debug:
+            print("Cached access point not answering")
+        cached = self.load()
+        self.clear()
+        wl.disconnect()
+        if cached is not None and cached[4] is not None:
+            wl.ifconfig(config='dhcp')
+
+    def scanConnect(self, wl, timeoutMs):
+        '''
+        Scans for the known networks and starts connecting to the strongest access point, which is cached.
+        Returns its ssid, raises ValueError if there is none
+        '''
+        if self.debug:
+            print("Scanning for known wifi networks")
+        known = [e for e in wl.scan() if e.ssid in ConfigNetwork.KNOWN_NETWORKS]
+        if not known:
+            raise ValueError('no known network in range')
+        ap = max(known, key=lambda e: e.rssi)
+        props = ConfigNetwork.KNOWN_NETWORKS[ap.ssid]
+        if 'config' in props:
+            wl.ifconfig(config=props['config'])
+        # Connected to without another scan
+        wl.connect(ap.ssid, (ap.sec, props['pwd']), bssid=ap.bssid, channel=ap.channel, timeout=timeoutMs)
+        # Dropped again on the next boot if it does not answer then
+        self.save(ap.ssid, ap.bssid, ap.sec, ap.channel)
+        return ap.ssid
+
+    def clear(self):
+        for key in [ConfigNetwork.NVS_WIFI_SSID, ConfigNetwork.NVS_WIFI_BSSID, ConfigNetwork.NVS_WIFI_CHANNEL] + \
+                [ConfigNetwork.NVS_WIFI_IP + str(i) for i in range(4)]:
+            nvsutil.erase(key)
@@ -10,13 +10,27 @@ import pycom
 import binascii
 import ujson
 from lib.mqtt import MQTTClient
+from lib.mqttconn import MQTTConnection
+from lib.resolver import AddressCache
+from lib.outbox import Outbox
+from lib import location
+from lib import profiler
+from lib import energy
+from lib import nvsutil
+from lib import timeutil
+from lib.energy import EnergyMeter
+from lib.ltesession import LTESession
+from lib.wificache import WifiCache
 from network import LTE, Bluetooth
 from network import WLAN # TODO remove
-from config import ConfigMqtt, ConfigAccelerometer, ConfigGPS, ConfigWakeup, ConfigBluetooth
-from lib.pycoproc import WAKE_REASON_ACCELEROMETER
+from config import ConfigNetwork, ConfigMqtt, ConfigAccelerometer, ConfigGPS, ConfigWakeup, ConfigBluetooth, ConfigProfile, \
+    ConfigEnergy
+from lib.pycoproc import WAKE_REASON_ACCELEROMETER, WAKE_REASON_TIMER
 from lib.LIS2HH12 import LIS2HH12
 #from L76GNSS import L76GNSS
 from lib.L76GNSV4 import L76GNSS
+from lib.gpsstart import GpsStartStrategy, STRATEGY_NAMES, START_COLD, START_ASSISTED
+from lib.epo import EPOLoader, gps_hour
 from lib.pytrack import Pytrack
 
 class Tracker:
@@ -30,14 +44,38 @@ class Tracker:
         # Instantiate and hold state for sensors (accelerometer, lte, gps, etc)
         self.accel = LIS2HH12()
         self.lte = LTE()
+        # Attach, connect and power saving of the lte modem
+        self.lteSession = LTESession(self.lte, debug=debug)
         self.gps = None
-        # Holds the mqtt client to send messages to
-        self.mqttClient = None
+        # Picks hot / warm / cold gps starts and keeps the ttff statistics
+        self.gpsStart = GpsStartStrategy(debug=debug)
+        # Loads EPO data into the gps for assisted cold starts (created with the gps)
+        self.epo = None
+        self.epoDownloaded = False
+        # Set by _waitFix when the gps got the EPO assistance during the attempt
+        self.gpsAssisted = False
+        # Address of the broker, cached across deep sleeps
+        self.brokerAddress = AddressCache(ConfigMqtt.SERVER, ConfigMqtt.PORT, debug=debug)
+        # Connection to the mqtt broker to send messages to (connects on demand, within a budget per wakeup)
+        self.mqtt = MQTTConnection(self._newMqttClient, self._onMqttConnect, ready=self.networkReady, debug=debug)
+        # Every message is queued on flash until the broker acknowledged it
+        self.outbox = Outbox(debug=debug)
+        # Fixes waiting to be sent together while tracking (ConfigMqtt.LOCATION_FORMATS batch)
+        self.fixBatch = location.FixBatch(ConfigMqtt.BATCH_FILE, ConfigMqtt.BATCH_MAX_FIXES,
+                                          ConfigMqtt.BATCH_MAX_SECONDS)
+        # Charge drawn from the battery per activity, totals kept across deep sleeps
+        self.energy = EnergyMeter(self.pytrack, debug=debug)
         # If after wakeup, we are in continuous GPS logging state
         self.continueGPSRead = False
         # Flag for handling wakeup and logging logic differently if owner is nearby
         self.checkOwnerNearby = True
         self.wlan = WLAN()  #TODO remove
+        # Access point of the last wifi association, boot.py connects to it first
+        self.wifiCache = WifiCache(debug=debug)
+        # If the network of this wakeup is lte (wifi otherwise)
+        self.useLTE = False
+        # Set once the network came up
+        self._networkUp = False
 
     def init(self, bInitLTE=False):
         '''
@@ -45,10 +83,16 @@ class Tracker:
         a timeout, resets the machine in order to try and conenct again. 
         Initializes MQTTClient and checks if we are in a continuous GPS read state after wakeup (saved to self instance variables)
         '''
+        self.useLTE = bInitLTE
+        self._restoreClock()
+        # Charge of the sleep that just ended
+        self.energy.radio = energy.LTE if bInitLTE else energy.WIFI
+        self.energy.wakeup()
+
         # Check if network is connected. If not, attempt to connect
         if bInitLTE:
             self.initLTE()
-        else:
+        elif not ConfigNetwork.CONCURRENT_BRINGUP:
             #TODO remove
             # Check if network is connected. If not, attempt to connect
             counter = 0
@@ -60,15 +104,105 @@ class Tracker:
                 counter += 1
 
 
-        # Initialize mqttClient
-        self.mqttClient = self._getMqttClient(self.debug)
-
         # Check to see if we are in continued gps read (went to sleep and want to continue reading GPS data)
         if self._getNVS(ConfigGPS.NVS_SLEEP_CONTINUE_GPS_READ) is not None:
             self.continueGPSRead = True
             # Erase this key from NVS
             pycom.nvs_erase(ConfigGPS.NVS_SLEEP_CONTINUE_GPS_READ)
 
+        # Connect to the broker and send what is still queued from previous wakeups. While tracking with batched
+        # locations the broker is only connected once a batch is due (sendMQTTMessage connects on demand).
+        # With the network still coming up it is sent as soon as it is up (_service)
+        if not (self.continueGPSRead and self._batchLocations()):
+            self.flushOutbox()
+
+        # Tracking disabled from mqtt on an earlier wakeup and not enabled since
+        if self._getNVS(ConfigMqtt.NVS_TRACKING_OFF) is not None and self.waitNetwork():
+            # The broker delivers an ON sent meanwhile once connected (persistent session), the network may still
+            # have been coming up above
+            self.mqtt.connect()
+            self.mqtt.poll()
+        disabledUntil = self._getNVS(ConfigMqtt.NVS_TRACKING_OFF)
+        if disabledUntil is not None:
+            remaining = disabledUntil - utime.time() if disabledUntil else ConfigMqtt.SLEEP_TIME_MQTT_DISABLE
+            if remaining > 0:
+                if self.debug:
+                    print("Tracking disabled from mqtt. Sleeping for {}".format(remaining))
+                self.goToSleep(sleepTime=min(remaining, ConfigMqtt.SLEEP_TIME_MQTT_DISABLE))
+            pycom.nvs_erase(ConfigMqtt.NVS_TRACKING_OFF)
+
+    def networkReady(self):
+        '''
+        True once the network of the wakeup is up (the wifi association is started by boot.py).
+        The first time it is, starts the ntp sync and keeps the wifi address for the next boot (lib/wificache.py)
+        '''
+        if self.useLTE:
+            ready = self.lteSession.ready()
+        else:
+            ready = self.wlan.isconnected()
+            if not ready and self.wifiCache.expired(self.wlan):
+                # boot.py did not wait for the cached access point, it did not answer
+                self.wifiCache.fallback(self.wlan)
+                try:
+                    self.wifiCache.scanConnect(self.wlan, ConfigNetwork.WIFI_DEADLINE * 1000)
+                except Exception as e:
+                    if self.debug:
+                        print("Failed to connect to any known network... Exception: {}".format(e))
+        if ready and not self._networkUp:
+            self._networkUp = True
+            self._getRTC()
+            if not self.useLTE:
+                self.wifiCache.saveIfconfig(self.wlan.ifconfig())
+        return ready
+
+    def waitNetwork(self):
+        '''
+        Waits for the network, until ConfigNetwork.CONNECT_TIMEOUT seconds after the wakeup at most.
+        Returns true if it is up
+        '''
+        if self.networkReady():
+            return True
+        with profiler.span(profiler.BOOT):
+            # ticks_ms counts from the boot
+            while not self.networkReady():
+                if utime.ticks_ms() > ConfigNetwork.CONNECT_TIMEOUT * 1000:
+                    if self.debug:
+                        print("Network not up after {} seconds".format(ConfigNetwork.CONNECT_TIMEOUT))
+                    return False
+                utime.sleep_ms(50)
+        return True
+
+    def _service(self):
+        '''
+        Called while the gps or the accelerometer keeps the tracker busy: sends what is queued as soon as the
+        network is up and keeps the broker connection alive
+        '''
+        if self.mqtt.client is None and not self.outbox.isEmpty():
+            self.flushOutbox()
+        self.mqtt.poll()
+
+    def _restoreClock(self):
+        '''
+        The rtc starts from 0 on every wakeup (the Pytrack powers the GPy off while it sleeps). Until ntp syncs it,
+        it is set from the time the sleep was due to end (saved by goToSleep) less what the Pytrack says was left of
+        it, the gps start strategy needs the time before the network is up
+        '''
+        wakeTime = self._getNVS(ConfigWakeup.NVS_WAKE_TIME)
+        if wakeTime is None:
+            return
+        pycom.nvs_erase(ConfigWakeup.NVS_WAKE_TIME)
+        rtc = machine.RTC()
+        if rtc.synced():
+            return
+        try:
+            if self.pytrack.get_wake_reason() == WAKE_REASON_ACCELEROMETER:
+                wakeTime -= self.pytrack.get_sleep_remaining()
+        except Exception as e:
+            if self.debug:
+                print("Exception reading the sleep remaining: {}".format(e))
+        # The rtc counts from the boot until then
+        rtc.init(utime.gmtime(wakeTime + utime.time())[:6])
+
     @staticmethod
     def _getRTC():
         '''
@@ -87,13 +221,7 @@ class Tracker:
         Looks up at the non volatile storage for a specified key. If it exists, returns the value stored
         for that key. Otherwise, returns None
         '''
-        try:
-            if pycom.nvs_get(key) is not None:
-                return pycom.nvs_get(key)
-        except Exception:
-            # Do nothing, key doesnt exist
-            pass
-        return None
+        return nvsutil.get(key)
 
     @staticmethod
     def _decodeBytes(data):
@@ -107,124 +235,49 @@ class Tracker:
             pass
         return data
 
-    def _getMqttClient(self, debug):
-        # Initialize mqttClient
-        state = False
-        count = 0
-        mqttClient = None
+    def _newMqttClient(self, retry):
+        # A failed attempt may be an outdated cached address, resolve the broker again then
+        mqttClient = MQTTClient(ConfigMqtt.CLIENT_ID, ConfigMqtt.SERVER, port=ConfigMqtt.PORT, user=ConfigMqtt.USER,
+                                password=ConfigMqtt.PASSWORD, keepalive=ConfigMqtt.KEEPALIVE,
+                                max_inflight=ConfigMqtt.MAX_INFLIGHT, timeout=ConfigMqtt.SOCKET_TIMEOUT,
+                                addr=self.brokerAddress.resolve(fresh=retry), ssl=ConfigMqtt.SSL,
+                                ssl_params=ConfigMqtt.SSL_PARAMS)
+        # Set the callback method that will be invoked on subscription to topics
+        mqttClient.set_callback(self.mqttCallback)
+        return mqttClient
 
-        while not state and count < 5:
-            try:
-                count += 1
-                mqttClient = MQTTClient(ConfigMqtt.CLIENT_ID, ConfigMqtt.SERVER, port=ConfigMqtt.PORT, user=ConfigMqtt.USER, password=ConfigMqtt.PASSWORD)
-                # Set the callback method that will be invoked on subscription to topics
-                mqttClient.set_callback(self.mqttCallback)
-                mqttClient.connect()
-                state = True
-            except Exception as e:
-                if debug:
-                    print("Exception on initialize mqtt client: {}".format(e))
-                time.sleep(0.5)
-        
-        #Subscribe to the disable tracking topic
-        mqttClient.subscribe(topic=ConfigMqtt.TOPIC_TRACKING_STATE)
-        time.sleep(0.5)
+    def _onMqttConnect(self, mqttClient, sessionPresent):
+        '''
+        Called by the connection manager after every connect: subscribes when the broker lost the session and
+        processes what it queued for the tracker
+        '''
+        if not sessionPresent:
+            # New session at the broker (first connection or it was lost), the subscriptions have to be made again
+            pycom.nvs_set(ConfigMqtt.NVS_SUBSCRIBED, 0)
+        if not self._getNVS(ConfigMqtt.NVS_SUBSCRIBED):
+            #Subscribe to the disable tracking topic
+            mqttClient.subscribe(topic=ConfigMqtt.TOPIC_TRACKING_STATE, qos=ConfigMqtt.SUBSCRIBE_QOS)
+            if not ConfigMqtt.CLEAN_SESSION:
+                pycom.nvs_set(ConfigMqtt.NVS_SUBSCRIBED, 1)
         if self.debug:
             print("Checking MQTT messages")
 
-        mqttClient.check_msg()
+        # What the broker queued for the session (or retained for a new subscription) comes right after
+        # the CONNACK / SUBACK
+        while mqttClient.check_msg() is not None:
+            pass
 
         if self.debug:
-            print("Messages checked. Returning MQTT client")
-
-        return mqttClient
+            print("Messages checked")
 
     def initLTE(self):
-        #TODO remove
-        return
         '''
-        If already used, the lte device will have an active connection.
-        If not, need to set up a new connection.
+        Starts the lte attach (lib/ltesession.py), the modem is only provisioned again when ConfigLTE changed.
+        Waits for the connection unless the network comes up concurrently
         '''
-        lte = self.lte
-        debug = self.debug
-
-        if lte.isconnected():
-            return
-
-        # Modem does not connect successfully without first being reset.
-        if debug:
-            print("Resetting LTE modem ... ", end='')
-        lte.send_at_cmd('AT^RESET')
-        if debug:
-            print("OK")
-        time.sleep(5)
-        lte.send_at_cmd('AT+CFUN=0')
-        time.sleep(5)
-
-        #send_at_cmd_pretty('AT!="fsm"')
-        # While the configuration of the CGDCONT register survives resets,
-        # the other configurations don't. So just set them all up every time.
-        if debug:
-            print("Configuring LTE ", end='')
-        lte.send_at_cmd('AT!="clearscanconfig"')
-
-        if debug:
-            print(".", end='')
-        lte.send_at_cmd('AT!="RRC::addScanBand band=26"')
-
-        if debug:
-            print(".", end='')
-        lte.send_at_cmd('AT!="RRC::addScanBand band=18"')
-
-        if debug:
-            print(".", end='')
-        lte.send_at_cmd('AT+CGDCONT=1,"IP","soracom.io"')
-
-        if debug:
-            print(".", end='')
-        lte.send_at_cmd('AT+CGAUTH=1,1,"sora","sora"')
-        print(".", end='')
-
-        if debug:
-            lte.send_at_cmd('AT+CFUN=1')
-        print(" OK")
-
-        # If correctly configured for carrier network, attach() should succeed.
-        if not lte.isattached():
-            if debug:
-                print("Attaching to LTE network ", end='')
-            lte.attach()
-
-            while True:
-                if lte.isattached():
-                    #send_at_cmd_pretty('AT+COPS?')
-                    time.sleep(5)
-                    break
-
-                if debug:
-                    print('.', end='')
-                    pycom.rgbled(0x0f0000)
-                time.sleep(0.5)
-                if debug:
-                    pycom.rgbled(0x000000)
-                time.sleep(1.5)
-
-        # Once attached, connect() should succeed.
-        if not lte.isconnected():
-            if debug:
-                print("Connecting on LTE network ", end='')
-            lte.connect()
-            while True:
-                if lte.isconnected():
-                    break
-                if debug:
-                    print('.', end='')
-                time.sleep(1)
-
-        # Once connect() succeeds, any call requiring Internet access will
-        # use the active LTE connection.
-        self.lte = lte
+        self.lteSession.start()
+        if not ConfigNetwork.CONCURRENT_BRINGUP:
+            self.waitNetwork()
 
     def isContinueGPSRead(self):
         '''
@@ -263,24 +316,28 @@ class Tracker:
         # TODO remove
         return False
         bt = Bluetooth()
+        scanStart = utime.ticks_ms()
         bt.start_scan(ConfigBluetooth.SCAN_ALLOW_TIME)  # Scans for 10 seconds
 
-        while bt.isscanning():
-            adv = bt.get_adv()
-            if adv and binascii.hexlify(adv.mac) == ConfigBluetooth.MAC_ADDR:
-                try:
-                    if self.debug:
-                        print("Owner device found: {} Mac addr {}".format(bt.resolve_adv_data(adv.data, Bluetooth.ADV_NAME_CMPL), ConfigBluetooth.MAC_ADDR))
-                    conn = bt.connect(adv.mac)
-                    time.sleep(0.05)
-                    conn.disconnect()
-                    bt.stop_scan()
-                except Exception:
-                    bt.stop_scan()
-
-                return True
-
-            time.sleep(0.050)
+        try:
+            while bt.isscanning():
+                adv = bt.get_adv()
+                if adv and binascii.hexlify(adv.mac) == ConfigBluetooth.MAC_ADDR:
+                    try:
+                        if self.debug:
+                            print("Owner device found: {} Mac addr {}".format(bt.resolve_adv_data(adv.data, Bluetooth.ADV_NAME_CMPL), ConfigBluetooth.MAC_ADDR))
+                        conn = bt.connect(adv.mac)
+                        time.sleep(0.05)
+                        conn.disconnect()
+                        bt.stop_scan()
+                    except Exception:
+                        bt.stop_scan()
+
+                    return True
+
+                time.sleep(0.050)
+        finally:
+            self.energy.add(energy.BLE, utime.ticks_diff(utime.ticks_ms(), scanStart), ConfigEnergy.BLE_SCAN_MA)
 
         return False
 
@@ -291,6 +348,7 @@ class Tracker:
         '''
         # Current time and last time we wokeup with owner nearby was less than 2 minutes apart.
         # Go to deep sleep for specified amount of time without accelerometer wakeup
+        self.energy.sleep(ConfigWakeup.SLEEP_TIME_OWNER_NEARBY, False, profiler.end_wake(ConfigProfile.RING_WAKES))
         self.pytrack.setup_sleep(ConfigWakeup.SLEEP_TIME_OWNER_NEARBY)
         self.pytrack.go_to_sleep()
 
@@ -306,6 +364,13 @@ class Tracker:
 
         # Attempt to decode the topic and msg if in byte format
         topic = self._decodeBytes(topic)
+
+        # EPO file chunks are binary, hand them over as they are
+        if topic == ConfigMqtt.TOPIC_EPO:
+            if self.epo is not None and self.epo.handleChunk(msg):
+                self.epoDownloaded = True
+            return
+
         msg = self._decodeBytes(msg)
 
         # Handle mqtt topic for disabiling the monitoring
@@ -313,6 +378,8 @@ class Tracker:
             try:
                 bSleep = False
                 sleepTime = ConfigMqtt.SLEEP_TIME_MQTT_DISABLE
+                # Time tracking stays disabled until, 0 until it is enabled again
+                disabledUntil = 0
 
                 # First check if this is a plaintext msg (not json format)
                 if msg == ConfigMqtt.ENABLE_TRACKING_MSG:
@@ -336,6 +403,13 @@ class Tracker:
                         # If theres a time with the disable flag, go to sleep for that amount of time
                         if jMsg['time'] and jMsg['time'] is not None:
                             sleepTime = jMsg['time']
+                            disabledUntil = utime.time() + sleepTime
+
+                # The broker does not send the state again on the next wakeups (persistent session), remember it
+                if bSleep:
+                    pycom.nvs_set(ConfigMqtt.NVS_TRACKING_OFF, disabledUntil)
+                elif self._getNVS(ConfigMqtt.NVS_TRACKING_OFF) is not None:
+                    pycom.nvs_erase(ConfigMqtt.NVS_TRACKING_OFF)
 
                 # If the flag was set, go to sleep
                 if bSleep:
@@ -348,42 +422,94 @@ class Tracker:
                     print('Exception parsing disable tracking mqtt msg')
 
 
+    @staticmethod
+    def _encodeMessage(msg):
+        """payload bytes of a message: str and bytes as is, dicts and lists as json, anything else as its str"""
+        if isinstance(msg, (bytes, bytearray)):
+            return bytes(msg)
+        if isinstance(msg, (dict, list, tuple)):
+            msg = ujson.dumps(msg)
+        elif not isinstance(msg, str):
+            msg = str(msg)
+        return msg.encode()
+
     def sendMQTTMessage(self, topic, msg, retain=False):
         '''
-        Sends an MQTT message to the specified topic
+        Queues an MQTT message to the specified topic and sends everything queued if the broker is reachable.
+        Messages that cannot be sent now stay on flash and go out on the next connection
         topic - Topic to send to
-        msg - Message to send to topic
-        mqttClient - MQTT Client used to send the message. If not defined, sends to default configured mqtt client in configuration
+        msg - Message to send to topic (str, bytes or json serializable)
+        retain - If the broker should retain the message
         '''
         debug = self.debug
+        msg = self._encodeMessage(msg)
 
         # If LTE is not setup, initialize it so we can send messages
         #self.initLTE()
 
-        if self.mqttClient is None:
-            try:
-                # Instantiate a new MQTTClient
-                self.mqttClient = self._getMqttClient(debug)
-            except:
-                self.mqttClient = None
-
         try:
-            if self.mqttClient is not None:
-                # Send the message topic
-                self.mqttClient.publish(topic=topic, msg=msg, retain=retain)
-        except:
+            self.outbox.append(topic, msg, retain)
+        except Exception as e:
+            # Flash write failed, try to send it straight away
             if debug:
-                print("Exception occurred attempting to connect to MQTT server")
+                print("Exception queueing mqtt message: {}".format(e))
+            mqttClient = self.mqtt.connect()
+            if mqttClient is not None:
+                try:
+                    mqttClient.publish(topic=topic, msg=msg, retain=retain)
+                except Exception as e:
+                    self.mqtt.failed(e)
+            return
 
+        self.flushOutbox()
 
-    def goToSleep(self, sleepTime=60, bWithInterrupt=False, bSleepGps=True):
+    @profiler.timed(profiler.PUBLISH)
+    def flushOutbox(self):
+        '''
+        Sends the queued messages in batches with QoS ConfigMqtt.OUTBOX_QOS (pipelined up to ConfigMqtt.MAX_INFLIGHT).
+        A batch is dropped from the queue once the broker acknowledged all of it.
+        Connects first if needed. Returns True if the queue was emptied
+        '''
+        mqttClient = self.mqtt.connect()
+        if mqttClient is None:
+            return False
+        outbox = self.outbox
+        sent = 0
+        try:
+            while True:
+                batch = outbox.batch()
+                if not batch:
+                    break
+                for end, topic, msg, retain in batch:
+                    mqttClient.publish(topic=topic, msg=msg, retain=retain, qos=ConfigMqtt.OUTBOX_QOS)
+                mqttClient.flush()
+                outbox.commit(batch[-1][0])
+                sent += len(batch)
+        except Exception as e:
+            if self.debug:
+                print("Exception occurred sending queued mqtt messages: {}".format(e))
+            # The connection is gone, reconnect on the next message
+            self.mqtt.failed(e)
+            return False
+        if self.debug and sent:
+            print("Sent {} queued mqtt messages".format(sent))
+        return True
+
+    def goToSleep(self, sleepTime=60, bWithInterrupt=False, bSleepGps=None):
         '''
         Puts the py to deepsleep, turning off lte in order to reduce battery consumption.
-        By default, sleeps for 60 seconds and powers down gps.
+        By default, sleeps for 60 seconds and lets the gps start strategy decide if the gps stays powered.
         sleepTime - specifies the time (in seconds) to put the device in deep sleep before waking up
         bWithInterrupt - if True, will wakeup for both timer timeout as well as acceleration interrupt
-        bSleepGps - If True, puts the gps in deepsleep state as well (will take longer to reinitialize and refix gps signal)
+        bSleepGps - If True, puts the gps in deepsleep state as well (will take longer to reinitialize and refix gps signal).
+            If None, the gps stays powered only if a hot start after the sleep is worth the current
         '''
+        # Until the deep sleep, end_wake closes it
+        profiler.begin(profiler.SLEEP)
+        if bSleepGps is None:
+            bSleepGps = not self.gpsStart.retainBackup(sleepTime)
+        self.gpsStart.setBackup(not bSleepGps)
+
         # Enable wakeup source from INT pin
         self.pytrack.setup_int_pin_wake_up(False)
 
@@ -393,23 +519,24 @@ class Tracker:
             self.accel.enable_activity_interrupt(
                 ConfigAccelerometer.INTERRUPT_THRESHOLD, ConfigAccelerometer.INTERRUPT_DURATION)
 
-        # If mqttClient is defined, disconnect
-        if self.mqttClient is not None:
-            try:
-                self.mqttClient.disconnect()
-            except:
-                if self.debug:
-                    print("Exception occurred disconnecting from mqtt client")
+        # What is still queued goes out once the network is up (it may still be coming up)
+        if not self.outbox.isEmpty() and self.waitNetwork():
+            self.flushOutbox()
 
-        # Disconnect lte
-        if self.lte is not None and self.lte.isconnected():
-            try:
-                self.lte.disconnect()
-                time.sleep(1)
-                self.lte.dettach()
-            except:
-                if self.debug:
-                    print("Exception disconnecting from lte")
+        # If connected, look the broker up again if its cached address is old (nothing waits on it any more),
+        # wait for the acknowledgements still in flight and disconnect
+        if self.mqtt.client is not None:
+            self.brokerAddress.refresh()
+        self._queueTelemetry()
+        self.mqtt.close()
+        if self.debug:
+            print("Mqtt connection stats {}".format(self.mqtt.stats))
+
+        # The lte modem stays registered in power saving mode, or detaches
+        if self.useLTE:
+            self.lteSession.sleep()
+            if self.debug:
+                print("LTE session stats {}".format(self.lteSession.stats))
 
         # Go to sleep for specified amount of time if no accelerometer wakeup
         if self.debug:
@@ -417,39 +544,196 @@ class Tracker:
             time.sleep(0.5)
 
         time.sleep(0.1)
+        now = utime.time()
+        if now > timeutil.TIME_KNOWN:
+            pycom.nvs_set(ConfigWakeup.NVS_WAKE_TIME, now + sleepTime)
+        # Record the timings and the charge of this wakeup last, the deep sleep reboots
+        self.energy.sleep(sleepTime, not bSleepGps, profiler.end_wake(ConfigProfile.RING_WAKES))
         self.pytrack.setup_sleep(sleepTime)
         self.pytrack.go_to_sleep(gps=bSleepGps)
 
+    def _queueTelemetry(self):
+        '''
+        Queues the phase timings of the last wakeups (lib/profiler.py) once ConfigProfile.FLUSH_WAKES are
+        recorded and the energy totals (lib/energy.py) every ConfigEnergy.PUBLISH_WAKES wakeups.
+        Only sent now if the broker is connected anyway
+        '''
+        queued = False
+        try:
+            if profiler.enabled() and profiler.pending() >= ConfigProfile.FLUSH_WAKES:
+                self.outbox.append(ConfigMqtt.TOPIC_TELEMETRY, profiler.payload(), False)
+                profiler.clear()
+                queued = True
+            if self.energy.due():
+                self.outbox.append(ConfigMqtt.TOPIC_ENERGY, self._encodeMessage(self.energy.message()), False)
+                self.energy.sent()
+                queued = True
+        except Exception as e:
+            if self.debug:
+                print("Exception queueing telemetry: {}".format(e))
+        if queued and self.mqtt.client is not None:
+            self.flushOutbox()
+
 
+    def _downloadEpo(self, nowHour):
+        '''
+        Requests a new EPO file over mqtt and waits for its chunks (written to flash by mqttCallback). The gps is
+        read for a fix in between, the download is given up once it has one. When no file came in, no new one is
+        requested for ConfigGPS.EPO_RETRY_BACKOFF seconds. Returns true if the file was received
+        '''
+        mqttClient = self.mqtt.connect()
+        if mqttClient is None:
+            return False
+        self.epoDownloaded = False
+        fixed = False
+        try:
+            self.epo.startDownload()
+            mqttClient.subscribe(topic=ConfigMqtt.TOPIC_EPO)
+            mqttClient.publish(topic=ConfigMqtt.TOPIC_EPO_REQUEST, msg=str(nowHour))
+            start = utime.time()
+            while not self.epoDownloaded and utime.time() - start < ConfigGPS.EPO_DOWNLOAD_TIMEOUT:
+                while not self.epoDownloaded and mqttClient.check_msg() is not None:
+                    pass
+                if not self.epoDownloaded and self.gps.get_fix(debug=False, timeout=ConfigGPS.FIX_POLL):
+                    # Fixed without the assistance, the file is left for the next cold start
+                    fixed = True
+                    break
+        except Exception as e:
+            if self.debug:
+                print("Exception downloading EPO file: {}".format(e))
+            self.mqtt.failed(e)
+        if not self.epoDownloaded:
+            self.epo.abortDownload()
+            if not fixed:
+                pycom.nvs_set(ConfigGPS.NVS_EPO_RETRY, utime.time() + ConfigGPS.EPO_RETRY_BACKOFF)
+        return self.epoDownloaded
+
+    def _assistGps(self):
+        '''
+        Assists a cold start with EPO data and the reference time / last known position, the gps keeps acquiring
+        meanwhile. Needs a synced rtc (so the network is up). A new EPO file is downloaded first when the one on
+        flash runs out, unless the last download failed less than ConfigGPS.EPO_RETRY_BACKOFF seconds ago.
+        Returns true if the gps got the assistance data
+        '''
+        rtc = machine.RTC()
+        if not rtc.synced():
+            return False
+        utc = rtc.now()
+        nowHour = gps_hour(utc)
+        if self.epo is None:
+            self.epo = EPOLoader(debug=self.debug)
+        self.epo.gps = self.gps
+        retryAt = self._getNVS(ConfigGPS.NVS_EPO_RETRY)
+        if self.epo.needsDownload(nowHour) and (retryAt is None or utime.time() >= retryAt):
+            self._downloadEpo(nowHour)
+            if self.gps.fix:
+                # Fixed while the file came in, nothing left to assist
+                return False
+        try:
+            return self.epo.assist(utc, self.gpsStart.lastFixPosition())
+        except Exception as e:
+            if self.debug:
+                print("Exception loading EPO data: {}".format(e))
+        return False
+
+    @profiler.timed(profiler.GPS_FIX)
     def _getGpsFix(self):
         '''
-        Attempts to lock on a signal to the gps.
+        Attempts to lock on a signal to the gps. The start strategy (hot, warm or cold) sets the timeout
+        of each attempt and falls back to a warm and then cold restart after a failed attempt. A cold start
+        is assisted with EPO data once the network is up, without waiting for it.
         Returns true if signal is found, false otherwise
         '''
         # Attempt to get the gps lock for X number of attempts (defined in config)
         maxTries = max(ConfigGPS.LOCK_FAIL_ATTEMPTS, 1)
         signalFixTries = maxTries
+        self._getRTC()  # Syncs rtc, the strategy depends on the age of the last fix
+        strategy = self.gpsStart.choose()
+        bIsFixed = False
         while signalFixTries > 0:
             signalFixTries -= 1
             if self.debug:
-                print("On GPS fix try number {} of {}".format(maxTries - signalFixTries, maxTries))
-            self.gps.get_fix(debug=False)
+                print("On GPS fix try number {} of {} ({} start)".format(
+                    maxTries - signalFixTries, maxTries, STRATEGY_NAMES[strategy]))
+            self.gpsStart.apply(self.gps, strategy, escalated=signalFixTries < maxTries - 1)
+            ttff = self._waitFix(self.gpsStart.timeout(strategy), assist=strategy == START_COLD)
             pycom.heartbeat(False)
-            bIsFixed = False
+            if self.gpsAssisted:
+                strategy = START_ASSISTED
 
-            if self.gps.fixed():
+            if ttff is not None and self.gps.fixed():
                 # Got the GPS fix, exit out of this while condition
                 if self.debug:
                     pycom.rgbled(0x000f00)
                 bIsFixed = True
+                self._setRTCFromGps()
+                self.gpsStart.recordFix(strategy, ttff, self.gps.Latitude, self.gps.Longitude)
+                break
             else:
                 # If couldnt get a signal fix, try again
                 if self.debug:
                     pycom.rgbled(0x0f0000)
+                self.gpsStart.recordFailure(strategy)
+                strategy = self.gpsStart.fallback(strategy)
 
+        if self.debug:
+            print("GPS ttff statistics {}".format(self.gpsStart.stats()))
         return bIsFixed
 
 
+    def _setRTCFromGps(self):
+        '''
+        Sets the rtc from the time of the fix if ntp did not sync it, the network may still be coming up.
+        The time of the fix is saved for the next start strategy
+        '''
+        rtc = machine.RTC()
+        if rtc.synced():
+            return
+        state = self.gps.state
+        timestamp = location.unix_time(state.date, state.utc)
+        if timestamp is not None:
+            rtc.init(utime.gmtime(timestamp)[:6])
+
+    def _waitFix(self, timeout, assist=False):
+        '''
+        Reads the gps until it has a fix, for timeout seconds at most. Reads ConfigGPS.FIX_POLL seconds at a time
+        and services the network in between (sends what is queued once it is up). With assist, the cold start
+        is assisted (_assistGps) as soon as the network and the rtc are, self.gpsAssisted tells if it was.
+        Returns the seconds it took, None without a fix
+        '''
+        self.gpsAssisted = False
+        start = utime.ticks_ms()
+        while True:
+            elapsed = utime.ticks_diff(utime.ticks_ms(), start) / 1000
+            if elapsed >= timeout:
+                return None
+            if self.gps.get_fix(debug=False, timeout=min(ConfigGPS.FIX_POLL, timeout - elapsed)):
+                return round(utime.ticks_diff(utime.ticks_ms(), start) / 1000)
+            if assist and self.networkReady() and machine.RTC().synced():
+                assist = False
+                self.gpsAssisted = self._assistGps()
+                if self.gps.fix:
+                    # Fixed while the EPO file was downloading
+                    return round(utime.ticks_diff(utime.ticks_ms(), start) / 1000)
+            self._service()
+
+    def startGps(self):
+        '''
+        Sets the gps up for tracking. It acquires from the moment the Pytrack powers it, so this is done first
+        on wakeups that need a location, while the network comes up
+        '''
+        if self.gps is not None:
+            return
+        with profiler.span(profiler.GPS_INIT):
+            # Not woken by the Pytrack: powered up, the cached identification of the chip is checked
+            self.gps = L76GNSS(self.pytrack, timeout=ConfigGPS.LOCK_TIMEOUT, debug=False,
+                               cold_start=self.pytrack.get_wake_reason() not in (WAKE_REASON_ACCELEROMETER,
+                                                                                 WAKE_REASON_TIMER))
+            # Always on, and only output the sentences we use for tracking (one pipelined PMTK round trip)
+            if not self.gps.configure(periodic_mode=0, nmea_output=ConfigGPS.NMEA_OUTPUT_TRACKING,
+                                      fix_interval=ConfigGPS.FIX_INTERVAL_MS) and self.debug:
+                print("GPS did not acknowledge the tracking configuration")
+
     def monitorLocation(self, bWithMotion=True):
         '''
         Sends GPS location to Mqtt topic. Continues sending data as long as motion is detected
@@ -458,26 +742,35 @@ class Tracker:
         '''
         if self.debug:
             print("Monitoring Location")
-        self.gps = L76GNSS(self.pytrack, timeout=ConfigGPS.LOCK_TIMEOUT, debug=False)
-        self.gps.setAlwaysOn()
+        self.startGps()
 
         if not self._getGpsFix():
             # Couldnt get a signal so send message to topic for gps not available and exit (go back to sleep)
             if self.debug:
                 print("Couldnt get a GPS signal after {} attempts".format(ConfigGPS.LOCK_FAIL_ATTEMPTS))
             self.sendMQTTMessage(ConfigMqtt.TOPIC_GPS_NOT_AVAILABLE, "-1")
+            self._sendFixBatch()
             return
 
-        # Otherwise we have a gps signal, so get the coordinates and send to topic
-        coordinates = self.gps.coordinates()
-        self.sendMQTTMessage(ConfigMqtt.TOPIC_GPS, coordinates)
+        # Otherwise we have a gps signal, so get the coordinates and send to topic (or add them to the batch)
+        payload = self._locationPayload(ConfigMqtt.TOPIC_GPS)
+        batching = self._batchLocations() and isinstance(payload, bytes)
+        if batching:
+            self.fixBatch.add(payload)
+        else:
+            self.sendMQTTMessage(ConfigMqtt.TOPIC_GPS, payload)
 
         # Save current timestamp of log time
         self._getRTC()  # Syncs rtc
         pycom.nvs_set(ConfigGPS.NVS_LAST_LOCATION_LOG_TIME, utime.time())
 
+        moving = bWithMotion & self.accelInMotion()
+        # The batch goes out with the first fix of a ride, once it is full or old enough and when the ride ends
+        if batching and (not moving or not self.continueGPSRead or self.fixBatch.due()):
+            self._sendFixBatch()
+
         # If we want to monitor with motion (send multiple gps coordinates as long as there is motion), start monitoring
-        if bWithMotion & self.accelInMotion():
+        if moving:
             # Go to sleep for a specified amount of time (keeping GPS alive) to conserve some battery
             # TODO - check if this is better than setPeriodicMode
             if self.debug:
@@ -487,6 +780,40 @@ class Tracker:
             self.goToSleep(sleepTime=ConfigGPS.SLEEP_BETWEEN_READS, bWithInterrupt=False, bSleepGps=False)
 
 
+    @staticmethod
+    def _batchLocations(topic=ConfigMqtt.TOPIC_GPS):
+        return ConfigMqtt.LOCATION_FORMATS.get(topic) == location.FORMAT_BATCH
+
+    def _sendFixBatch(self):
+        '''
+        Sends the fixes batched on flash as one message (lib/location.py version 2) and empties the batch.
+        The message is in the outbox before the batch is dropped
+        '''
+        payload = self.fixBatch.payload()
+        if payload is not None:
+            self.sendMQTTMessage(ConfigMqtt.TOPIC_GPS, payload)
+            self.fixBatch.clear()
+
+    def _locationPayload(self, topic):
+        '''
+        Payload of the current gps location in the format configured for topic (ConfigMqtt.LOCATION_FORMATS):
+        the binary encoding of lib/location.py (batches are made of these) or a json dict
+        '''
+        coordinates = self.gps.coordinates()
+        state = self.gps.state
+        # Time of the fix from the gps, the rtc if the epoch has no date
+        timestamp = location.unix_time(state.date, state.utc)
+        if timestamp is None and self._getRTC().synced():
+            timestamp = utime.time()
+        if ConfigMqtt.LOCATION_FORMATS.get(topic) in (location.FORMAT_BINARY, location.FORMAT_BATCH) and \
+                coordinates['latitude'] is not None:
+            if state.complete() and state.latitude is not None:
+                return location.encode_state(state, timestamp)
+            return location.encode(coordinates['latitude'], coordinates['longitude'], timestamp)
+        coordinates['time'] = timestamp
+        return coordinates
+
+    @profiler.timed(profiler.MOTION)
     def accelInMotion(self, numReads=10):
         '''
         Takes numReads measurements of accelerometer data to detect if there is motion.
@@ -499,6 +826,7 @@ class Tracker:
         for index in range(0, numReads):
             # Print change from last reading
             time.sleep(0.5)
+            self._service()
             xyzList.append(accel.acceleration())
             deltas = list(map(lambda b, a: abs(b - a), xyzList[-1], xyzList[-2]))  # Get last element (with -1) and subtract previous element (-2)
             # If max delta is greater than threshold, return true
@@ -566,16 +894,24 @@ class Tracker:
 
 
 def main(debug=False):
+    # Phase timings of the wakeup, already started by boot.py
+    profiler.enable(ConfigProfile.ENABLED, ConfigProfile.FILE)
     pycom.heartbeat(False)
-    py = Pytrack()
 
-    #Initialize new instance of Tracker class and initialize
-    tracker = Tracker(pytrack=py, debug=debug)
-    tracker.init(bInitLTE=False)  #TODO change to True
+    with profiler.span(profiler.INIT):
+        py = Pytrack()
+
+        #Initialize new instance of Tracker class and initialize
+        tracker = Tracker(pytrack=py, debug=debug)
+        tracker.init(bInitLTE=ConfigNetwork.USE_LTE)
 
     try:
         # Get the wakeup reason
         wakeReason = tracker.getWakeReason()
+        profiler.set_reason(wakeReason)
+        if wakeReason != ConfigWakeup.WAKE_REASON_TIMEOUT:
+            # Tracking or a possible theft, the gps is set up while the network comes up
+            tracker.startGps()
 
         # If continueGPS is true, dont send another heartbeat. Jump right to the continue monitoring service
         if wakeReason == ConfigWakeup.WAKE_CONTINUE_GPS:
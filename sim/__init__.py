@@ -0,0 +1,10 @@
+# Host side simulator of the tracker hardware (GPy + Pytrack)
+# Runs the unchanged main.py / lib code with CPython on simulated time:
+# firmware modules (machine, pycom, network, utime, usocket, ussl) are replaced
+# by sim/fake, the Pytrack I2C devices by sim/devices and the MQTT server by
+# sim/broker. See `python -m sim --help`
+# author: callen
+#
+
+from sim.clock import SimClock
+from sim.runtime import Simulator, NetModel, AccessPoint, DeepSleep, SimReset, current
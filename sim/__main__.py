@@ -0,0 +1,45 @@
+# Runs tracker wake cycles in the simulator and prints what each one did
+# usage: python -m sim [--wakes N] [--motion START:END ...] [--no-sky] [--no-boot]
+# author: callen
+#
+
+import argparse
+
+from sim.runtime import Simulator, DEFAULT_CAPTURE
+
+
+def _window(text):
+    start, end = text.split(':')
+    return (float(start), float(end))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated tracker wake cycles')
+    parser.add_argument('--wakes', type=int, default=5, help='number of wake cycles')
+    parser.add_argument('--capture', default=DEFAULT_CAPTURE, help='recorded L76 NMEA output to replay')
+    parser.add_argument('--motion', type=_window, action='append', default=[],
+                        help='simulated seconds START:END the bike moves (repeatable)')
+    parser.add_argument('--no-sky', action='store_true', help='the gps never gets a fix')
+    parser.add_argument('--no-boot', action='store_true', help='skip boot.py (wifi connect) before main.py')
+    parser.add_argument('--debug', action='store_true', help='print each wake record as it happens')
+    args = parser.parse_args()
+
+    sim = Simulator(capture=args.capture, motion=args.motion, sky=not args.no_sky, debug=args.debug)
+    wakes = sim.run(wakes=args.wakes, boot_script=None if args.no_boot else 'boot.py')
+
+    print("{:>4} {:>10} {:>6} {:>9} {:>9} {:>5} {:>9} {:>9}".format(
+        'wake', 'at (s)', 'reason', 'awake (s)', 'sleep (s)', 'gps', 'i2c B', 'published'))
+    for record in wakes:
+        print("{:>4} {:>10.1f} {:>6} {:>9.2f} {:>9} {:>5} {:>9} {:>9}".format(
+            record.number, record.start, record.reason, record.awake,
+            record.sleep if record.sleep is not None else '-',
+            'on' if record.gps_powered else 'off', record.stats['i2c_bytes'], len(record.published)))
+        if record.reset:
+            print("     machine.reset()")
+        if record.error is not None:
+            print("     stopped by {!r}".format(record.error))
+    print("gps starts: {}".format(', '.join('{}@{:.0f}s'.format(kind, t) for t, kind in sim.gps.starts)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,452 @@
+# In process MQTT 3.1.1 broker and TCP sockets for the host side simulator
+# The tracker's sockets talk to SimBroker directly. Answers become readable one
+# round trip after the request was written, blocking reads advance the
+# simulated clock to that moment. Every socket write is counted, so benches can
+# compare how many writes (syscalls / radio bursts) a message costs
+# author: callen
+#
+
+import errno
+import struct
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter match with + and # wildcards"""
+    pattern = pattern.split('/')
+    topic = topic.split('/')
+    for i, level in enumerate(pattern):
+        if level == '#':
+            return True
+        if i >= len(topic) or (level != '+' and level != topic[i]):
+            return False
+    return len(pattern) == len(topic)
+
+
+def _remaining_length(size):
+    out = bytearray()
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        out.append(byte | 0x80 if size else byte)
+        if not size:
+            return bytes(out)
+
+
+def publish_packet(topic, payload, qos=0, retain=False, pid=0):
+    """a PUBLISH packet from the broker to a client"""
+    topic = topic.encode() if isinstance(topic, str) else topic
+    body = struct.pack('!H', len(topic)) + topic
+    if qos:
+        body += struct.pack('!H', pid)
+    body += payload
+    return bytes([0x30 | qos << 1 | retain]) + _remaining_length(len(body)) + body
+
+
+class Message:
+    __slots__ = ('time', 'client', 'topic', 'payload', 'qos', 'retain', 'dup')
+
+    def __init__(self, time, client, topic, payload, qos, retain, dup):
+        self.time = time
+        self.client = client
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.dup = dup
+
+    def __repr__(self):
+        return 'Message({!r}, {!r}, qos={})'.format(self.topic, bytes(self.payload[:32]), self.qos)
+
+
+class Session:
+    """subscriptions of a client id, kept between connections unless clean session"""
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.subscriptions = {}
+        self.clean = True
+        # Packet ids of QoS 2 messages received but not released (PUBREL) yet
+        self.qos2 = set()
+        # QoS 1 messages for the client: sent and not acknowledged yet (by pid), and
+        # queued while it was not connected. Both go out after its next CONNACK
+        self.unacked = {}
+        self.queue = []
+
+
+class Connection:
+    """the broker side of one TCP connection"""
+
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.session = None
+        self._rx = bytearray()
+        self.closed = False
+
+    def received(self, data):
+        if self.broker.silent:
+            return
+        self._rx += data
+        while not self.closed:
+            packet = self._next_packet()
+            if packet is None:
+                return
+            self.broker._handle(self, packet[0], packet[1])
+
+    def _next_packet(self):
+        rx = self._rx
+        size = 0
+        shift = 0
+        i = 1
+        while True:
+            if i >= len(rx):
+                return None
+            byte = rx[i]
+            size |= (byte & 0x7F) << shift
+            i += 1
+            if not byte & 0x80:
+                break
+            shift += 7
+        if len(rx) < i + size:
+            return None
+        packet = (rx[0], bytes(rx[i:i + size]))
+        del rx[:i + size]
+        return packet
+
+    def send(self, data):
+        if not self.closed:
+            self.sock._deliver(data)
+
+    def close(self):
+        self.closed = True
+        self.sock._peer_closed()
+
+
+class SimBroker:
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.sessions = {}
+        self.connections = []
+        self.retained = {}
+        # Every PUBLISH received from the clients, in order
+        self.messages = []
+        # (topic filter, handler(broker, message)) called for matching publishes,
+        # e.g. a server answering EPO requests
+        self.handlers = []
+        # Refuse connections (broker or network down)
+        self.down = False
+        # Nothing gets through any more but no side notices (half open connections),
+        # new connections time out
+        self.silent = False
+        self._pid = 0
+
+    def published(self, topic=None):
+        """the messages received (on topics matching the filter)"""
+        return [m for m in self.messages if topic is None or topic_matches(topic, m.topic)]
+
+    def on(self, topic, handler):
+        self.handlers.append((topic, handler))
+
+    def connect(self, sock):
+        if self.down:
+            raise OSError(errno.ECONNREFUSED, 'broker down')
+        connection = Connection(self, sock)
+        self.connections.append(connection)
+        return connection
+
+    def drop_connections(self):
+        """the broker (or the network) drops every connection"""
+        for connection in list(self.connections):
+            connection.close()
+        self.connections = []
+
+    def publish(self, topic, payload, retain=False, qos=0):
+        '''
+        publishes from the server side to the subscribed clients. QoS 1 messages for
+        a persistent session that is not connected are queued until it connects
+        '''
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if retain:
+            self.retained[topic] = payload
+        for session in self.sessions.values():
+            granted = [q for pattern, q in session.subscriptions.items() if topic_matches(pattern, topic)]
+            if not granted:
+                continue
+            message = (topic, payload, min(qos, max(granted)))
+            connection = self._connection(session)
+            if connection is not None:
+                self._deliver(connection, message)
+            elif message[2] and not session.clean:
+                session.queue.append(message)
+
+    def _connection(self, session):
+        for connection in self.connections:
+            if connection.session is session and not connection.closed:
+                return connection
+        return None
+
+    def _deliver(self, connection, message):
+        topic, payload, qos = message
+        pid = 0
+        if qos:
+            self._pid = self._pid % 65535 + 1
+            pid = self._pid
+            connection.session.unacked[pid] = message
+        connection.send(publish_packet(topic, payload, qos=qos, pid=pid))
+
+    def _handle(self, connection, header, body):
+        kind = header & 0xF0
+        if kind == 0x10:
+            self._connect(connection, body)
+        elif kind == 0x30:
+            self._publish(connection, header, body)
+        elif kind == 0x40:
+            if connection.session is not None:
+                connection.session.unacked.pop(struct.unpack('!H', body[:2])[0], None)
+        elif kind == 0x60:
+            # PUBREL -> PUBCOMP
+            if connection.session is not None:
+                connection.session.qos2.discard(bytes(body[:2]))
+            connection.send(b'\x70\x02' + body[:2])
+        elif kind == 0x80:
+            self._subscribe(connection, body)
+        elif kind == 0xA0:
+            connection.send(b'\xb0\x02' + body[:2])
+        elif kind == 0xC0:
+            connection.send(b'\xd0\x00')
+        elif kind == 0xE0:
+            connection.close()
+            self.connections.remove(connection)
+
+    def _connect(self, connection, body):
+        flags = body[7]
+        offset = 10
+        size = struct.unpack_from('!H', body, offset)[0]
+        client_id = body[offset + 2:offset + 2 + size].decode()
+        clean = bool(flags & 0x02)
+        session = self.sessions.get(client_id)
+        present = session is not None and not clean and not session.clean
+        if session is None or clean:
+            session = Session(client_id)
+            self.sessions[client_id] = session
+        session.clean = clean
+        connection.session = session
+        connection.send(bytes([0x20, 0x02, 1 if present else 0, 0]))
+        if present:
+            pending = list(session.unacked.values()) + session.queue
+            session.unacked = {}
+            session.queue = []
+            for message in pending:
+                self._deliver(connection, message)
+
+    def _publish(self, connection, header, body):
+        qos = (header >> 1) & 0x03
+        size = struct.unpack_from('!H', body, 0)[0]
+        topic = body[2:2 + size].decode()
+        offset = 2 + size
+        pid = None
+        if qos:
+            pid = body[offset:offset + 2]
+            offset += 2
+        client = connection.session.client_id if connection.session else None
+        if qos == 2:
+            # Exactly once: a resent copy before the PUBREL is only acknowledged
+            if pid in connection.session.qos2:
+                connection.send(b'\x50\x02' + pid)
+                return
+            connection.session.qos2.add(pid)
+        message = Message(self.sim.clock.now, client, topic, body[offset:], qos, bool(header & 1),
+                          bool(header & 0x08))
+        self.messages.append(message)
+        if qos == 1:
+            connection.send(b'\x40\x02' + pid)
+        elif qos == 2:
+            connection.send(b'\x50\x02' + pid)
+        if message.retain:
+            self.retained[topic] = message.payload
+        for pattern, handler in self.handlers:
+            if topic_matches(pattern, topic):
+                handler(self, message)
+
+    def _subscribe(self, connection, body):
+        pid = body[:2]
+        offset = 2
+        granted = bytearray()
+        topics = []
+        while offset < len(body):
+            size = struct.unpack_from('!H', body, offset)[0]
+            topic = body[offset + 2:offset + 2 + size].decode()
+            qos = body[offset + 2 + size]
+            offset += 3 + size
+            connection.session.subscriptions[topic] = qos
+            granted.append(min(qos, 1))
+            topics.append(topic)
+        connection.send(bytes([0x90, 2 + len(granted)]) + pid + bytes(granted))
+        for retained, payload in self.retained.items():
+            for topic in topics:
+                if topic_matches(topic, retained):
+                    connection.send(publish_packet(retained, payload, retain=True))
+                    break
+
+
+class SimSocket:
+    """usocket.socket connected to the simulated broker"""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.net = sim.net
+        self.blocking = True
+        self.timeout = None
+        self.connection = None
+        # (time readable, bytes) from the broker
+        self._incoming = []
+        self._buffer = bytearray()
+        self._eof = False
+        self.tls = False
+        self.writes = 0
+        self.bytes_written = 0
+        # Non-blocking connect: simulated time it completes (None once it has), or the error it ended with
+        self.connecting = None
+        self.connect_error = None
+
+    def connect(self, addr):
+        if not self.sim.network_up():
+            raise OSError(errno.EHOSTUNREACH, 'no network')
+        if not self.blocking:
+            # Completes a round trip later, uselect.poll tells when (POLLOUT, or POLLERR if it failed)
+            self.connecting = float('inf') if self.sim.broker.silent else self.sim.clock.now + self.net.rtt
+            try:
+                self._connected()
+            except OSError as e:
+                self.connect_error = e
+            raise OSError(errno.EINPROGRESS, 'connecting')
+        # TCP handshake
+        if self.sim.broker.silent:
+            self._timed_out()
+        self.sim.net_busy(self.net.rtt)
+        self._connected()
+
+    def _connected(self):
+        self.connection = self.sim.broker.connect(self)
+        self.sim.stats['tcp_connects'] += 1
+        # SYN, SYN-ACK, ACK
+        self.sim.stats['wire_bytes'] += 3 * self.net.packet_overhead
+
+    def _connecting(self):
+        """true while a non-blocking connect has not completed yet"""
+        if self.connecting is not None and self.sim.clock.now >= self.connecting:
+            self.connecting = None
+        return self.connecting is not None
+
+    def poll_events(self, mask):
+        """uselect events of the socket among mask"""
+        from sim.fake.uselect import POLLIN, POLLOUT, POLLERR, POLLHUP
+        if self._connecting():
+            return 0
+        if self.connect_error is not None or self.connection is None or self.connection.closed:
+            return POLLERR | POLLHUP
+        self._pull()
+        events = POLLOUT & mask
+        if self._buffer or self._eof:
+            events |= POLLIN & mask
+        return events
+
+    def _timed_out(self):
+        # Listening for the whole timeout (a socket without one would block forever)
+        self.sim.net_busy(self.timeout or 0)
+        raise OSError(errno.ETIMEDOUT, 'timed out')
+
+    def _deliver(self, data):
+        self._incoming.append((self.sim.clock.now + self.net.rtt, bytes(data)))
+        self.sim.stats['wire_bytes'] += len(data) + self.net.packet_overhead
+
+    def _peer_closed(self):
+        self._incoming.append((self.sim.clock.now, None))
+
+    def _pull(self):
+        """moves the answers that arrived by now into the read buffer"""
+        now = self.sim.clock.now
+        while self._incoming and self._incoming[0][0] <= now:
+            data = self._incoming.pop(0)[1]
+            if data is None:
+                self._eof = True
+            else:
+                self._buffer += data
+
+    def _wait(self, size):
+        """blocks (advancing the clock) until size bytes, eof or nothing more to come"""
+        self._pull()
+        while len(self._buffer) < size and not self._eof and self._incoming:
+            self.sim.net_busy(self._incoming[0][0] - self.sim.clock.now)
+            self._pull()
+
+    def write(self, buf, size=None):
+        if self._connecting():
+            if not self.blocking:
+                raise OSError(errno.EAGAIN, 'connecting')
+            self.sim.net_busy(self.connecting - self.sim.clock.now)
+            self.connecting = None
+        if self.connection is None or self.connection.closed:
+            raise OSError(errno.ECONNRESET, 'connection closed')
+        if isinstance(buf, str):
+            # MicroPython streams take str as well (umqtt writes the topic that way)
+            buf = buf.encode()
+        data = bytes(buf if size is None else memoryview(buf)[:size])
+        self.writes += 1
+        self.bytes_written += len(data)
+        self.sim.stats['socket_writes'] += 1
+        self.sim.stats['socket_bytes'] += len(data)
+        self.sim.stats['wire_bytes'] += len(data) + self.net.packet_overhead
+        self.sim.net_busy(self.net.write_overhead + len(data) / self.net.bandwidth)
+        self.connection.received(data)
+        return len(data)
+
+    send = write
+
+    def sendall(self, buf):
+        self.write(buf)
+
+    def read(self, size=-1):
+        if self.blocking:
+            self._wait(size if size > 0 else 1)
+        else:
+            self._pull()
+        if not self._buffer:
+            if self._eof:
+                return b''
+            if not self.blocking:
+                return None
+            self._timed_out()
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.sim.stats['socket_reads'] += 1
+        return data
+
+    recv = read
+
+    def readinto(self, buf, size=None):
+        data = self.read(len(buf) if size is None else size)
+        if data is None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def setblocking(self, flag):
+        self.blocking = bool(flag)
+
+    def settimeout(self, value):
+        self.timeout = value
+        self.blocking = value is None or value > 0
+
+    def close(self):
+        if self.connection is not None and not self.connection.closed:
+            # FIN / ACK both ways
+            self.sim.stats['wire_bytes'] += 4 * self.net.packet_overhead
+            self.connection.closed = True
+            if self.connection in self.sim.broker.connections:
+                self.sim.broker.connections.remove(self.connection)
+        self.connection = None
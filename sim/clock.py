@@ -0,0 +1,70 @@
+# Simulated time for the host side simulator
+# Nothing in the simulation really sleeps: time.sleep, I2C transfers and network
+# round trips advance this clock, so a wake cycle of minutes runs in milliseconds
+# author: callen
+#
+
+import calendar
+
+# Wall clock the simulation starts at (UTC), only seen once the rtc is synced
+DEFAULT_START = calendar.timegm((2026, 6, 18, 14, 5, 0, 0, 0, 0))
+
+
+class SimClock:
+
+    def __init__(self, start=DEFAULT_START):
+        # Seconds since the simulation started
+        self.now = 0.0
+        self.start = start
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def advance_to(self, when):
+        if when > self.now:
+            self.now = when
+
+    def wall(self):
+        """simulated unix time"""
+        return self.start + self.now
+
+    def ticks_ms(self):
+        return int(self.now * 1000)
+
+    def ticks_us(self):
+        return int(self.now * 1000000)
+
+
+class Chrono:
+    """machine.Timer.Chrono on top of the simulated clock"""
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._started = None
+        self._elapsed = 0.0
+
+    def start(self):
+        if self._started is None:
+            self._started = self._clock.now
+
+    def stop(self):
+        if self._started is not None:
+            self._elapsed += self._clock.now - self._started
+            self._started = None
+
+    def reset(self):
+        self._elapsed = 0.0
+        if self._started is not None:
+            self._started = self._clock.now
+
+    def read(self):
+        if self._started is None:
+            return self._elapsed
+        return self._elapsed + self._clock.now - self._started
+
+    def read_ms(self):
+        return self.read() * 1000
+
+    def read_us(self):
+        return self.read() * 1000000
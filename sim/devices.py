@@ -0,0 +1,441 @@
+# I2C devices of the Pytrack board for the host side simulator
+# PicSim answers the pycoproc protocol (address 8), L76Sim replays a recorded
+# NMEA capture at the fix interval and answers PMTK commands and binary EPO
+# packets (address 0x10), LIS2HH12Sim synthesises acceleration registers from
+# motion windows (address 30)
+# author: callen
+#
+
+import random
+
+# Pycoproc commands and PIC memory addresses (lib/pycoproc.py)
+CMD_PEEK = 0x00
+CMD_POKE = 0x01
+CMD_MAGIC = 0x02
+CMD_HW_VER = 0x10
+CMD_FW_VER = 0x11
+CMD_PROD_ID = 0x12
+CMD_SETUP_SLEEP = 0x20
+CMD_GO_SLEEP = 0x21
+CMD_CALIBRATE = 0x22
+
+ADCON0_ADDR = 0x9D
+ADRESL_ADDR = 0x9B
+ADRESH_ADDR = 0x9C
+PORTC_ADDR = 0x0E
+ANSELC_ADDR = 0x18E
+IOCAP_ADDR = 0x391
+IOCAN_ADDR = 0x392
+WAKE_REASON_ADDR = 0x064C
+
+WAKE_REASON_ACCELEROMETER = 1
+WAKE_REASON_PUSH_BUTTON = 2
+WAKE_REASON_TIMER = 4
+WAKE_REASON_INT_PIN = 8
+
+
+class PicSim:
+    """the PIC co-processor of the Pytrack as driven by lib/pycoproc.py"""
+
+    ADDR = 8
+    HW_VERSION = 3
+    FW_VERSION = 12
+    PRODUCT_ID = 0xF014
+
+    def __init__(self, sim, battery=3.9):
+        self.sim = sim
+        self.memory = {}
+        self.battery = battery
+        self.sleep_time = 0
+        self.sleep_requested = False
+        # Answer of the last command, the first byte 0xFF tells pycoproc it is done
+        self._response = b'\xff'
+
+    def boot(self, reason, remaining=0):
+        self.sleep_requested = False
+        self.memory[WAKE_REASON_ADDR] = reason
+        for i in range(3):
+            self.memory[WAKE_REASON_ADDR + 1 + i] = (remaining >> (8 * i)) & 0xFF
+
+    def _peek(self, addr):
+        return self.memory.get(addr, 0)
+
+    def _store(self, addr, value):
+        value &= 0xFF
+        if addr == ADCON0_ADDR and value & 0x02:
+            # ADC conversion of the battery voltage is done at once
+            adc = int((self.battery - 0.01) * 180 * 1023 / (3.3 * 280))
+            self.memory[ADRESH_ADDR] = adc >> 2
+            self.memory[ADRESL_ADDR] = (adc & 0x03) << 6
+            value &= ~0x02
+        self.memory[addr] = value
+
+    def write(self, data):
+        cmd = data[0]
+        answer = b''
+        if cmd == CMD_PEEK:
+            answer = bytes([self._peek(data[1] | data[2] << 8)])
+        elif cmd == CMD_POKE:
+            self._store(data[1] | data[2] << 8, data[3])
+        elif cmd == CMD_MAGIC:
+            addr = data[1] | data[2] << 8
+            self._store(addr, ((self._peek(addr) & data[3]) | data[4]) ^ data[5])
+            answer = bytes([self._peek(addr)])
+        elif cmd in (CMD_HW_VER, CMD_FW_VER, CMD_PROD_ID):
+            value = {CMD_HW_VER: self.HW_VERSION, CMD_FW_VER: self.FW_VERSION, CMD_PROD_ID: self.PRODUCT_ID}[cmd]
+            answer = bytes([value & 0xFF, value >> 8])
+        elif cmd == CMD_SETUP_SLEEP:
+            self.sleep_time = data[1] | data[2] << 8 | data[3] << 16
+        elif cmd == CMD_GO_SLEEP:
+            self.sleep_requested = True
+        self._response = b'\xff' + answer
+
+    def read(self, size):
+        return (self._response + b'\xff' * size)[:size]
+
+    def gps_powered_in_sleep(self):
+        """go_to_sleep(gps=True) sets RC7, which cuts the power of the gps"""
+        return not self._peek(PORTC_ADDR) & 0x80
+
+    def accelerometer_powered_in_sleep(self):
+        """go_to_sleep leaves RC6 digital (accelerometer powered) only with the interrupt wakeup"""
+        return not self._peek(ANSELC_ADDR) & 0x40
+
+    def accelerometer_wakeup(self):
+        """interrupt on change of RA5 (accelerometer INT) and the accelerometer powered"""
+        return bool((self._peek(IOCAP_ADDR) | self._peek(IOCAN_ADDR)) & 0x20) and self.accelerometer_powered_in_sleep()
+
+
+def _checksum(body):
+    checksum = 0
+    for c in body:
+        checksum ^= c
+    return checksum
+
+
+def sentence(body):
+    """a complete NMEA sentence (bytes) for a body without $ and checksum"""
+    if isinstance(body, str):
+        body = body.encode()
+    return b'$' + body + b'*%02X\r\n' % _checksum(body)
+
+
+def load_capture(path):
+    """splits a recorded L76 capture into epochs (lists of sentences, starting with RMC)"""
+    epochs = []
+    with open(path, 'rb') as f:
+        for line in f.read().split(b'\r\n'):
+            line = line.strip()
+            if not line.startswith(b'$'):
+                continue
+            if line[3:6] == b'RMC' or not epochs:
+                epochs.append([])
+            epochs[-1].append(line + b'\r\n')
+    return epochs
+
+
+def _epoch_fixed(epoch):
+    for line in epoch:
+        if line[3:6] == b'RMC':
+            return line.split(b',')[2] == b'A'
+    return False
+
+
+# PMTK314 field order of the sentence rates
+_OUTPUT_TYPES = (b'GLL', b'RMC', b'VTG', b'GGA', b'GSA', b'GSV')
+_DEFAULT_OUTPUT = (1, 1, 1, 1, 1, 1)
+
+
+class L76Sim:
+    """
+    the quectel L76 on the Pytrack I2C bus. Replays the no fix epochs of a capture
+    until the time to first fix of the current start (hot, warm, cold or assisted)
+    has passed and the fixed epochs after that
+    """
+
+    ADDR = 0x10
+    RELEASE = 'AXN_5.1.6_3333_19020118,0027,Quectel-L76,1.0'
+    CHIP_VERSION = 'L76NNR02A01S,2019/02/18,12:00'
+    # Time to first fix (simulated seconds) per start
+    TTFF = {'hot': 2.0, 'warm': 28.0, 'cold': 45.0, 'assisted': 12.0}
+    # The L76 keeps about this much output when nobody reads it
+    BUFFER_SIZE = 4096
+    RESPONSE_DELAY = 0.05
+
+    def __init__(self, sim, capture, ttff=None, sky=True):
+        self.sim = sim
+        self.clock = sim.clock
+        epochs = load_capture(capture)
+        self.fix_epochs = [e for e in epochs if _epoch_fixed(e)]
+        self.nofix_epochs = [e for e in epochs if not _epoch_fixed(e)] or [[sentence('GNRMC,,V,,,,,,,,,,N')]]
+        self.ttff = dict(self.TTFF)
+        if ttff:
+            self.ttff.update(ttff)
+        # False simulates no view of the sky (garage), the gps never fixes
+        self.sky = sky
+        # EPO data lives in the flash of the L76 and survives power cycles
+        self.epo_sets = 0
+        self._epo_packets = 0
+        self.powered = False
+        self.starts = []
+        self.power_on()
+
+    def power_on(self):
+        self.powered = True
+        self.ephemeris = False
+        self.output = _DEFAULT_OUTPUT
+        self.interval = 1.0
+        self.binary = False
+        self.standby = False
+        self._rx = b''
+        self._restart('cold')
+
+    def power_off(self):
+        self.powered = False
+        self.queue = bytearray()
+
+    def _restart(self, kind):
+        now = self.clock.now
+        self.start_kind = kind
+        self.restart_at = now
+        self.fix_at = now + self.ttff[kind]
+        self.next_epoch = now + self.interval
+        self.epoch_count = 0
+        self._fix_index = 0
+        self._nofix_index = 0
+        self.queue = bytearray()
+        self._pending = []
+        self.starts.append((now, kind))
+
+    def fixed(self):
+        return self.powered and self.sky and self.clock.now >= self.fix_at
+
+    def _emit(self, data):
+        self.queue += data
+        if len(self.queue) > self.BUFFER_SIZE:
+            # Oldest output is lost, resync on the next sentence start
+            del self.queue[:len(self.queue) - self.BUFFER_SIZE]
+            start = self.queue.find(b'$')
+            del self.queue[:start if start >= 0 else len(self.queue)]
+
+    def _answer(self, body):
+        self._pending.append((self.clock.now + self.RESPONSE_DELAY, sentence(body)))
+
+    def _generate(self):
+        now = self.clock.now
+        for pending in list(self._pending):
+            if pending[0] <= now:
+                self._emit(pending[1])
+                self._pending.remove(pending)
+        if self.binary or self.standby:
+            return
+        behind = int((now - self.next_epoch) / self.interval)
+        if behind > 8:
+            # Only the last epochs fit in the output buffer anyway
+            self.next_epoch += (behind - 8) * self.interval
+            self.epoch_count += behind - 8
+        while self.next_epoch <= now:
+            fixed = self.sky and self.next_epoch >= self.fix_at and self.fix_epochs
+            if fixed:
+                epoch = self.fix_epochs[self._fix_index % len(self.fix_epochs)]
+                self._fix_index += 1
+                self.ephemeris = True
+            else:
+                epoch = self.nofix_epochs[self._nofix_index % len(self.nofix_epochs)]
+                self._nofix_index += 1
+            for line in epoch:
+                kind = line[3:6]
+                if kind in _OUTPUT_TYPES:
+                    rate = self.output[_OUTPUT_TYPES.index(kind)]
+                    if rate <= 0 or self.epoch_count % rate:
+                        continue
+                self._emit(line)
+            self.epoch_count += 1
+            self.next_epoch += self.interval
+
+    # I2C side
+
+    def read(self, size):
+        if not self.powered:
+            raise OSError(19, 'gps not powered')
+        self._generate()
+        data = bytes(self.queue[:size])
+        del self.queue[:size]
+        # The L76 pads reads with '\n' when it has nothing to send
+        return data + b'\n' * (size - len(data))
+
+    def write(self, data):
+        if not self.powered:
+            raise OSError(19, 'gps not powered')
+        # Any byte wakes the L76 from standby
+        self.standby = False
+        self._rx += bytes(data)
+        if self.binary:
+            self._binary_packets()
+        else:
+            self._nmea_commands()
+
+    def _nmea_commands(self):
+        while True:
+            end = self._rx.find(b'\r\n')
+            if end < 0:
+                break
+            line = self._rx[:end]
+            self._rx = self._rx[end + 2:]
+            start = line.find(b'$')
+            if start < 0 or line[-3:-2] != b'*':
+                continue
+            body = line[start + 1:-3]
+            if b'%02X' % _checksum(body) != line[-2:].upper():
+                continue
+            self._command(body.decode())
+        if self._rx.find(b'$') < 0:
+            self._rx = b''
+
+    def _ack(self, command, flag=3):
+        self._answer('PMTK001,{},{}'.format(command, flag))
+
+    def _command(self, body):
+        fields = body.split(',')
+        name = fields[0]
+        args = fields[1:]
+        if name == 'PMTK101':
+            self._restart('hot' if self.ephemeris else 'cold')
+        elif name == 'PMTK102':
+            self._restart('warm' if self.ephemeris else 'cold')
+        elif name in ('PMTK103', 'PMTK104'):
+            self.ephemeris = False
+            self._restart('cold')
+        elif name == 'PMTK161':
+            self.standby = True
+            self._ack(161)
+        elif name == 'PMTK225':
+            self._ack(225)
+        elif name == 'PMTK314':
+            if args and args[0] == '-1':
+                self.output = _DEFAULT_OUTPUT
+            else:
+                self.output = tuple(int(a) for a in args[:6])
+            self._ack(314)
+        elif name == 'PMTK220':
+            interval = int(args[0])
+            if 100 <= interval <= 10000:
+                self.interval = interval / 1000
+                self._ack(220)
+            else:
+                self._ack(220, 2)
+        elif name == 'PMTK605':
+            self._answer('PMTK705,' + self.RELEASE)
+        elif name == 'PQVERNO':
+            self._answer('PQVERNO,R,' + self.CHIP_VERSION)
+        elif name == 'PMTK183':
+            self._answer('PMTKLOG,0,1,b,127,60,0,0,0,0,0,0,0,0,0,100')
+        elif name in ('PMTK740', 'PMTK741'):
+            self._ack(name[4:])
+            if self.epo_sets and self.start_kind == 'cold' and not self.fixed():
+                # EPO orbits plus reference time / position, the fix comes much sooner
+                self.start_kind = 'assisted'
+                self.fix_at = min(self.fix_at, self.restart_at + self.ttff['assisted'])
+        elif name == 'PMTK253':
+            self.binary = args[:1] == ['1']
+            self._epo_packets = 0
+        elif name.startswith('PMTK'):
+            self._ack(name[4:], 1)
+
+    def _binary_packets(self):
+        while len(self._rx) >= 9:
+            start = self._rx.find(b'\x04\x24')
+            if start < 0:
+                self._rx = b''
+                return
+            rx = self._rx = self._rx[start:]
+            if len(rx) < 4:
+                return
+            size = rx[2] | rx[3] << 8
+            if len(rx) < size:
+                return
+            packet = rx[:size]
+            self._rx = rx[size:]
+            if size < 9 or _checksum(packet[2:size - 3]) != packet[size - 3]:
+                continue
+            command = packet[4] | packet[5] << 8
+            if command == 722:
+                seq = packet[6] | packet[7] << 8
+                if seq == 0xFFFF:
+                    self.epo_sets = self._epo_packets * 3 // 32
+                else:
+                    self._epo_packets += 1
+                ack = bytearray(b'\x04\x24\x0c\x00\x02\x00') + bytes([seq & 0xFF, seq >> 8, 1])
+                self._pending.append((self.clock.now + self.RESPONSE_DELAY / 10,
+                                      bytes(ack) + bytes([_checksum(ack[2:])]) + b'\r\n'))
+            elif command == 253:
+                self.binary = False
+
+
+# LIS2HH12 registers (lib/LIS2HH12.py)
+_WHO_AM_I = 0x0F
+_CTRL3 = 0x22
+_CTRL4 = 0x23
+_OUT_X_L = 0x28
+_OUT_Z_H = 0x2D
+_ACC_G_DIV = 1000 * 65536
+_SCALES = {0: 4000, 2: 8000, 3: 16000}
+
+
+class LIS2HH12Sim:
+    """accelerometer at rest (1 g on z) with small noise, shaken inside the motion windows"""
+
+    ADDR = 30
+
+    def __init__(self, sim, motion=(), noise=0.004, shake=0.5, seed=1):
+        self.sim = sim
+        self.power_off()
+        # (start, end) simulated seconds the bike is moving
+        self.motion = list(motion)
+        self.noise = noise
+        self.shake = shake
+        self._random = random.Random(seed)
+
+    def power_off(self):
+        self.registers = bytearray(0x40)
+        self.registers[_WHO_AM_I] = 0x41
+
+    def moving(self, when=None):
+        when = self.sim.clock.now if when is None else when
+        for start, end in self.motion:
+            if start <= when < end:
+                return True
+        return False
+
+    def next_motion(self, after, before):
+        """start of the first motion after `after` (or None if not before `before`)"""
+        for start, end in sorted(self.motion):
+            if end > after and start < before:
+                return max(start, after)
+        return None
+
+    def interrupt_enabled(self):
+        return bool(self.registers[_CTRL3] & 0x20)
+
+    def _axis(self, rest):
+        g = rest + self._random.gauss(0, self.noise)
+        if self.moving():
+            g += self._random.uniform(-self.shake, self.shake)
+        scale = _SCALES.get((self.registers[_CTRL4] >> 4) & 0x03, 4000)
+        raw = int(g * _ACC_G_DIV / scale)
+        return max(-32768, min(32767, raw))
+
+    def read_mem(self, register, size):
+        if _OUT_X_L <= register <= _OUT_Z_H:
+            values = bytearray()
+            for rest in (0.0, 0.0, 1.0):
+                raw = self._axis(rest) & 0xFFFF
+                values += bytes([raw & 0xFF, raw >> 8])
+            offset = register - _OUT_X_L
+            return bytes(values[offset:offset + size])
+        return bytes(self.registers[register:register + size])
+
+    def write_mem(self, register, data):
+        if isinstance(data, int):
+            data = bytes([data & 0xFF])
+        self.registers[register:register + len(data)] = data
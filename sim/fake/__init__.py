@@ -0,0 +1,5 @@
+# Stand ins for the MicroPython / Pycom firmware modules (machine, pycom,
+# network, utime, usocket, ussl, uasyncio, micropython). Simulator.install() puts them in
+# sys.modules under their firmware names, they all act on the current Simulator
+# author: callen
+#
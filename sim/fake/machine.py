@@ -0,0 +1,230 @@
+# machine module of the firmware: I2C to the simulated Pytrack devices, Pin,
+# Timer.Chrono, RTC, UART and the reset / sleep functions
+# An I2C transfer costs its bus time (9 bits per byte) on the simulated clock
+# author: callen
+#
+
+import calendar
+import random as _random
+import time as _time
+
+from sim.runtime import current, DeepSleep, SimReset
+from sim.clock import Chrono
+
+PWRON_RESET = 0
+HARD_RESET = 1
+WDT_RESET = 2
+DEEPSLEEP_RESET = 3
+SOFT_RESET = 4
+BROWN_OUT_RESET = 5
+
+PWRON_WAKE = 0
+PIN_WAKE = 1
+RTC_WAKE = 2
+ULP_WAKE = 3
+
+
+class I2C:
+    MASTER = 0
+    SLAVE = 1
+
+    def __init__(self, bus=0, mode=MASTER, pins=None, baudrate=100000):
+        self.init(mode, pins=pins, baudrate=baudrate)
+
+    def init(self, mode=MASTER, pins=None, baudrate=100000):
+        self.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def _device(self, addr, size):
+        sim = current()
+        device = sim.devices.get(addr)
+        # Address byte plus the data, 9 clocks each
+        sim.clock.advance((size + 1) * 9 / self.baudrate)
+        sim.stats['i2c_transfers'] += 1
+        sim.stats['i2c_bytes'] += size
+        if device is None:
+            raise OSError(19, 'I2C bus error')
+        return device
+
+    def scan(self):
+        return sorted(current().devices)
+
+    def writeto(self, addr, buf, stop=True):
+        self._device(addr, len(buf)).write(bytes(buf))
+        return len(buf)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return self._device(addr, nbytes).read(nbytes)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        data = self._device(addr, len(buf)).read(len(buf))
+        buf[:len(data)] = data
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        return self._device(addr, nbytes + 1).read_mem(memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        data = self._device(addr, len(buf) + 1).read_mem(memaddr, len(buf))
+        buf[:len(data)] = data
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        size = 1 if isinstance(buf, int) else len(buf)
+        self._device(addr, size + 1).write_mem(memaddr, buf)
+        return size
+
+
+class Pin:
+    IN = 1
+    OUT = 2
+    OPEN_DRAIN = 7
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+    IRQ_LOW_LEVEL = 4
+    IRQ_HIGH_LEVEL = 8
+
+    def __init__(self, id, mode=IN, pull=None, value=None, alt=-1):
+        self.id = id
+        self.mode = mode
+        self._value = value or 0
+        self._handler = None
+        sim = current()
+        if id == 'P3' and mode == Pin.OUT and value == 0 and sim.pic.sleep_requested:
+            # pycoproc kills the run pin, the PIC powers the GPy down
+            raise DeepSleep(sim.pic.sleep_time, gps=sim.pic.gps_powered_in_sleep(),
+                            accelerometer=sim.pic.accelerometer_wakeup() and sim.accel.interrupt_enabled())
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            if self.id == 'P13':
+                # LIS2HH12 activity interrupt
+                return 1 if current().accel.moving() else 0
+            return self._value
+        self._value = value
+
+    def callback(self, trigger=None, handler=None, arg=None):
+        self._handler = handler
+
+    def hold(self, hold=None):
+        pass
+
+
+class Timer:
+    class Chrono(Chrono):
+        def __init__(self):
+            Chrono.__init__(self, current().clock)
+
+    class Alarm:
+        def __init__(self, handler, s=None, ms=None, us=None, arg=None, periodic=False):
+            self.handler = handler
+
+        def cancel(self):
+            pass
+
+
+class RTC:
+    def __init__(self, id=0, datetime=None, source=None):
+        if datetime is not None:
+            self.init(datetime)
+
+    def init(self, datetime=None, source=None):
+        if datetime is not None:
+            current().set_rtc(_time_from_tuple(datetime))
+
+    def ntp_sync(self, server, update_period=3600, backup_server=None):
+        current().ntp_sync()
+
+    def synced(self):
+        return current().rtc_synced()
+
+    def memory(self, data=None):
+        """RTC slow memory, lost when the Pytrack powers the GPy off for a deep sleep"""
+        sim = current()
+        if data is None:
+            return sim.rtc_memory
+        if len(data) > sim.RTC_MEMORY_SIZE:
+            raise ValueError('buffer too long')
+        sim.rtc_memory = bytes(data)
+
+    def now(self):
+        sim = current()
+        when = sim.rtc_time()
+        t = _time.gmtime(int(when))
+        return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, int((when % 1) * 1000000), None)
+
+
+def _time_from_tuple(t):
+    return calendar.timegm(tuple(t[:6]) + (0, 0, 0))
+
+
+class UART:
+    def __init__(self, bus, baudrate=115200, **kwargs):
+        self.bus = bus
+
+    def write(self, buf):
+        return len(buf)
+
+    def read(self, nbytes=None):
+        return None
+
+    def any(self):
+        return 0
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        pass
+
+    def feed(self):
+        pass
+
+
+_rng = _random.Random(0)
+
+
+def rng():
+    """24 bit random number (the hardware random number generator)"""
+    return _rng.getrandbits(24)
+
+
+def idle():
+    current().clock.advance(0.001)
+
+
+def reset():
+    raise SimReset()
+
+
+def reset_cause():
+    return current().reset_cause
+
+
+def wake_reason():
+    return (current().gpy_wake_reason, None)
+
+
+def deepsleep(ms=0):
+    # The GPy sleeps on its own, the Pytrack keeps the gps powered
+    raise DeepSleep(ms / 1000, gps=True, accelerometer=False)
+
+
+def unique_id():
+    return b'\x24\x0a\xc4\x00\x00\x01'
+
+
+def freq(value=None):
+    return 160000000
+
+
+def main(path):
+    current().main_script = path
+
+
+def info():
+    pass
@@ -0,0 +1,15 @@
+# micropython module of the firmware
+# author: callen
+#
+
+
+def const(value):
+    return value
+
+
+def mem_info(verbose=False):
+    pass
+
+
+def opt_level(level=None):
+    return 0
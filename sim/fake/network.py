@@ -0,0 +1,164 @@
+# network module of the firmware: WLAN, LTE and Bluetooth on the simulated clock
+# Scans and connects take the time configured in Simulator.net, a WLAN connect
+# with a known bssid and channel skips the scan
+# author: callen
+#
+
+from collections import namedtuple
+
+from sim.runtime import current
+
+ScanResult = namedtuple('ScanResult', ('ssid', 'bssid', 'sec', 'channel', 'rssi'))
+
+
+class WLAN:
+    STA = 1
+    AP = 2
+    STA_AP = 3
+    WEP = 1
+    WPA = 2
+    WPA2 = 3
+    WPA2_ENT = 5
+    INT_ANT = 0
+    EXT_ANT = 1
+
+    def __init__(self, id=0, mode=STA, **kwargs):
+        self._mode = mode
+
+    def init(self, mode=STA, ssid=None, auth=None, channel=1, antenna=None, hidden=False, **kwargs):
+        self._mode = mode
+        if mode == WLAN.AP:
+            current().wifi.disconnect()
+
+    def deinit(self):
+        current().wifi.disconnect()
+
+    def mode(self, mode=None):
+        if mode is None:
+            return self._mode
+        self._mode = mode
+
+    def scan(self, ssid=None, bssid=None, channel=None, show_hidden=False, type=None, scantime=None):
+        wifi = current().wifi
+        wifi.scan(channel)
+        return [ScanResult(ap.ssid, ap.bssid, ap.sec, ap.channel, ap.rssi) for ap in wifi.access_points
+                if channel is None or ap.channel == channel]
+
+    def connect(self, ssid, auth=None, bssid=None, timeout=None, channel=None, **kwargs):
+        current().wifi.connect(ssid, auth, bssid=bssid, channel=channel, timeout=timeout)
+
+    def disconnect(self):
+        current().wifi.disconnect()
+
+    def isconnected(self):
+        return current().wifi.isconnected()
+
+    def ifconfig(self, id=0, config=None):
+        wifi = current().wifi
+        if config is None:
+            return wifi.ifconfig()
+        wifi.static = None if config == 'dhcp' else config
+
+    def bssid(self):
+        ap = current().wifi.ap
+        return ap.bssid if ap is not None else None
+
+    def channel(self, channel=None):
+        ap = current().wifi.ap
+        return ap.channel if ap is not None else None
+
+
+class LTE:
+    def __init__(self, **kwargs):
+        pass
+
+    def init(self, **kwargs):
+        pass
+
+    def deinit(self, detach=True, reset=False):
+        if detach:
+            current().lte.detach()
+        else:
+            current().lte.power_save()
+
+    def attach(self, band=None, apn=None, cid=None, type=None, legacyattach=None):
+        current().lte.attach(apn)
+
+    def isattached(self):
+        return current().lte.isattached()
+
+    def connect(self, cid=1):
+        current().lte.connect()
+
+    def isconnected(self):
+        return current().lte.isconnected()
+
+    def disconnect(self):
+        current().lte.disconnect()
+
+    def detach(self, reset=False):
+        current().lte.detach()
+
+    # Name used in main.py
+    dettach = detach
+
+    def send_at_cmd(self, cmd, delay=10000):
+        return current().lte.at(cmd)
+
+    def imei(self):
+        return '354347094000001'
+
+    def iccid(self):
+        return '8988280666000000001'
+
+
+class _Advertisement:
+    def __init__(self, mac, data, rssi=-60):
+        self.mac = mac
+        self.data = data
+        self.rssi = rssi
+        self.addr_type = 0
+        self.adv_type = 0
+
+
+class _BLEConnection:
+    def disconnect(self):
+        pass
+
+
+class Bluetooth:
+    ADV_NAME_CMPL = 0x09
+    ADV_NAME_SHORT = 0x08
+
+    def __init__(self, id=0, **kwargs):
+        self._scan_until = None
+        self._adverts = []
+
+    def init(self, **kwargs):
+        pass
+
+    def deinit(self):
+        self._scan_until = None
+
+    def start_scan(self, timeout):
+        sim = current()
+        self._scan_until = sim.clock.now + timeout if timeout >= 0 else float('inf')
+        self._adverts = [_Advertisement(mac, data) for mac, data in sim.ble_adverts]
+
+    def isscanning(self):
+        return self._scan_until is not None and current().clock.now < self._scan_until
+
+    def stop_scan(self):
+        self._scan_until = None
+
+    def get_adv(self):
+        if self._adverts and self.isscanning():
+            return self._adverts.pop(0)
+        return None
+
+    def resolve_adv_data(self, data, data_type):
+        return None
+
+    def connect(self, mac, timeout=None):
+        current().clock.advance(0.1)
+        return _BLEConnection()
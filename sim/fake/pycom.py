@@ -0,0 +1,69 @@
+# pycom module of the firmware, NVS survives wakeups within one Simulator
+# author: callen
+#
+
+from sim.runtime import current
+
+_MISSING = object()
+
+
+def nvs_set(key, value):
+    if len(key) > 15:
+        raise ValueError('NVS key too long')
+    if not isinstance(value, int):
+        raise TypeError('NVS holds 32 bit integers only')
+    # Stored as uint32, like the firmware does
+    current().nvs[key] = value & 0xFFFFFFFF
+    current().stats['nvs_writes'] += 1
+
+
+def nvs_get(key, default=_MISSING):
+    nvs = current().nvs
+    if key in nvs:
+        return nvs[key]
+    if default is _MISSING:
+        raise ValueError('No matching object for the provided key')
+    return default
+
+
+def nvs_erase(key):
+    nvs = current().nvs
+    if key not in nvs:
+        raise KeyError(key)
+    del nvs[key]
+
+
+def nvs_erase_all():
+    current().nvs.clear()
+
+
+def heartbeat(state=None):
+    sim = current()
+    if state is None:
+        return sim.heartbeat
+    sim.heartbeat = bool(state)
+
+
+def rgbled(color):
+    current().led = color
+
+
+def pulses_get(pin, timeout):
+    # The PIC calibration pulses are not simulated, pycoproc keeps a factor of 1
+    return []
+
+
+def heartbeat_on_boot(state=None):
+    return False
+
+
+def wifi_on_boot(state=None):
+    return True
+
+
+def lte_modem_en_on_boot(state=None):
+    return True
+
+
+def wdt_on_boot(state=None):
+    return False
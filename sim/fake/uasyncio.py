@@ -0,0 +1,63 @@
+# uasyncio of the firmware: CPython asyncio running on the simulated clock
+# The event loop reads its time from SimClock and, when every task is waiting,
+# advances the clock to the next timer instead of sleeping. Work a task does
+# (I2C transfers, socket writes) advances the clock as well, so concurrent
+# tasks overlap the way they would on the GPy
+# author: callen
+#
+
+import asyncio
+import selectors
+from asyncio import *  # noqa: F401,F403
+
+from sim.runtime import current
+
+
+class _SimSelector(selectors.SelectSelector):
+    """the loop's selector: nothing is ever ready, waiting moves the clock"""
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError('every task waits and no timer is pending, the simulation would hang')
+        current().clock.advance(timeout)
+        return []
+
+
+class SimEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self):
+        asyncio.SelectorEventLoop.__init__(self, _SimSelector())
+
+    def time(self):
+        return current().clock.now
+
+
+def new_event_loop():
+    return SimEventLoop()
+
+
+def run(coro):
+    loop = SimEventLoop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def get_event_loop():
+    try:
+        return asyncio.get_event_loop()
+    except RuntimeError:
+        loop = SimEventLoop()
+        asyncio.set_event_loop(loop)
+        return loop
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await asyncio.wait_for(aw, timeout / 1000)
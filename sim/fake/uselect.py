@@ -0,0 +1,57 @@
+# uselect module of the firmware, polls the simulated sockets
+# poll(timeout) waits on the simulated clock, in steps of POLL_STEP seconds
+# author: callen
+#
+
+from sim.runtime import current
+
+POLLIN = 0x0001
+POLLOUT = 0x0004
+POLLERR = 0x0008
+POLLHUP = 0x0010
+
+POLL_STEP = 0.01
+
+
+class _Poll:
+
+    def __init__(self):
+        self._registered = {}
+
+    def register(self, obj, eventmask=POLLIN | POLLOUT):
+        self._registered[obj] = eventmask
+
+    def modify(self, obj, eventmask):
+        if obj not in self._registered:
+            raise OSError(2, 'not registered')
+        self._registered[obj] = eventmask
+
+    def unregister(self, obj):
+        self._registered.pop(obj, None)
+
+    def _ready(self):
+        ready = []
+        for obj, mask in self._registered.items():
+            events = obj.poll_events(mask)
+            if events:
+                ready.append((obj, events))
+        return ready
+
+    def poll(self, timeout=-1):
+        """(object, events) of the objects ready, waits up to timeout ms (-1 forever)"""
+        clock = current().clock
+        deadline = None if timeout < 0 else clock.now + timeout / 1000
+        while True:
+            ready = self._ready()
+            if ready or (deadline is not None and clock.now >= deadline):
+                return ready
+            if deadline is None and not self._registered:
+                raise RuntimeError('polling nothing forever, the simulation would hang')
+            clock.advance(POLL_STEP if deadline is None else min(POLL_STEP, deadline - clock.now))
+
+    def ipoll(self, timeout=-1, flags=0):
+        return iter(self.poll(timeout))
+
+
+def poll():
+    return _Poll()
@@ -0,0 +1,22 @@
+# usocket module of the firmware, sockets connect to the simulated broker
+# author: callen
+#
+
+from sim.runtime import current
+from sim.broker import SimSocket
+
+AF_INET = 2
+SOCK_STREAM = 1
+SOCK_DGRAM = 2
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+SOL_SOCKET = 0xFFFF
+SO_REUSEADDR = 4
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    return [(AF_INET, SOCK_STREAM, IPPROTO_TCP, '', (current().resolve(host), port))]
+
+
+def socket(af=AF_INET, type=SOCK_STREAM, proto=IPPROTO_TCP):
+    return SimSocket(current())
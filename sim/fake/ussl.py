@@ -0,0 +1,48 @@
+# ussl module of the firmware, the handshake costs round trips and bytes on the simulated clock
+# A resumed handshake (saved_session from save_session, as the Pycom firmware
+# has it) is one round trip and a few hundred bytes instead of two and the
+# certificate chain. Sizes measured with bench/bench_tls_resume.py
+# author: callen
+#
+
+from sim.runtime import current
+
+CERT_NONE = 0
+CERT_OPTIONAL = 1
+CERT_REQUIRED = 2
+
+# Client and server bytes of a TLS 1.2 handshake (RSA 2048 certificate without
+# intermediates, a longer chain only adds to the full handshake)
+FULL_HANDSHAKE_BYTES = 1700
+FULL_HANDSHAKE_ROUND_TRIPS = 2
+RESUMED_HANDSHAKE_BYTES = 710
+RESUMED_HANDSHAKE_ROUND_TRIPS = 1
+
+
+class _Session:
+    """an established TLS session the broker still knows"""
+
+    def __init__(self, number):
+        self.number = number
+
+
+def wrap_socket(sock, keyfile=None, certfile=None, server_side=False, cert_reqs=CERT_NONE, ca_certs=None,
+                server_hostname=None, saved_session=None, **kwargs):
+    sim = current()
+    if isinstance(saved_session, _Session):
+        trips, size = RESUMED_HANDSHAKE_ROUND_TRIPS, RESUMED_HANDSHAKE_BYTES
+        sim.stats['tls_resumed'] += 1
+        sock.tls_session = saved_session
+    else:
+        trips, size = FULL_HANDSHAKE_ROUND_TRIPS, FULL_HANDSHAKE_BYTES
+        sim.stats['tls_handshakes'] += 1
+        sock.tls_session = _Session(sim.stats['tls_handshakes'])
+    sim.net_busy(trips * sim.net.rtt + size / sim.net.bandwidth)
+    # A segment per flight each way
+    sim.stats['wire_bytes'] += size + 2 * trips * sim.net.packet_overhead
+    sock.tls = True
+    return sock
+
+
+def save_session(sock):
+    return sock.tls_session
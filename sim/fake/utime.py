@@ -0,0 +1,64 @@
+# utime (and time) module of the firmware on the simulated clock
+# time() counts from 1970 since boot until the rtc is synced, like the GPy
+# author: callen
+#
+
+import calendar
+import time as _time
+
+from sim.runtime import current
+
+
+def time():
+    return int(current().rtc_time())
+
+
+def sleep(seconds):
+    current().clock.advance(seconds)
+
+
+def sleep_ms(ms):
+    current().clock.advance(ms / 1000)
+
+
+def sleep_us(us):
+    current().clock.advance(us / 1000000)
+
+
+def ticks_ms():
+    return int(current().uptime() * 1000)
+
+
+def ticks_us():
+    return int(current().uptime() * 1000000)
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_diff(new, old):
+    return new - old
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def gmtime(secs=None):
+    if secs is None:
+        secs = time()
+    t = _time.gmtime(secs)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+
+localtime = gmtime
+
+
+def mktime(t):
+    return calendar.timegm(tuple(t[:6]) + (0, 0, 0))
+
+
+def __getattr__(name):
+    # Anything the firmware doesnt have (perf_counter, ...) comes from CPython
+    return getattr(_time, name)
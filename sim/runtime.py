@@ -0,0 +1,645 @@
+# Simulator: the state of one simulated tracker (clock, NVS, flash, Pytrack
+# devices, wifi / lte / broker) and the wake cycle loop
+# Every wake runs main.py from a fresh import of the project modules (deep
+# sleep is a reboot on the GPy). Going to sleep raises DeepSleep out of the
+# script, the clock then jumps to the timer or accelerometer wakeup
+# author: callen
+#
+
+import ast
+import atexit
+import builtins
+import collections
+import errno
+import importlib.machinery
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import types
+
+from sim.clock import SimClock, DEFAULT_START
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CAPTURE = os.path.join(ROOT, 'bench', 'captures', 'l76_ride.nmea')
+
+_current = None
+
+
+def current():
+    if _current is None:
+        raise RuntimeError('No simulator installed, call Simulator.install() first')
+    return _current
+
+
+class DeepSleep(BaseException):
+    """the script put the board to sleep. BaseException so `except Exception` in main.py doesnt stop it"""
+
+    def __init__(self, seconds, gps=False, accelerometer=False):
+        BaseException.__init__(self, seconds)
+        self.seconds = seconds
+        self.gps = gps
+        self.accelerometer = accelerometer
+
+
+class SimReset(BaseException):
+    """machine.reset()"""
+
+
+class NetModel:
+    '''
+    link and service timings (simulated seconds). stats['wire_bytes'] adds the
+    IPv4 + TCP headers (packet_overhead) to every segment, the TCP handshake and
+    close, and a DNS query and answer (dns_bytes)
+    '''
+
+    def __init__(self, rtt=0.08, bandwidth=250000, write_overhead=0.0005, dns_time=0.12, ntp_time=0.3,
+                 packet_overhead=40, dns_bytes=150):
+        self.rtt = rtt
+        self.bandwidth = bandwidth
+        self.write_overhead = write_overhead
+        self.dns_time = dns_time
+        self.ntp_time = ntp_time
+        self.packet_overhead = packet_overhead
+        self.dns_bytes = dns_bytes
+
+
+class AccessPoint:
+    def __init__(self, ssid, password, bssid=b'\x50\xc7\xbf\x00\x00\x01', sec=3, channel=6, rssi=-58):
+        self.ssid = ssid
+        self.password = password
+        self.bssid = bssid
+        self.sec = sec
+        self.channel = channel
+        self.rssi = rssi
+
+
+class WifiModel:
+    """station side of the wifi: scans, association, dhcp"""
+
+    def __init__(self, sim, access_points=(), scan_time=2.2, channel_scan_time=0.15, associate_time=0.6,
+                 dhcp_time=1.2):
+        self.sim = sim
+        self.access_points = list(access_points)
+        self.scan_time = scan_time
+        self.channel_scan_time = channel_scan_time
+        self.associate_time = associate_time
+        self.dhcp_time = dhcp_time
+        self.scans = 0
+        self.connects = []
+        self.reset()
+
+    def reset(self):
+        self.ap = None
+        self.connected_at = None
+        self.static = None
+
+    def scan(self, channel=None):
+        self.scans += 1
+        self.sim.clock.advance(self.channel_scan_time if channel is not None else self.scan_time)
+
+    def connect(self, ssid, auth, bssid=None, channel=None, timeout=None):
+        self.connects.append((self.sim.clock.now, ssid, bssid, channel))
+        password = auth[1] if isinstance(auth, (tuple, list)) and len(auth) > 1 else None
+        self.ap = None
+        self.connected_at = None
+        for ap in self.access_points:
+            if ap.ssid == ssid and (bssid is None or ap.bssid == bssid) and ap.password == password:
+                self.ap = ap
+        if self.ap is None:
+            return
+        # Without a known bssid and channel the station scans first
+        delay = self.associate_time
+        delay += self.channel_scan_time if bssid is not None and channel is not None else self.scan_time
+        delay += 0 if self.static else self.dhcp_time
+        self.connected_at = self.sim.clock.now + delay
+
+    def disconnect(self):
+        self.ap = None
+        self.connected_at = None
+
+    def isconnected(self):
+        return self.connected_at is not None and self.sim.clock.now >= self.connected_at
+
+    def ifconfig(self):
+        if self.static:
+            return tuple(self.static)
+        if self.isconnected():
+            return ('192.168.0.185', '255.255.255.0', '192.168.0.1', '192.168.0.1')
+        return ('0.0.0.0', '0.0.0.0', '0.0.0.0', '0.0.0.0')
+
+
+# Units (seconds) of the 3GPP timers set by AT+CPSMS, by the 3 high bits
+_T3412_UNITS = {0: 600, 1: 3600, 2: 36000, 3: 2, 4: 30, 5: 60, 6: 1152000}
+_T3324_UNITS = {0: 2, 1: 60, 2: 360}
+_OK = '\r\nOK\r\n'
+
+
+def gprs_timer(bits, units=_T3412_UNITS):
+    """seconds of a timer as AT+CPSMS gives it ('00100100'), None if deactivated"""
+    value = int(bits, 2)
+    unit = units.get(value >> 5)
+    return None if unit is None else unit * (value & 0x1F)
+
+
+class LteModel:
+    '''
+    the Sequans modem, scripted: the AT commands the tracker sends, attach and connect. The configuration
+    (APN, scan bands, PSM, eDRX) is saved in the modem and kept through reboots. A modem that went to PSM
+    keeps its registration on the network until the periodic TAU timer runs out, the next attach resumes it.
+    Without the bands of the network configured the attach scans all of them. attaches keeps
+    (start, seconds, kind) of every attach, kind 'resume', 'attach', 'scan' or 'rejected' (wrong APN)
+    '''
+
+    def __init__(self, sim, attach_time=12.0, scan_all_time=30.0, resume_time=1.5, connect_time=1.5,
+                 reset_time=4.0, bands=(26, 18), apn='soracom.io'):
+        self.sim = sim
+        self.attach_time = attach_time
+        self.scan_all_time = scan_all_time
+        self.resume_time = resume_time
+        self.connect_time = connect_time
+        self.reset_time = reset_time
+        self.network_bands = set(bands)
+        self.network_apn = apn
+        # Saved in the modem
+        self.apn = None
+        self.auth = None
+        self.bands = []
+        self.psm = None
+        self.edrx = None
+        # The network keeps the registration until then (PSM)
+        self.registered_until = None
+        self.commands = []
+        self.attaches = []
+        self.busy_until = 0
+        self.reset()
+
+    def reset(self):
+        """the modem boots with the GPy"""
+        self.cfun = 1
+        self.attached_at = None
+        self.connected_at = None
+
+    def attach(self, apn=None):
+        if self.attached_at is not None:
+            return
+        if apn is not None:
+            self.apn = apn
+        self.cfun = 1
+        now = self.sim.clock.now
+        if self.apn != self.network_apn:
+            delay, kind = float('inf'), 'rejected'
+        elif self.registered_until is not None and now < self.registered_until:
+            delay, kind = self.resume_time, 'resume'
+        elif self.network_bands & set(self.bands):
+            delay, kind = self.attach_time, 'attach'
+        else:
+            delay, kind = self.scan_all_time, 'scan'
+        self.registered_until = None
+        self.attached_at = now + delay
+        self.attaches.append((now, delay, kind))
+
+    def isattached(self):
+        return self.attached_at is not None and self.sim.clock.now >= self.attached_at
+
+    def connect(self):
+        if not self.isattached():
+            raise OSError(errno.EIO, 'not attached')
+        self.connected_at = self.sim.clock.now + self.connect_time
+
+    def isconnected(self):
+        return self.connected_at is not None and self.sim.clock.now >= self.connected_at
+
+    def disconnect(self):
+        self.connected_at = None
+
+    def detach(self):
+        self.connected_at = None
+        self.attached_at = None
+        self.registered_until = None
+
+    def power_save(self):
+        """deinit without detaching: registered, the modem keeps it in PSM"""
+        if self.psm is not None and self.isattached():
+            tau = gprs_timer(self.psm[0])
+            if tau:
+                self.registered_until = self.sim.clock.now + tau
+        self.connected_at = None
+        self.attached_at = None
+
+    def _registration(self):
+        if self.isattached():
+            return 1
+        return 2 if self.attached_at is not None else 0
+
+    def at(self, cmd):
+        self.commands.append(cmd)
+        self.sim.clock.advance(0.05)
+        if self.sim.clock.now < self.busy_until:
+            # Still rebooting
+            return ''
+        if cmd == 'AT^RESET':
+            self.reset()
+            self.registered_until = None
+            self.busy_until = self.sim.clock.now + self.reset_time
+        elif cmd.startswith('AT+CFUN='):
+            self.cfun = int(cmd[8:].split(',')[0])
+            if self.cfun != 1:
+                self.attached_at = None
+                self.connected_at = None
+        elif cmd == 'AT+CFUN?':
+            return '\r\n+CFUN: {}\r\n'.format(self.cfun) + _OK
+        elif cmd == 'AT!="clearscanconfig"':
+            self.bands = []
+        elif cmd.startswith('AT!="RRC::addScanBand band='):
+            self.bands.append(int(cmd[len('AT!="RRC::addScanBand band='):-1]))
+        elif cmd.startswith('AT+CGDCONT='):
+            self.apn = cmd.split(',')[2].strip('"')
+        elif cmd == 'AT+CGDCONT?':
+            return '\r\n+CGDCONT: 1,"IP","{}",,0,0\r\n'.format(self.apn or '') + _OK
+        elif cmd.startswith('AT+CGAUTH='):
+            self.auth = cmd[10:]
+        elif cmd.startswith('AT+CPSMS='):
+            fields = cmd[9:].split(',')
+            self.psm = (fields[3].strip('"'), fields[4].strip('"')) if fields[0] == '1' else None
+        elif cmd == 'AT+CPSMS?':
+            if self.psm is None:
+                return '\r\n+CPSMS: 0\r\n' + _OK
+            return '\r\n+CPSMS: 1,,,"{}","{}"\r\n'.format(*self.psm) + _OK
+        elif cmd.startswith('AT+CEDRXS='):
+            fields = cmd[10:].split(',')
+            self.edrx = fields[2].strip('"') if fields[0] != '0' and len(fields) > 2 else None
+        elif cmd == 'AT+CEREG?':
+            return '\r\n+CEREG: 0,{}\r\n'.format(self._registration()) + _OK
+        return _OK
+
+
+class WakeRecord:
+    """what happened in one wake cycle"""
+
+    def __init__(self, number, reason, start):
+        self.number = number
+        self.reason = reason
+        self.start = start
+        self.awake = 0.0
+        self.sleep = None
+        self.gps_powered = None
+        self.accelerometer = None
+        self.reset = False
+        self.error = None
+        self.published = []
+        self.stats = None
+        # NVS when the wake ended
+        self.nvs = None
+
+    def __repr__(self):
+        return 'WakeRecord({}, reason={}, awake={:.1f}s, sleep={})'.format(
+            self.number, self.reason, self.awake, self.sleep)
+
+
+def module_consts(source):
+    '''
+    The names a module assigns with const(). The MicroPython compiler substitutes
+    them everywhere in the module, even when assigned in a class body (the
+    drivers use GPS_I2CADDR, CMD_FW_VER, ... as globals), CPython doesnt
+    '''
+    consts = {}
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) \
+                and isinstance(node.value, ast.Call) and getattr(node.value.func, 'id', None) == 'const' \
+                and len(node.value.args) == 1:
+            arg = node.value.args[0]
+            try:
+                consts[node.targets[0].id] = ast.literal_eval(arg)
+            except ValueError:
+                if isinstance(arg, ast.Name) and arg.id in consts:
+                    consts[node.targets[0].id] = consts[arg.id]
+    return consts
+
+
+# {path: (mtime, consts)}, every wake imports the project modules again
+_consts_cache = {}
+
+
+class _ConstLoader(importlib.machinery.SourceFileLoader):
+    def _consts(self, module):
+        mtime = os.path.getmtime(self.path)
+        cached = _consts_cache.get(self.path)
+        if cached is None or cached[0] != mtime:
+            cached = _consts_cache[self.path] = (mtime, module_consts(self.get_source(module.__name__)))
+        return cached[1]
+
+    def exec_module(self, module):
+        for name, value in self._consts(module).items():
+            module.__dict__.setdefault(name, value)
+        importlib.machinery.SourceFileLoader.exec_module(self, module)
+        if module.__name__ == 'config' and _current is not None:
+            _current.configure(module)
+
+
+class _ProjectFinder:
+    """loads the project modules (not the simulator) with MicroPython const semantics"""
+
+    def __init__(self, root):
+        self.root = root + os.sep
+        self.sim = os.path.join(root, 'sim') + os.sep
+
+    def find_spec(self, name, path=None, target=None):
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+        if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+            return spec
+        if spec.origin.startswith(self.root) and not spec.origin.startswith(self.sim):
+            spec.loader = _ConstLoader(spec.name, spec.origin)
+        return spec
+
+
+# Firmware module names, the stand ins live in sim/fake
+_FAKE_MODULES = ('machine', 'pycom', 'network', 'utime', 'usocket', 'ussl', 'uselect', 'micropython', 'uasyncio')
+_ALIASES = {'ubinascii': 'binascii', 'ujson': 'json', 'ustruct': 'struct', 'uos': 'os', 'uerrno': 'errno',
+            'ucollections': 'collections'}
+
+
+class FlashFS:
+    """/flash of the GPy: paths under it go to a host directory (a temporary one by default)"""
+
+    PREFIX = '/flash'
+    _OS_FUNCTIONS = ('remove', 'rename', 'stat', 'listdir', 'mkdir', 'rmdir')
+
+    def __init__(self, directory=None):
+        self.temporary = directory is None
+        self.directory = tempfile.mkdtemp(prefix='simflash') if directory is None else directory
+        self._saved = None
+        if self.temporary:
+            # Kept between install / uninstall, like the flash between wakes
+            atexit.register(shutil.rmtree, self.directory, True)
+
+    def path(self, path):
+        if isinstance(path, str) and (path == self.PREFIX or path.startswith(self.PREFIX + '/')):
+            return os.path.join(self.directory, path[len(self.PREFIX):].lstrip('/'))
+        return path
+
+    def _wrap(self, function, paths=1):
+        def mapped(*args, **kwargs):
+            args = [self.path(a) if i < paths else a for i, a in enumerate(args)]
+            return function(*args, **kwargs)
+        return mapped
+
+    def mount(self):
+        if self._saved is not None:
+            return
+        self._saved = {'open': builtins.open}
+        builtins.open = self._wrap(builtins.open)
+        for name in self._OS_FUNCTIONS:
+            self._saved[name] = getattr(os, name)
+            setattr(os, name, self._wrap(self._saved[name], paths=2 if name == 'rename' else 1))
+
+    def unmount(self):
+        if self._saved is None:
+            return
+        builtins.open = self._saved.pop('open')
+        for name, function in self._saved.items():
+            setattr(os, name, function)
+        self._saved = None
+
+
+
+class Simulator:
+
+    RTC_MEMORY_SIZE = 2048
+
+    def __init__(self, capture=DEFAULT_CAPTURE, start=DEFAULT_START, root=ROOT, motion=(), sky=True,
+                 ttff=None, net=None, access_points=None, flash=None, config=None, debug=False):
+        from sim.devices import PicSim, L76Sim, LIS2HH12Sim
+        from sim.broker import SimBroker
+
+        self.root = root
+        self.debug = debug
+        self.clock = SimClock(start)
+        self.nvs = {}
+        self.rtc_memory = b''
+        self.flash = FlashFS(flash)
+        # {'ConfigMqtt.LOCATION_FORMATS': ..., ...} set on config.py every time it is imported
+        self.config = dict(config or {})
+        self.stats = collections.Counter()
+        self.net = net or NetModel()
+        self.pic = PicSim(self)
+        self.gps = L76Sim(self, capture, ttff=ttff, sky=sky)
+        self.accel = LIS2HH12Sim(self, motion=motion)
+        self.devices = {PicSim.ADDR: self.pic, L76Sim.ADDR: self.gps, LIS2HH12Sim.ADDR: self.accel}
+        self.broker = SimBroker(self)
+        if access_points is None:
+            access_points = [AccessPoint('Nuthouse', 'simulated')]
+        self.wifi = WifiModel(self, access_points)
+        self.lte = LteModel(self)
+        self.ble_adverts = []
+        self.hosts = {}
+        self.heartbeat = True
+        self.led = 0
+        self.main_script = None
+        self.wakes = []
+        self.reset_cause = 0
+        self.gpy_wake_reason = 0
+        self._saved_modules = None
+        self._finder = None
+        self._boot_at = 0.0
+        self._rtc_offset = 0.0
+        self._rtc_synced_at = None
+
+    # clock / rtc
+
+    def uptime(self):
+        return self.clock.now - self._boot_at
+
+    def rtc_time(self):
+        """seconds the rtc reads: since 1970 at boot, unix time once synced"""
+        return self.clock.now + self._rtc_offset
+
+    def rtc_synced(self):
+        return self._rtc_synced_at is not None and self.clock.now >= self._rtc_synced_at
+
+    def set_rtc(self, when):
+        self._rtc_offset = when - self.clock.now
+
+    def ntp_sync(self):
+        if self._rtc_synced_at is None and self.network_up():
+            self._rtc_synced_at = self.clock.now + self.net.ntp_time
+            self._rtc_offset = self.clock.start
+
+    def configure(self, module):
+        for name, value in self.config.items():
+            cls, attr = name.split('.')
+            setattr(getattr(module, cls), attr, value)
+
+    # network
+
+    def net_busy(self, seconds):
+        """time the radio is busy with the network (round trips, transfers), counted in stats['radio_seconds']"""
+        if seconds > 0:
+            self.clock.advance(seconds)
+            self.stats['radio_seconds'] += seconds
+
+    def network_up(self):
+        return self.wifi.isconnected() or self.lte.isconnected()
+
+    def resolve(self, host):
+        if not self.network_up():
+            raise OSError(errno.EHOSTUNREACH, 'no network')
+        self.net_busy(self.net.dns_time)
+        self.stats['dns_lookups'] += 1
+        self.stats['wire_bytes'] += self.net.dns_bytes
+        return self.hosts.get(host, '10.0.0.2')
+
+    # install / boot
+
+    def install(self):
+        """puts the firmware stand ins in sys.modules and makes this the current simulator"""
+        global _current
+        import importlib
+        _current = self
+        if self._saved_modules is None:
+            self._saved_modules = {}
+            for name in _FAKE_MODULES + tuple(_ALIASES) + ('time', 'config_auth'):
+                self._saved_modules[name] = sys.modules.get(name)
+        for name in _FAKE_MODULES:
+            sys.modules[name] = importlib.import_module('sim.fake.' + name)
+        for name, module in _ALIASES.items():
+            sys.modules[name] = importlib.import_module(module)
+        sys.modules['time'] = sys.modules['utime']
+        builtins.const = lambda value: value
+        self.flash.mount()
+        # os.dupterm of boot.py
+        if not hasattr(os, 'dupterm'):
+            os.dupterm = lambda stream, index=0: None
+        if not os.path.exists(os.path.join(self.root, 'config_auth.py')):
+            sys.modules['config_auth'] = self._config_auth()
+        for path in (os.path.join(self.root, 'lib'), self.root):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+        if self._finder is None:
+            self._finder = _ProjectFinder(self.root)
+            sys.meta_path.insert(0, self._finder)
+        return self
+
+    def uninstall(self):
+        global _current
+        if self._saved_modules is not None:
+            for name, module in self._saved_modules.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+            self._saved_modules = None
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+        self._forget_project_modules()
+        self.flash.unmount()
+        _current = None
+
+    def _config_auth(self):
+        """credentials of the simulated wifi and broker (config_auth.py is not in the repo)"""
+        module = types.ModuleType('config_auth')
+        ap = self.wifi.access_points[0] if self.wifi.access_points else None
+        module.NETWORK_1_PASS = 'simulated'
+        module.NETWORK_2_PASS = ap.password if ap is not None else 'simulated'
+        module.MQTT_SERVER = 'broker.sim'
+        module.MQTT_USER = 'tracker'
+        module.MQTT_PASSWORD = 'simulated'
+        module.BLUETOOTH_MAC_ADDR = b'000000000000'
+        return module
+
+    def _forget_project_modules(self):
+        """a reboot imports the project modules again"""
+        sim_dir = os.path.join(self.root, 'sim') + os.sep
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None) or ''
+            if not path and getattr(module, '__path__', None):
+                # Namespace package (lib), `from lib import x` would get x from it
+                path = os.path.join(list(module.__path__)[0], '')
+            if path.startswith(self.root + os.sep) and not path.startswith(sim_dir) and name != 'config_auth':
+                del sys.modules[name]
+
+    def _boot(self):
+        self._forget_project_modules()
+        self._boot_at = self.clock.now
+        self._rtc_offset = -self.clock.now
+        self._rtc_synced_at = None
+        # The Pytrack cut the power of the GPy
+        self.rtc_memory = b''
+        self.wifi.reset()
+        self.lte.reset()
+        self.broker.drop_connections()
+        self.main_script = None
+        # pycoproc powers the gps at boot
+        if not self.gps.powered:
+            self.gps.power_on()
+
+    def wake(self, script='main.py', boot_script='boot.py'):
+        """runs one wake cycle (boot.py optional, then the script) until it sleeps, resets or ends"""
+        if _current is not self:
+            self.install()
+        record = WakeRecord(len(self.wakes) + 1, self.pic.memory.get(0x064C, 0), self.clock.now)
+        published = len(self.broker.messages)
+        stats = self.stats.copy()
+        self._boot()
+        try:
+            if boot_script is not None:
+                runpy.run_path(os.path.join(self.root, boot_script), run_name='__main__')
+            runpy.run_path(os.path.join(self.root, script), run_name='__main__')
+        except DeepSleep as sleep:
+            record.sleep = sleep.seconds
+            record.gps_powered = sleep.gps
+            record.accelerometer = sleep.accelerometer
+        except SimReset:
+            record.reset = True
+        except Exception as e:
+            record.error = e
+        record.awake = self.clock.now - record.start
+        record.published = self.broker.messages[published:]
+        record.stats = self.stats - stats
+        record.nvs = dict(self.nvs)
+        self.wakes.append(record)
+        return record
+
+    def sleep(self, record):
+        """jumps the clock over the sleep of a wake record and prepares the wakeup reason"""
+        from sim.devices import WAKE_REASON_ACCELEROMETER, WAKE_REASON_TIMER
+        if not record.gps_powered:
+            self.gps.power_off()
+        if not self.pic.accelerometer_powered_in_sleep():
+            self.accel.power_off()
+        self.stats['gps_powered_sleep'] += record.sleep if record.gps_powered else 0
+        start = self.clock.now
+        end = start + (record.sleep or 0)
+        wake = None
+        if record.accelerometer:
+            wake = self.accel.next_motion(start, end)
+        if wake is not None:
+            self.clock.advance_to(wake)
+            self.pic.boot(WAKE_REASON_ACCELEROMETER, int(end - wake))
+        else:
+            self.clock.advance_to(end)
+            self.pic.boot(WAKE_REASON_TIMER)
+        self.reset_cause = 3
+        self.gpy_wake_reason = 1
+
+    def run(self, wakes=10, script='main.py', boot_script='boot.py', until=None):
+        """wake cycles until `wakes` have run, the clock passed `until` (seconds) or the script stops without sleeping"""
+        self.install()
+        try:
+            for _ in range(wakes):
+                if until is not None and self.clock.now >= until:
+                    break
+                record = self.wake(script, boot_script)
+                if self.debug:
+                    print(record)
+                if record.sleep is None:
+                    if not record.reset:
+                        break
+                    self.reset_cause = 1
+                    continue
+                self.sleep(record)
+        finally:
+            self.uninstall()
+        return self.wakes
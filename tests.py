@@ -43,16 +43,16 @@ def testGPSLib2():
     L76 = L76GNSS(pytrack=py)
     L76.setAlwaysOn()
 
-    print("gsv - info about sattelites in view at this moment: ")
-    # returns the info about sattelites in view at this moment
+    print("gsv - number of sattelites in view at this moment: ")
+    # returns the info about sattelites in view at this moment (a Fix record)
     # even without the gps being fixed
-    print(L76.gps_message('GSV',debug=True))
+    print(L76.gps_message('GSV',debug=True).satellites)
     input("Press enter to continue")
 
     print("gga - number of sattelites in view at this moment: ")
     # returns the number of sattelites in view at this moment
     # even without the gps being fixed
-    print(L76.gps_message('GGA',debug=True)['NumberOfSV'])
+    print(L76.gps_message('GGA',debug=True).satellites)
     input("Press enter to continue")
 
     print("Attempting to get gps fix... This may take some time...")
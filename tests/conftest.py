@@ -0,0 +1,35 @@
+# Host side tests of the tracker code (pytest). The pure modules (nmea,
+# timeutil, location) are imported from lib as they are, the ones that need the
+# firmware run on the simulator (sim package), see the sim fixture.
+# tests.py at the root is the on device test script boot.py runs, not these
+# author: callen
+#
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(ROOT, 'lib'), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def sim():
+    """a simulator installed (firmware modules, NVS and /flash) for the test"""
+    from sim import Simulator
+    simulator = Simulator().install()
+    yield simulator
+    simulator.uninstall()
+
+
+@pytest.fixture
+def online(sim):
+    """the simulator with the wifi connected, for tests that talk to its broker"""
+    from network import WLAN
+    ap = sim.wifi.access_points[0]
+    WLAN().connect(ap.ssid, auth=(WLAN.WPA2, ap.password))
+    sim.clock.advance_to(sim.wifi.connected_at)
+    return sim
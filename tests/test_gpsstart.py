@@ -0,0 +1,78 @@
+# lib/gpsstart.py: start strategy selection and the ttff statistics, on the
+# simulator's NVS
+# author: callen
+#
+
+NOW = 1700000000
+
+
+def make(sim, backup=None, fixAge=None):
+    import pycom
+    from gpsstart import GpsStartStrategy
+    from config import ConfigGPS
+    strategy = GpsStartStrategy()
+    if backup is not None:
+        strategy.setBackup(backup)
+    if fixAge is not None:
+        pycom.nvs_set(ConfigGPS.NVS_LAST_FIX_TIME, NOW - fixAge)
+    return strategy
+
+
+def test_cold_without_a_fix(sim):
+    from gpsstart import START_COLD
+    assert make(sim).choose(now=NOW) == START_COLD
+    assert make(sim, backup=True).choose(now=NOW) == START_COLD
+
+
+def test_hot_with_backup_and_fresh_ephemeris(sim):
+    from gpsstart import START_HOT
+    assert make(sim, backup=True, fixAge=600).choose(now=NOW) == START_HOT
+
+
+def test_warm_with_backup_and_stale_ephemeris(sim):
+    from gpsstart import START_WARM
+    assert make(sim, backup=True, fixAge=3 * 3600).choose(now=NOW) == START_WARM
+
+
+def test_cold_without_backup(sim):
+    from gpsstart import START_COLD
+    assert make(sim, backup=False, fixAge=600).choose(now=NOW) == START_COLD
+
+
+def test_cold_when_the_clock_is_behind_the_last_fix(sim):
+    from gpsstart import START_COLD
+    strategy = make(sim, backup=True, fixAge=600)
+    # rtc not set yet, counting from 1970
+    assert strategy.lastFixAge(now=60) is None
+    assert strategy.choose(now=60) == START_COLD
+
+
+def test_fallback(sim):
+    from gpsstart import GpsStartStrategy, START_HOT, START_WARM, START_COLD, START_ASSISTED
+    assert GpsStartStrategy.fallback(START_HOT) == START_WARM
+    assert GpsStartStrategy.fallback(START_WARM) == START_COLD
+    assert GpsStartStrategy.fallback(START_COLD) == START_COLD
+    assert GpsStartStrategy.fallback(START_ASSISTED) == START_COLD
+
+
+def test_record_fix_and_stats(sim):
+    from gpsstart import START_HOT, START_COLD
+    strategy = make(sim)
+    strategy.recordFix(START_COLD, 40, -33.856784, 151.215297, now=NOW)
+    strategy.recordFix(START_COLD, 50, now=NOW + 10)
+    strategy.recordFailure(START_HOT)
+    assert strategy.lastFixAge(now=NOW + 70) == 60
+    assert strategy.lastFixPosition() == (-33.856784, 151.215297)
+    stats = strategy.stats()
+    assert stats['cold'] == (2, 45, 0)
+    assert stats['hot'] == (0, None, 1)
+    assert strategy.meanTtff(START_COLD) == 45
+
+
+def test_retain_backup_only_for_short_sleeps(sim):
+    strategy = make(sim, fixAge=0)
+    # 60 - 5 s of acquisition at 25 mA against 18 mA over the sleep (the ttff estimates)
+    assert strategy.retainBackup(60, now=NOW)
+    assert not strategy.retainBackup(600, now=NOW)
+    # The ephemeris would be stale at wakeup
+    assert not make(sim, fixAge=7000).retainBackup(600, now=NOW)
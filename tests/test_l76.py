@@ -0,0 +1,131 @@
+# lib/L76GNSV4.py against the simulated L76 (sim/devices.py): epochs and
+# fixes, the PMTK request/response engine and the NVS identification cache
+# author: callen
+#
+
+from nmea import EPOCH_ALL
+
+RELEASE = 'AXN_3.8_3333_16070500,0000,Quectel-L76,1.0'
+
+
+def make(sim, **kwargs):
+    from pytrack import Pytrack
+    from L76GNSV4 import L76GNSS
+    return L76GNSS(pytrack=Pytrack(), **kwargs)
+
+
+def sent(sim, gps, header):
+    """number of times the driver wrote a $<header> sentence to the simulated chip"""
+    count = [0]
+    write = sim.gps.write
+
+    def counting(data):
+        if bytes(data).startswith(b'$' + header.encode()):
+            count[0] += 1
+        return write(data)
+
+    sim.gps.write = counting
+    return count
+
+
+# epochs and fixes
+
+def test_epoch_snapshot(sim):
+    gps = make(sim)
+    sim.clock.advance(60)
+    state = gps.read_epoch(timeout=3)
+    assert state is not None and state.complete() and state.valid
+    coordinates = gps.coordinates()
+    assert coordinates['latitude'] == state.latitude and coordinates['longitude'] == state.longitude
+
+
+def test_fixed_after_a_timed_out_fix_following_a_pmtk_exchange(sim):
+    sim.gps.sky = False
+    gps = make(sim)
+    # Standby is acked, then the chip outputs nothing
+    assert gps._pmtk_ack(161) == 3
+    assert not gps.get_fix(timeout=2)
+    assert not gps.fixed()
+
+
+def test_read_epoch_keeps_its_timeout(sim):
+    gps = make(sim)
+    # RMC only while state.want still waits for GGA, GSA and VTG
+    sim.gps.output = (0, 1, 0, 0, 0, 0)
+    start = sim.clock.now
+    assert gps.read_epoch(timeout=2.5) is None
+    assert sim.clock.now - start < 2.6
+
+
+# PMTK engine
+
+def test_pmtk_acks(sim):
+    gps = make(sim)
+    assert gps.set_fix_interval(500)
+    assert sim.gps.interval == 0.5
+    # out of range interval and unknown command
+    assert gps._pmtk_ack(220, (50,)) == 2
+    assert gps._pmtk_ack(999) == 1
+
+
+def test_pmtk_pipelined_commands_and_queries(sim):
+    gps = make(sim)
+    writes = sent(sim, gps, 'PMTK')
+    results = gps._pmtk_transact([('PMTK605', 'PMTK705'), ('PMTK220,2000', None), ('PQVERNO,R', 'PQVERNO')])
+    assert results[0]['ReleaseString'] == sim.gps.RELEASE.split(',')[0]
+    assert results[1] == 3
+    assert results[2]['ChipVersionID'] == sim.gps.CHIP_VERSION.split(',')[0]
+    assert writes[0] == 2
+
+
+def test_pmtk_resends_until_timeout(sim):
+    gps = make(sim)
+    sim.gps.RESPONSE_DELAY = 10
+    writes = sent(sim, gps, 'PMTK220')
+    assert gps._pmtk_ack(220, (1000,), timeout=1.2) is None
+    assert writes[0] == 3
+
+
+def test_configure(sim):
+    gps = make(sim)
+    assert gps.configure(periodic_mode=0, nmea_output=(0, 1, 0, 1, 0, 0), fix_interval=1000)
+    assert sim.gps.output == (0, 1, 0, 1, 0, 0)
+    state = gps.read_epoch(timeout=3)
+    assert state is not None and state.satellites is not None
+
+
+def test_configure_without_output_ack(sim):
+    gps = make(sim)
+    ack = sim.gps._ack
+    sim.gps._ack = lambda command, flag=3: None if command == 314 else ack(command, flag)
+    assert not gps.configure(nmea_output=(0, 1, 0, 1, 0, 0), timeout=1)
+    # back to the default output, the epochs complete again
+    assert gps.state.want == EPOCH_ALL
+    assert gps.read_epoch(timeout=3) is not None
+
+
+# identification cache
+
+def test_identification_is_cached(sim):
+    import pycom
+    gps = make(sim)
+    assert gps.nmea_version() == 410
+    assert pycom.nvs_get(gps.NVS_NMEA_VERSION) == 410
+    gps = make(sim)
+    queries = sent(sim, gps, 'PMTK605')
+    assert gps.nmea_version() == 410
+    assert queries[0] == 0
+
+
+def test_cold_start_checks_the_cached_release(sim):
+    make(sim).nmea_version()
+    gps = make(sim, cold_start=True)
+    queries = sent(sim, gps, 'PQVERNO')
+    assert gps.nmea_version() == 410
+    assert queries[0] == 0
+    # Other chip firmware since the cache was made
+    sim.gps.RELEASE = RELEASE
+    sim.gps.CHIP_VERSION = 'L76NNR01A01S,2016/07/05,12:00'
+    gps = make(sim, cold_start=True)
+    assert gps.nmea_version() == 301
+    assert queries[0] == 1
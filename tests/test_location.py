@@ -0,0 +1,102 @@
+# lib/location.py: version 1 payloads, version 2 batches and FixBatch on flash
+# author: callen
+#
+
+import pytest
+
+import location
+from location import FixBatch, SIZE, encode, decode, encode_batch, decode_batch, decode_any
+
+START = 1700000000
+
+
+def fix(i, **kwargs):
+    values = dict(hdop=1.2, speed=10.0 + i, heading=90.5 - i)
+    values.update(kwargs)
+    return encode(45.5 + i * 0.0003, -73.6 - i * 0.0002, START + i * 15, **values)
+
+
+def test_round_trip():
+    point = decode(encode(45.501234, -73.567891, START, hdop=1.3, speed=20.0, heading=181.25, dgps=True))
+    assert point['latitude'] == 45.501234
+    assert point['longitude'] == -73.567891
+    assert point['time'] == START
+    assert point['hdop'] == 1.3
+    assert abs(point['speed'] - 20.0 * 1.852) < 0.1
+    assert point['heading'] == 181.25
+    assert point['valid'] and point['dgps']
+
+
+def test_round_trip_unknown_values():
+    point = decode(encode(-33.9, 151.2, START, valid=False))
+    assert point['hdop'] is None and point['speed'] is None and point['heading'] is None
+    assert not point['valid']
+
+
+def test_encode_into_buffer():
+    buf = bytearray(SIZE)
+    assert encode(1.0, 2.0, START, buf=buf) is buf
+    assert bytes(buf) == encode(1.0, 2.0, START)
+
+
+def test_decode_rejects_bad_payloads():
+    with pytest.raises(ValueError):
+        decode(b'\x09' + bytes(SIZE - 1))
+    with pytest.raises(ValueError):
+        decode(encode(1.0, 2.0, START)[:-1])
+
+
+def test_batch_round_trip():
+    fixes = [fix(i) for i in range(10)] + [fix(10, valid=False, speed=None, heading=None)]
+    payload = encode_batch(fixes)
+    assert len(payload) < SIZE * len(fixes)
+    assert decode_batch(payload) == [decode(f) for f in fixes]
+    assert decode_any(payload) == decode_batch(payload)
+
+
+def test_batch_large_and_negative_deltas():
+    fixes = [encode(-89.9, 179.9, START), encode(89.9, -179.9, 0), encode(0.0, 0.0, START + 10 ** 6)]
+    assert decode_batch(encode_batch(fixes)) == [decode(f) for f in fixes]
+
+
+def test_batch_cut_short():
+    payload = encode_batch([fix(i) for i in range(3)])
+    with pytest.raises(ValueError):
+        decode_batch(payload[:-1])
+
+
+def test_zigzag_varint_round_trip():
+    for value in (0, 1, -1, 63, -64, 64, 2 ** 31 - 1, -2 ** 31):
+        buf = bytearray()
+        location._add_varint(buf, location._zigzag(value))
+        decoded, end = location._varint(buf, 0)
+        assert location._unzigzag(decoded) == value
+        assert end == len(buf)
+
+
+def test_fix_batch(tmp_path):
+    batch = FixBatch(str(tmp_path / 'batch.bin'), 3, 600)
+    assert batch.payload() is None and not batch.due()
+    batch.add(fix(0))
+    batch.add(fix(1))
+    assert not batch.due()
+    assert batch.due(now=START + 600)
+    batch.add(fix(2))
+    assert batch.due()
+    assert decode_batch(batch.payload()) == [decode(fix(i)) for i in range(3)]
+    batch.clear()
+    assert batch.fixes() == []
+
+
+def test_fix_batch_torn_record(tmp_path):
+    path = str(tmp_path / 'batch.bin')
+    batch = FixBatch(path, 10, 600)
+    batch.add(fix(0))
+    # Reset in the middle of the next append
+    with open(path, 'ab') as f:
+        f.write(fix(1)[:7])
+    assert batch.fixes() == [fix(0)]
+    batch.add(fix(2))
+    batch.add(fix(3))
+    assert batch.fixes() == [fix(0), fix(2), fix(3)]
+    assert decode_batch(batch.payload()) == [decode(fix(i)) for i in (0, 2, 3)]
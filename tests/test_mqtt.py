@@ -0,0 +1,78 @@
+# lib/mqtt.py against the simulated broker (sim/broker.py): the in-flight
+# window of QoS 1/2 publishes and their resend after a reconnect
+# author: callen
+#
+
+TOPIC = '/motorcycle/location'
+
+
+def make(window):
+    from mqtt import MQTTClient
+    from config import ConfigMqtt
+    client = MQTTClient('tracker', ConfigMqtt.SERVER, port=ConfigMqtt.PORT, max_inflight=window)
+    client.set_callback(lambda topic, msg: None)
+    client.connect(clean_session=False)
+    return client
+
+
+def payloads(sim):
+    return [bytes(m.payload) for m in sim.broker.published(TOPIC)]
+
+
+def test_window_does_not_wait_for_acks(online):
+    client = make(4)
+    start = online.clock.now
+    for i in range(3):
+        client.publish(TOPIC, 'm{}'.format(i), qos=1)
+    # Nothing acknowledged yet, no round trip waited for
+    assert len(client.inflight) == 3
+    assert online.clock.now - start < online.net.rtt
+    client.flush()
+    assert client.inflight == []
+    assert payloads(online) == [b'm0', b'm1', b'm2']
+
+
+def test_full_window_waits(online):
+    client = make(2)
+    for i in range(5):
+        client.publish(TOPIC, 'm{}'.format(i), qos=1)
+        assert len(client.inflight) < 2
+    client.flush()
+    assert payloads(online) == ['m{}'.format(i).encode() for i in range(5)]
+
+
+def test_packet_ids_skip_the_ones_in_flight(online):
+    client = make(8)
+    client.pid = 65534
+    pids = [client.publish(TOPIC, 'm', qos=1) for _ in range(3)]
+    assert pids == [65535, 1, 2]
+    client.pid = 0
+    assert client.publish(TOPIC, 'm', qos=1) == 3
+
+
+def test_resend_with_dup_after_reconnect(online):
+    client = make(8)
+    # The broker stops answering, the publishes stay in flight
+    online.broker.silent = True
+    client.publish(TOPIC, 'lost', qos=1)
+    client.publish(TOPIC, 'lost2', qos=2)
+    assert len(client.inflight) == 2
+    online.broker.silent = False
+    online.broker.drop_connections()
+    client.connect(clean_session=False)
+    client.flush()
+    messages = online.broker.published(TOPIC)
+    assert [(bytes(m.payload), m.qos, m.dup) for m in messages] == [(b'lost', 1, True), (b'lost2', 2, True)]
+
+
+def test_qos2_release_is_resent(online):
+    client = make(8)
+    client.publish(TOPIC, 'once', qos=2)
+    entry = client.inflight[0]
+    # PUBREC came in, the PUBCOMP did not before the connection was lost
+    while not entry[5]:
+        client.wait_msg()
+    online.broker.drop_connections()
+    client.connect(clean_session=False)
+    client.flush()
+    assert payloads(online) == [b'once']
@@ -0,0 +1,52 @@
+# lib/mqttasync.py against the simulated broker (sim/broker.py)
+# author: callen
+#
+
+TOPIC = '/motorcycle/tracking'
+
+
+def run(session, client_id='tracker'):
+    import uasyncio as asyncio
+    from mqttasync import MQTTClientAsync
+    from config import ConfigMqtt
+
+    async def main():
+        client = MQTTClientAsync(client_id, ConfigMqtt.SERVER, port=ConfigMqtt.PORT, user='usér',
+                                 password='pässword')
+        await session(client)
+        await client.disconnect()
+
+    asyncio.run(main())
+
+
+def test_connect_with_non_ascii_fields(online):
+    async def session(client):
+        client.set_callback(lambda topic, msg: None)
+        await client.connect()
+        await client.subscribe(TOPIC)
+
+    run(session, client_id='tracker-é')
+    assert TOPIC in online.broker.sessions['tracker-é'].subscriptions
+
+
+def test_ack_before_callback(online):
+    import uasyncio as asyncio
+    events = []
+
+    async def session(client):
+        ack = client._ack
+
+        async def recording(kind, pid):
+            events.append(kind)
+            await ack(kind, pid)
+
+        client._ack = recording
+        client.set_callback(lambda topic, msg: events.append(bytes(msg)))
+        await client.connect()
+        await client.subscribe(TOPIC, qos=1)
+        online.broker.publish(TOPIC, b'off', qos=1)
+        await asyncio.sleep(1)
+
+    run(session)
+    assert events == [0x40, b'off']
+    assert not online.broker.sessions['tracker'].unacked
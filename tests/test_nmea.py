@@ -0,0 +1,108 @@
+# lib/nmea.py: the tokenizer (NMEAStream) and the epoch snapshot (FixState)
+# author: callen
+#
+
+from nmea import NMEAStream, FixState, parse, EPOCH_RMC, EPOCH_GGA
+
+RMC = 'GNRMC,123519.000,A,4807.0380,N,01131.0000,E,10.5,84.4,230394,,,A'
+GGA = 'GNGGA,123519.000,4807.0380,N,01131.0000,E,1,08,0.9,545.4,M,46.9,M,,'
+GSA = 'GNGSA,A,3,04,05,09,12,24,,,,,,,,2.5,1.3,2.1'
+
+
+def sentence(body):
+    cs = 0
+    for c in body.encode():
+        cs ^= c
+    return '${}*{:02X}\r\n'.format(body, cs).encode()
+
+
+def sentences(stream):
+    found = []
+    while True:
+        body = stream.next_sentence()
+        if body is None:
+            return found
+        found.append(bytes(body).decode())
+
+
+def test_stream_returns_bodies():
+    stream = NMEAStream()
+    stream.feed(sentence(RMC) + sentence(GGA))
+    assert sentences(stream) == [RMC, GGA]
+    assert stream.sentences == 2
+
+
+def test_stream_keeps_partial_sentence_between_reads():
+    stream = NMEAStream()
+    data = sentence(RMC)
+    stream.feed(data[:20])
+    assert sentences(stream) == []
+    stream.feed(data[20:])
+    assert sentences(stream) == [RMC]
+
+
+def test_stream_drops_bad_checksum():
+    stream = NMEAStream()
+    bad = bytearray(sentence(RMC))
+    bad[-4:-2] = b'00' if bad[-4:-2] != b'00' else b'11'
+    stream.feed(bytes(bad) + sentence(GGA))
+    assert sentences(stream) == [GGA]
+    assert stream.bad_checksum == 1
+
+
+def test_stream_restarts_at_truncated_sentence():
+    stream = NMEAStream()
+    stream.feed(sentence(RMC)[:30] + sentence(GGA))
+    assert sentences(stream) == [GGA]
+
+
+def test_stream_compacts_across_buffer_end():
+    stream = NMEAStream(size=128)
+    data = sentence(GGA) * 8
+    for i in range(0, len(data), 50):
+        stream.feed(data[i:i + 50])
+        found = sentences(stream)
+        assert all(body == GGA for body in found)
+    assert stream.sentences == 8
+
+
+def test_parse_fix():
+    fix = parse(RMC)
+    assert fix.kind == 'RMC'
+    assert fix.valid
+    assert abs(fix.latitude - 48.1173) < 1e-6
+    assert abs(fix.longitude - 11.516666) < 1e-6
+    assert fix.utc == 123519
+    assert fix.date == 230394
+    assert fix.speed == 10.5
+
+
+def test_fix_state_merges_epoch():
+    state = FixState(want=EPOCH_RMC | EPOCH_GGA)
+    assert not state.update(parse(RMC))
+    assert state.update(parse(GGA))
+    assert state.valid
+    assert state.speed == 10.5
+    assert state.hdop == 0.9
+    assert state.satellites == 8
+    assert state.altitude == 545.4
+
+
+def test_fix_state_gsa_hdop_only_without_gga():
+    state = FixState()
+    state.update(parse(RMC))
+    state.update(parse(GSA))
+    assert state.hdop == 1.3
+    state.update(parse(GGA))
+    assert state.hdop == 0.9
+
+
+def test_fix_state_resets_on_new_epoch():
+    state = FixState(want=EPOCH_RMC | EPOCH_GGA)
+    state.update(parse(RMC))
+    state.update(parse(GGA))
+    later = parse('GNRMC,123520.000,V,,,,,,,230394,,,N')
+    assert not state.update(later)
+    assert state.utc == 123520
+    assert state.satellites is None
+    assert not state.valid
@@ -0,0 +1,123 @@
+# lib/outbox.py: append, acknowledge (commit) and evict, on the simulator's
+# NVS and /flash, including a reset in the middle of an eviction
+# author: callen
+#
+
+import os
+
+PATH = '/flash/outbox.bin'
+
+
+def make(sim, **kwargs):
+    from outbox import Outbox
+    options = dict(path=PATH, maxBytes=300, batchBytes=64)
+    options.update(kwargs)
+    return Outbox(**options)
+
+
+def messages(outbox):
+    return [msg for end, topic, msg, retain in outbox.batch()]
+
+
+def drain(outbox):
+    found = []
+    while not outbox.isEmpty():
+        records = outbox.batch()
+        found += [msg for end, topic, msg, retain in records]
+        if records:
+            outbox.commit(records[-1][0])
+    return found
+
+
+def test_append_and_replay(sim):
+    outbox = make(sim)
+    assert outbox.isEmpty()
+    outbox.append('gps', b'one')
+    outbox.append('gps', 'two', retain=True)
+    records = outbox.batch()
+    assert [(topic, msg, retain) for end, topic, msg, retain in records] == \
+        [(b'gps', b'one', False), (b'gps', b'two', True)]
+
+
+def test_commit_survives_a_restart(sim):
+    outbox = make(sim)
+    for i in range(3):
+        outbox.append('t', 'm{}'.format(i))
+    outbox.commit(outbox.batch()[0][0])
+    assert messages(make(sim)) == [b'm1', b'm2']
+    outbox.commit(outbox.batch()[-1][0])
+    assert make(sim).isEmpty()
+    assert not os.path.exists(PATH)
+
+
+def test_torn_append_is_skipped(sim):
+    outbox = make(sim)
+    outbox.append('t', 'm0')
+    with open(PATH, 'ab') as f:
+        f.write(b'\xa5\x00\x01\x10')
+    outbox = make(sim)
+    outbox.append('t', 'm1')
+    assert drain(outbox) == [b'm0', b'm1']
+
+
+def test_evict_drops_sent_and_oldest(sim):
+    outbox = make(sim)
+    for i in range(40):
+        outbox.append('t', 'm{:02d}'.format(i))
+        assert outbox.size <= outbox.maxBytes
+    left = drain(outbox)
+    assert left[-1] == b'm39'
+    assert left == ['m{:02d}'.format(i).encode() for i in range(40 - len(left), 40)]
+
+
+def evict_until_swap(sim, outbox, stop):
+    '''
+    Fills the outbox until it evicts, with a reset (SimReset) right before the os.<stop> of the queue
+    file swap (remove of the queue, rename of the .tmp). Returns the messages appended before it
+    '''
+    from sim import SimReset
+
+    real = getattr(os, stop)
+    swapped = PATH if stop == 'remove' else PATH + '.tmp'
+
+    def reset(*args):
+        if args[0] == swapped:
+            raise SimReset()
+        return real(*args)
+
+    appended = []
+    setattr(os, stop, reset)
+    try:
+        for i in range(100):
+            msg = 'm{:02d}'.format(i).encode()
+            outbox.append('t', msg)
+            appended.append(msg)
+    except SimReset:
+        pass
+    finally:
+        setattr(os, stop, real)
+    return appended
+
+
+def test_reset_before_the_swap(sim):
+    outbox = make(sim)
+    outbox.append('t', 'sent')
+    outbox.commit(outbox.batch()[0][0])
+    appended = evict_until_swap(sim, outbox, 'remove')
+    assert os.path.exists(PATH + '.tmp')
+    outbox = make(sim)
+    assert not os.path.exists(PATH + '.tmp')
+    # Nothing lost, the records already sent may go out again
+    left = drain(outbox)
+    assert [msg for msg in left if msg != b'sent'] == appended
+
+
+def test_reset_in_the_middle_of_the_swap(sim):
+    outbox = make(sim)
+    appended = evict_until_swap(sim, outbox, 'rename')
+    assert not os.path.exists(PATH) and os.path.exists(PATH + '.tmp')
+    outbox = make(sim)
+    assert os.path.exists(PATH) and not os.path.exists(PATH + '.tmp')
+    left = drain(outbox)
+    assert left and left[-1] == appended[-1]
+    assert left == appended[len(appended) - len(left):]
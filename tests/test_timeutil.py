@@ -0,0 +1,14 @@
+# lib/timeutil.py
+# author: callen
+#
+
+import datetime
+
+from timeutil import days_from_civil
+
+
+def test_days_from_civil():
+    epoch = datetime.date(1970, 1, 1)
+    for date in (epoch, datetime.date(1980, 1, 6), datetime.date(2000, 2, 29), datetime.date(2024, 3, 1),
+                 datetime.date(2100, 12, 31), datetime.date(1969, 12, 31)):
+        assert days_from_civil(date.year, date.month, date.day) == (date - epoch).days
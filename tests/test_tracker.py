@@ -0,0 +1,74 @@
+# main.py on the simulator (whole wake cycles): the EPO assistance of cold starts
+# and the persistent mqtt session
+# author: callen
+#
+
+from sim import Simulator
+
+CLIENT_ID = 'ChrisGpyMTrack001'
+TOPIC_EPO_REQUEST = '/motorcycle/epo/request'
+TOPIC_LOCATION = '/motorcycle/location'
+TOPIC_TRACKING_STATE = '/motorcycle/monitorState'
+
+
+def test_epo_download_does_not_hold_the_fix():
+    sim = Simulator()
+    sim.run(wakes=1)
+    requests = sim.broker.published(TOPIC_EPO_REQUEST)
+    locations = sim.broker.published(TOPIC_LOCATION)
+    assert len(requests) == 1 and locations
+    # No file comes in, the location goes out once the gps fixed on its own (45 s cold start)
+    assert locations[0].time < requests[0].time + 45
+    assert 'eporetry' not in sim.nvs
+
+
+def test_failed_epo_download_backs_off():
+    sim = Simulator(sky=False)
+    sim.run(wakes=2)
+    requests = sim.broker.published(TOPIC_EPO_REQUEST)
+    assert len(requests) == 1
+    assert sim.nvs['eporetry'] >= sim.clock.start + 6 * 3600
+
+
+def subscribes(sim):
+    """counts the subscribes to TOPIC_TRACKING_STATE the broker gets"""
+    count = [0]
+    subscribe = sim.broker._subscribe
+
+    def counting(connection, body):
+        if TOPIC_TRACKING_STATE.encode() in body:
+            count[0] += 1
+        subscribe(connection, body)
+
+    sim.broker._subscribe = counting
+    return count
+
+
+def test_persistent_session_subscribes_once():
+    sim = Simulator()
+    count = subscribes(sim)
+    sim.run(wakes=3)
+    assert count[0] == 1
+    assert TOPIC_TRACKING_STATE in sim.broker.sessions[CLIENT_ID].subscriptions
+
+
+def test_lost_session_subscribes_again():
+    sim = Simulator()
+    count = subscribes(sim)
+    sim.run(wakes=2)
+    # The broker restarted without its sessions
+    sim.broker.sessions.clear()
+    sim.run(wakes=2)
+    assert count[0] == 2
+    assert TOPIC_TRACKING_STATE in sim.broker.sessions[CLIENT_ID].subscriptions
+
+
+def test_command_queued_while_asleep():
+    sim = Simulator()
+    sim.run(wakes=1)
+    # Sent while the tracker sleeps, delivered right after its next connect
+    sim.broker.publish(TOPIC_TRACKING_STATE, 'OFF', qos=1)
+    sim.run(wakes=1)
+    assert not sim.broker.sessions[CLIENT_ID].queue
+    assert not sim.broker.sessions[CLIENT_ID].unacked
+    assert 'trackingoff' in sim.nvs
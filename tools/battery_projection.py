@@ -0,0 +1,139 @@
+# Host side battery life projection, from the energy accounting of the tracker
+# (lib/energy.py) running on the simulator (sim package). Runs main.py for a
+# number of simulated days with the given rides and config.py overrides (the
+# policy to evaluate, e.g. --set ConfigGPS.SLEEP_BETWEEN_READS=120), then
+# reports the charge per activity and per kind of wakeup (the awake time and
+# the sleep after it) and the days a battery would last.
+# --mix projects the same charge per wakeup for another mix of wakeups a day
+# usage: python tools/battery_projection.py [--days N] [--motion START:END ...] [--set KEY=VALUE ...]
+#            [--battery MAH] [--mix KIND:PER_DAY ...]
+# author: callen
+#
+
+import argparse
+import ast
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sim import Simulator  # noqa: E402
+
+DAY = 86400
+# ConfigEnergy.NVS_PREFIX, the totals are in 0.01 uAh
+NVS_PREFIX = 'energy'
+ACTIVITIES = (('c', 'cpu'), ('w', 'wifi'), ('l', 'lte'), ('g', 'gps'), ('b', 'ble'), ('s', 'sleep'))
+UNITS_PER_MAH = 100000
+# ConfigGPS.NVS_SLEEP_CONTINUE_GPS_READ, set when the next wakeup continues tracking
+NVS_CONTINUE_GPS = 'sleepgpsread'
+WAKE_REASON_ACCELEROMETER = 1
+KINDS = ('timer', 'accelerometer', 'continue gps')
+
+
+def _window(text):
+    start, end = text.split(':')
+    return (float(start), float(end))
+
+
+def _setting(text):
+    key, value = text.split('=', 1)
+    try:
+        return key, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return key, value
+
+
+def _mix(text):
+    kind, per_day = text.rsplit(':', 1)
+    if kind not in KINDS:
+        raise argparse.ArgumentTypeError('kind of wakeup is one of {}'.format(', '.join(KINDS)))
+    return kind, float(per_day)
+
+
+def charges(nvs):
+    return {name: nvs.get(NVS_PREFIX + letter, 0) / UNITS_PER_MAH for letter, name in ACTIVITIES}
+
+
+def kind(record, previous):
+    """kind of wakeup, as Tracker.getWakeReason tells them apart"""
+    if previous is not None and NVS_CONTINUE_GPS in previous.nvs:
+        return 'continue gps'
+    if record.reason == WAKE_REASON_ACCELEROMETER:
+        return 'accelerometer'
+    return 'timer'
+
+
+def simulate(days, motion, config):
+    sim = Simulator(motion=motion, config=config)
+    with contextlib.redirect_stdout(io.StringIO()):
+        records = sim.run(wakes=10 ** 7, until=days * DAY)
+    return sim, records
+
+
+def per_wake(records):
+    '''
+    {kind: [mAh of every wakeup of that kind]}: what the wakeup drew awake, and its sleep (charged
+    by the next wakeup). The first wakeup (power on) is left out
+    '''
+    result = {}
+    for i in range(1, len(records) - 1):
+        before = charges(records[i - 1].nvs)
+        after = charges(records[i].nvs)
+        awake = sum(after[name] - before[name] for name in after if name != 'sleep')
+        sleep = charges(records[i + 1].nvs)['sleep'] - after['sleep']
+        result.setdefault(kind(records[i], records[i - 1]), []).append(awake + sleep)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Battery life of the tracker projected on the simulator')
+    parser.add_argument('--days', type=float, default=1, help='simulated days')
+    parser.add_argument('--motion', type=_window, action='append', default=[],
+                        help='simulated seconds START:END the bike moves (repeatable)')
+    parser.add_argument('--set', type=_setting, action='append', default=[], metavar='KEY=VALUE',
+                        help='config.py override, e.g. ConfigGPS.SLEEP_BETWEEN_READS=120 (repeatable)')
+    parser.add_argument('--battery', type=float, default=2000, help='battery capacity in mAh (ConfigEnergy.BATTERY_MAH)')
+    parser.add_argument('--mix', type=_mix, action='append', default=[], metavar='KIND:PER_DAY',
+                        help='wakeups a day of a kind ({}) to project for (repeatable)'.format(', '.join(KINDS)))
+    args = parser.parse_args()
+
+    sim, records = simulate(args.days, args.motion, dict(args.set))
+    elapsed = sim.clock.now / DAY
+    totals = charges(records[-1].nvs)
+    total = sum(totals.values())
+    print("{:.2f} simulated days, {} wakeups, {:.1f} mAh".format(elapsed, len(records), total))
+    print("{:<14} {:>10} {:>7}".format('activity', 'mAh/day', 'share'))
+    for name, mAh in totals.items():
+        print("{:<14} {:10.2f} {:6.1f}%".format(name, mAh / elapsed, 100 * mAh / total if total else 0))
+
+    wakes = per_wake(records)
+    print()
+    print("{:<14} {:>10} {:>10} {:>10}".format('wakeup', 'per day', 'mAh each', 'mAh/day'))
+    for name in KINDS:
+        values = wakes.get(name, [])
+        if values:
+            mean = sum(values) / len(values)
+            print("{:<14} {:10.1f} {:10.4f} {:10.2f}".format(name, len(values) / elapsed, mean,
+                                                             len(values) / elapsed * mean))
+    perDay = total / elapsed
+    print()
+    print("{:.0f} mAh battery: {:.1f} days at {:.2f} mAh/day".format(args.battery, args.battery / perDay, perDay))
+
+    if args.mix:
+        perDay = 0
+        for name, count in args.mix:
+            values = wakes.get(name)
+            if not values:
+                print("no {} wakeups in the simulation to project from".format(name))
+                return
+            perDay += count * sum(values) / len(values)
+        print("mix {}: {:.1f} days at {:.2f} mAh/day".format(
+            ', '.join('{} {:g}/day'.format(name, count) for name, count in args.mix),
+            args.battery / perDay, perDay))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Host side report of the wake cycle phase timings the tracker uploads on
+# ConfigMqtt.TOPIC_TELEMETRY (lib/profiler.py): percentiles of the seconds
+# spent in every phase, and the share of the time awake, over all the
+# wakeups of the messages. "other" is the time awake outside of any phase.
+# Reads payload files (raw bytes, or one hex encoded payload per line as
+# `mosquitto_sub -t /motorcycle/telemetry -F %x` prints them), or runs the
+# simulator (sim package) and reports the messages its broker got
+# usage: python tools/profile_report.py [--by-reason] FILE ...
+#        python tools/profile_report.py [--by-reason] --sim WAKES [--motion START:END ...]
+# author: callen
+#
+
+import argparse
+import binascii
+import contextlib
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib import profiler  # noqa: E402
+
+TOPIC = '/motorcycle/telemetry'
+OTHER = 'other'
+PERCENTILES = (50, 90, 99)
+
+
+def _window(text):
+    start, end = text.split(':')
+    return (float(start), float(end))
+
+
+def read_payloads(path):
+    """payloads of a file: hex lines if it is all hex text, one raw payload otherwise"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        lines = [line.strip() for line in data.decode('ascii').splitlines() if line.strip()]
+        return [binascii.unhexlify(line) for line in lines]
+    except (UnicodeDecodeError, binascii.Error, ValueError):
+        return [data]
+
+
+def sim_payloads(wakes, motion):
+    from sim import Simulator
+    sim = Simulator(motion=motion)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.run(wakes=wakes)
+    return [m.payload for m in sim.broker.messages if m.topic == TOPIC]
+
+
+def percentile(values, p):
+    """nearest rank percentile of sorted values"""
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def report(records, title):
+    awake = [times['awake'] for _, times in records]
+    total = sum(awake)
+    phases = [name for name in profiler.PHASE_NAMES if name != 'awake'] + [OTHER]
+    columns = {name: [times.get(name, 0) for _, times in records] for name in phases}
+    columns[OTHER] = [max(a - sum(t for name, t in times.items() if name != 'awake'), 0)
+                      for a, (_, times) in zip(awake, records)]
+    print("{}: {} wakeups, {:.1f} s awake".format(title, len(records), total))
+    print("{:<13} {:>8} {:>8} {:>8} {:>8} {:>8} {:>7}".format(
+        'phase', *['p{}'.format(p) for p in PERCENTILES], 'max', 'mean', 'share'))
+    for name in phases + ['awake']:
+        values = sorted(columns[name] if name in columns else awake)
+        share = 100 * sum(values) / total if total else 0
+        print("{:<13} {:8.2f} {:8.2f} {:8.2f} {:8.2f} {:8.2f} {:6.1f}%".format(
+            name, *[percentile(values, p) for p in PERCENTILES], values[-1], sum(values) / len(values), share))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Percentiles of the tracker wake cycle phase timings')
+    parser.add_argument('files', nargs='*', help='telemetry payloads, raw or hex lines')
+    parser.add_argument('--sim', type=int, metavar='WAKES', help='run the simulator for WAKES wake cycles instead')
+    parser.add_argument('--motion', type=_window, action='append', default=[],
+                        help='with --sim, simulated seconds START:END the bike moves (repeatable)')
+    parser.add_argument('--by-reason', action='store_true', help='one table per wake reason as well')
+    args = parser.parse_args()
+
+    if args.sim:
+        payloads = sim_payloads(args.sim, args.motion)
+    elif args.files:
+        payloads = [payload for path in args.files for payload in read_payloads(path)]
+    else:
+        parser.error('give payload files or --sim WAKES')
+    records = []
+    for payload in payloads:
+        try:
+            records.extend(profiler.decode(payload))
+        except ValueError as e:
+            print("skipping a payload: {}".format(e))
+    if not records:
+        print("no wakeups recorded")
+        return
+
+    report(records, 'all')
+    if args.by_reason:
+        for reason in sorted(set(reason for reason, _ in records)):
+            print()
+            report([r for r in records if r[0] == reason], 'wake reason {}'.format(reason))
+
+
+if __name__ == '__main__':
+    main()